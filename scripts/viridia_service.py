@@ -6,22 +6,18 @@ Viridia top level service script
 import grp
 import os
 import pwd
-from signal import signal, SIGINT, SIGTERM
+from StringIO import StringIO
+from signal import signal, SIGINT, SIGTERM, SIGUSR1
 from sys import exit
-from time import sleep
 
-from approxeng.holochassis.chassis import get_regular_triangular_chassis
 from approxeng.input.asyncorebinder import ControllerResource
 from approxeng.input.dualshock4 import DualShock4, CONTROLLER_NAME
 from approxeng.pi2arduino import I2CHelper
-from approxeng.viridia.display import PrintDisplay
-from approxeng.viridia.feather import Feather
-from approxeng.viridia.motors import Motors
-from approxeng.viridia.task import TaskManager
-from approxeng.viridia.tasks.calibration import LinearCalibrationTask, AngularCalibrationTask
-from approxeng.viridia.tasks.camera import LineFollowerTask
+from approxeng.viridia.devices import ControllerMonitor
+from approxeng.viridia.profiling import TickProfiler
+from approxeng.viridia.system import ViridiaSystem
 from approxeng.viridia.tasks.main_menu import MenuTask
-from approxeng.viridia.tasks.manual_control import ManualMotionTask
+from approxeng.viridia.tasks.registry import built_in_tasks
 
 
 def drop_privileges(uid_name='nobody', gid_name='nogroup'):
@@ -54,58 +50,86 @@ def get_shutdown_handler(message=None):
 
     def handler(signum, frame):
         display.show('Service shutdown', message)
-        motors.disable()
+        controller.stop()
+        system.close()
         exit(0)
 
     return handler
 
 
+def profile_dump_handler(signum, frame):
+    """
+    Dump the task loop latency histograms and I2C write statistics to stdout, send SIGUSR1 to the service to trigger
+    this
+    """
+    # Signal handlers run on the task loop's thread, so this goes through the display's output sink like everything else
+    dump = StringIO()
+    profiler.dump(dump)
+    display.log('profile', '{}{}\n{}\n{}\n{}', dump.getvalue(), str(system.registers), str(system.bus.statistics()),
+                str(system.watchdog), str(display.sink))
+
+
 signal(SIGINT, get_shutdown_handler('SIGINT received'))
 signal(SIGTERM, get_shutdown_handler('SIGTERM received'))
+signal(SIGUSR1, profile_dump_handler)
+
+# Profiler used to time each phase of the task loop, including I2C traffic
+profiler = TickProfiler()
 
 # I2CHelper used to communicate with I2C peripherals. Note that we must be root at this point, but can then
 # drop root access and change to a regular user for better sanity - the initialisation of this class performs
 # the memory mapping operation which requires root, but actually accessing that mapped memory can be done
 # as a regular user.
-i2c = I2CHelper()
+raw_i2c = I2CHelper()
 # Become 'pi'
 drop_privileges(uid_name='pi', gid_name='pi')
 
-# Set up a display class, either interfacing to an actual display or printing to the console
-display = PrintDisplay()
-
-# Motors
-motors = Motors(i2c=i2c)
-
-while 1:
-    try:
-        # Attempt to acquire and bind to a controller
-        with ControllerResource(controller=DualShock4(), device_name=CONTROLLER_NAME) as joystick:
-            display.show("Found dualshock4 at {}".format(joystick))
-            # Create a task manager
-            task_manager = TaskManager(
-                # Chassis, configure for robot dimensions
-                chassis=get_regular_triangular_chassis(
-                    wheel_distance=204,
-                    wheel_radius=29.5,
-                    max_rotations_per_second=500 / 60),
-                # Joystick bound by resource context
-                joystick=joystick,
-                # I2CHelper instance
-                i2c=i2c,
-                # Motors instance used to control the motors and read wheel positions
-                motors=motors,
-                # Feather, used to control lights and kicker solenoid
-                feather=Feather(i2c=i2c),
-                # Display, used to print messages either to hardware or to stdout
-                display=display
-            )
-            # Start the task manager with a MenuTask, this in turn allows for other tasks to be
-            # launched; pressing the home button will reset the task to whatever's passed to the
-            # initial_task argument here, so in this case will return to the top level menu.
-            task_manager.run(initial_task=MenuTask(
-                tasks=[ManualMotionTask(), LinearCalibrationTask(), AngularCalibrationTask(), LineFollowerTask()]))
-    except IOError:
-        # There wasn't a controller, wait for a bit and try again
-        display.show("Waiting for joystick")
-        sleep(0.3)
+# Per-tick telemetry log, only recorded if VIRIDIA_TELEMETRY is set to the path of the log file to write
+recorder = None
+if 'VIRIDIA_TELEMETRY' in os.environ:
+    from approxeng.viridia.telemetry import TelemetryRecorder
+
+    recorder = TelemetryRecorder(path=os.environ['VIRIDIA_TELEMETRY'])
+
+# Live telemetry stream for local dashboards, only published if VIRIDIA_PUBLISH is set, either to a UDP port number on
+# localhost or to the path of a unix domain socket
+publisher = None
+if 'VIRIDIA_PUBLISH' in os.environ:
+    from approxeng.viridia.telemetry import TelemetryPublisher
+
+    publish_address = os.environ['VIRIDIA_PUBLISH']
+    if publish_address.isdigit():
+        publish_address = ('127.0.0.1', int(publish_address))
+    publisher = TelemetryPublisher(address=publish_address).start()
+
+# Everything between the I2C bus and the task loop, built the same way as in the simulated benchmarks:
+# - All I2C traffic goes through a bus scheduler, so motor setpoints take priority over odometry reads, which in turn
+#   take priority over lighting. Lighting traffic is held back to the next tick once 10ms of bus time has been used.
+# - Shadow copies of the state written to the motors and feather are used to avoid sending writes which wouldn't change
+#   anything. Values are re-sent every second regardless, in case a device has been reset.
+# - Console output is written from a background thread, so the task loop never waits on a slow stdout, and the feather
+#   sends lighting commands from its own thread.
+# - The task loop runs as a coroutine at 50 ticks per second, sharing its thread with the odometry service which
+#   samples the wheel angles for dead reckoning, and coroutine tasks such as the line follower wait for the camera
+#   without holding up the loop. It starts without a joystick, and holds the motors at zero speed whenever there isn't
+#   one, so the active task survives the controller disconnecting.
+# - A watchdog disables the motors from its own thread if any tick of the task loop takes more than 100ms, other than
+#   while a task is starting, and records the task and phase responsible. The motors are disabled by writing straight
+#   to the raw I2C helper, bypassing the bus scheduler's queue and the shadow registers, while holding the bus so the
+#   write can't overlap a transaction in progress, unless that's hung.
+system = ViridiaSystem(i2c=raw_i2c, profiler=profiler, tick_rate=50, recorder=recorder, publisher=publisher)
+display = system.display
+task_manager = system.task_manager
+
+# Bind the controller as soon as it appears in /dev/input and hand it to the task manager, releasing it again when it
+# disappears. This is driven by inotify, so reconnection takes milliseconds rather than waiting for a poll.
+controller = ControllerMonitor(task_manager=task_manager, display=display,
+                               resource_factory=lambda: ControllerResource(controller=DualShock4(),
+                                                                           device_name=CONTROLLER_NAME))
+controller.start()
+
+# Start the task manager with a MenuTask, this in turn allows for other tasks to be launched; pressing the home button
+# will reset the task to whatever's passed to the initial_task argument here, so in this case will return to the top
+# level menu. Tasks are only imported when they're first highlighted, so the camera libraries aren't loaded unless we
+# need them.
+task_manager.run(initial_task=MenuTask(tasks=built_in_tasks()))
@@ -1,8 +1,9 @@
 import fcntl
 import socket
 import struct
+from collections import OrderedDict
 from pkgutil import extend_path
-from time import time, sleep as time_sleep
+from approxeng.viridia.clock import SYSTEM_CLOCK
 
 __path__ = extend_path(__path__, __name__)
 
@@ -18,57 +19,160 @@ class IntervalCheck:
     polling loop such as the task manager, but where the hardware itself cannot usefully be written or read at that
     high rate.
 
+    Runs are scheduled against fixed deadlines, each one interval after the last, rather than from whenever the code
+    happened to run, so the rate doesn't drift when polled from a loop whose ticks don't line up with the interval. If
+    a deadline is missed by more than a whole interval the schedule restarts from now rather than running repeatedly
+    to catch up. Tasks should pass the context's timestamp to should_run, so the check uses the same time as the rest
+    of the tick and follows the task manager's clock.
+
     Instances of this class can also be used in 'with' clauses, i.e. 'with interval:' - this will sleep if required
-    before running the gated code, then set the last run time to be the current time. This is not quite the same as
-    just calling sleep() before running a code block, as it resets the time after the code has run, instead of after
-    the sleep call has completed. Used in this mode therefore the interval is from the end of one code block to the
-    start of the next, whereas normally it is from the start of one code block to the start of the next.
+    before running the gated code, then set the next deadline to be one interval from the current time. This is not
+    quite the same as just calling sleep() before running a code block, as it resets the time after the code has run,
+    instead of after the sleep call has completed. Used in this mode therefore the interval is from the end of one
+    code block to the start of the next, whereas normally it is from the start of one code block to the start of the
+    next.
     """
 
-    def __init__(self, interval):
+    def __init__(self, interval, clock=None):
         """
         Constructor
 
         :param float interval:
             The number of seconds that must pass between True values from the should_run() function
+        :param clock:
+            Optional, the clock to read when no time is passed to should_run, and to sleep on. Defaults to None for
+            :data:`approxeng.viridia.clock.SYSTEM_CLOCK`
         """
         self.interval = interval
-        self.last_time = None
+        self.clock = clock if clock is not None else SYSTEM_CLOCK
+        self.next_time = None
+
+    def _advance(self, now):
+        self.next_time += self.interval
+        if self.next_time <= now:
+            self.next_time = now + self.interval
 
-    def should_run(self):
+    def should_run(self, now=None):
         """
-        Determines whether the necessary interval has elapsed. If it has, this returns True and updates the internal
-        record of the last runtime to be 'now'. If the necessary time has not elapsed this returns False
+        Determines whether the next deadline has been reached. If it has, this returns True and moves the deadline on
+        by one interval. If the deadline has not been reached this returns False
+
+        :param now:
+            Optional, the current time, typically the context's timestamp. Defaults to None to read the clock
         """
-        now = time()
-        if self.last_time is None or now - self.last_time > self.interval:
-            self.last_time = now
+        if now is None:
+            now = self.clock.time()
+        if self.next_time is None:
+            self.next_time = now + self.interval
+            return True
+        elif now >= self.next_time:
+            self._advance(now)
             return True
         else:
             return False
 
     def sleep(self):
         """
-        Sleep, if necessary, until the minimum interval has elapsed. If the last run time is not set this function will
-        set it as a side effect, but will not sleep in this case. Calling sleep() repeatedly will therefore not sleep
-        on the first invocation but will subsequently do so each time.
+        Sleep, if necessary, until the next deadline, then move the deadline on by one interval. If there is no
+        deadline yet this function will set it as a side effect, but will not sleep in this case. Calling sleep()
+        repeatedly will therefore not sleep on the first invocation but will subsequently return once per interval.
         """
-        now = time()
-        if self.last_time is None:
-            self.last_time = now
+        now = self.clock.time()
+        if self.next_time is None:
+            self.next_time = now + self.interval
             return
-        elif now - self.last_time > self.interval:
-            return
-        else:
-            remaining_interval = self.interval - (now - self.last_time)
-            time_sleep(remaining_interval)
-            self.last_time = now + remaining_interval
+        elif now < self.next_time:
+            self.clock.sleep(self.next_time - now)
+            now = self.next_time
+        self._advance(now)
 
     def __enter__(self):
         self.sleep()
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.last_time = time()
+        self.next_time = self.clock.time() + self.interval
+
+
+class LRUCache:
+    """
+    Bounded mapping which evicts the least recently used entry when full, used to memoise computations in the task
+    loop where the same inputs tend to recur. Keeps hit and miss counts so the benefit can be measured.
+    """
+
+    def __init__(self, max_size=256):
+        """
+        Create a new, empty, cache
+
+        :param int max_size:
+            The maximum number of entries, defaults to 256
+        """
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        Look up a key, marking it as most recently used if present
+
+        :param key:
+            The key
+        :return:
+            The cached value, or None if the key isn't in the cache
+        """
+        value = self.entries.pop(key, None)
+        if value is None:
+            self.misses += 1
+            return None
+        self.entries[key] = value
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """
+        Add or replace an entry, evicting the least recently used entry if the cache is full
+
+        :param key:
+            The key
+        :param value:
+            The value, which must not be None
+        """
+        self.entries.pop(key, None)
+        if len(self.entries) >= self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+        self.entries[key] = value
+
+    def clear(self):
+        """
+        Remove all entries, leaving the statistics untouched
+        """
+        self.entries.clear()
+
+    @property
+    def hit_rate(self):
+        """
+        Fraction of lookups which were hits, or None if there haven't been any lookups
+        """
+        lookups = self.hits + self.misses
+        if lookups == 0:
+            return None
+        return float(self.hits) / lookups
+
+    def statistics(self):
+        """
+        Get cache statistics
+
+        :return:
+            A dict containing 'size', 'hits', 'misses', 'evictions' and 'hit_rate'
+        """
+        return {'size': len(self.entries), 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'hit_rate': self.hit_rate}
+
+    def __str__(self):
+        return 'LRUCache[ size={}, hits={}, misses={}, evictions={} ]'.format(len(self.entries), self.hits,
+                                                                          self.misses, self.evictions)
 
 
 def in_range(value, min_value, max_value):
@@ -0,0 +1,468 @@
+"""
+Benchmarks for the task loop, run with 'python -m approxeng.viridia.benchmark'. These run against the simulated
+hardware in :mod:`approxeng.viridia.simulation`, wired up in the same way as the service script, so can be run on a
+development machine as well as on the robot. Results are written as JSON so runs can be compared across commits.
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+from threading import Thread
+from time import time, sleep
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2 doesn't have tracemalloc, we can still count garbage collected objects
+    tracemalloc = None
+
+from approxeng.viridia.clock import VirtualClock
+from approxeng.viridia.display import AsyncDisplay, OutputSink
+from approxeng.viridia.profiling import LatencyHistogram
+from approxeng.viridia.runtime import Runtime, Sleep
+from approxeng.viridia.simulation import SimulatedRobot, ScriptedJoystick, SimulatedVideoStream
+from approxeng.viridia.system import ViridiaSystem
+from approxeng.viridia.tasks.calibration import LinearCalibrationTask, AngularCalibrationTask
+from approxeng.viridia.tasks.main_menu import MenuTask
+from approxeng.viridia.tasks.manual_control import ManualMotionTask
+
+STICK_SCRIPT = [(0.0, {'lx': 0.0, 'ly': 0.5, 'rx': 0.0}, None),
+                (0.5, {'lx': 0.3, 'ly': 0.6, 'rx': -0.2}, None),
+                (1.0, {'lx': -0.4, 'ly': 0.2, 'rx': 0.4}, None),
+                (1.5, {'lx': 0.0, 'ly': 0.5, 'rx': 0.0}, None)]
+'Joystick script used when benchmarking manual control, changes the sticks every half second'
+
+SERVICE_MODULES = ['approxeng.viridia.task',
+                   'approxeng.viridia.tasks.main_menu',
+                   'approxeng.viridia.tasks.registry',
+                   'approxeng.viridia.telemetry',
+                   'approxeng.viridia.tasks.manual_control',
+                   'approxeng.viridia.tasks.calibration',
+                   'approxeng.viridia.tasks.camera',
+                   'euclid',
+                   'numpy',
+                   'cv2',
+                   'imutils.video',
+                   'picamera']
+'Modules imported by the service script or its tasks, in the order reported by the import benchmark'
+
+MENU_SCRIPT = [(0.0, None, ['dright']),
+               (0.5, None, ['dleft'])]
+'Joystick script used when benchmarking the menu, moves between menu items every half second'
+
+
+class NullStream:
+    """
+    File-like object which discards everything written to it, used to stop task diagnostics ending up in the output
+    """
+
+    def write(self, s):
+        pass
+
+    def flush(self):
+        pass
+
+
+class SetpointLatencyProbe:
+    """
+    Sits between the bus scheduler and the simulated I2C bus, timing how long it takes from a joystick axis changing to
+    the first motor setpoint write which differs from the setpoint in effect at the time of the change.
+    """
+
+    def __init__(self, i2c, motor_addresses, clock=time):
+        self.i2c = i2c
+        self.clock = clock
+        self.motor_addresses = motor_addresses
+        self.setpoints = {}
+        self.baseline = None
+        self.change_time = None
+        self.latencies = LatencyHistogram(window=10000)
+
+    def axis_changed(self, sname, value, when):
+        if self.change_time is None:
+            self.change_time = when
+            self.baseline = dict(self.setpoints)
+
+    def send(self, address, *sequence):
+        self.i2c.send(address, *sequence)
+        if address in self.motor_addresses and sequence[0] == 0:
+            speed = sequence[1]
+            if self.change_time is not None and abs(speed - self.baseline.get(address, 0.0)) > 1e-6:
+                self.latencies.add(self.clock() - self.change_time)
+                self.change_time = None
+            self.setpoints[address] = speed
+
+    def read(self, address, format_string):
+        return self.i2c.read(address, format_string)
+
+
+class SimulatedSystem(ViridiaSystem):
+    """
+    Viridia's software stack, built by :class:`approxeng.viridia.system.ViridiaSystem` as in the service script,
+    running against simulated hardware with a probe timing motor setpoint latency. Display output is discarded. If a
+    clock is supplied the simulated robot and the whole stack use it, the joystick should be created with the same
+    clock, and the runtime should be on it too.
+    """
+
+    def __init__(self, joystick, tick_rate=None, reuse_context=False, odometry=True, clock=None, runtime=None):
+        self.robot = SimulatedRobot(clock=None if clock is None else clock.time)
+        self.joystick = joystick
+        self.probe = SetpointLatencyProbe(i2c=self.robot.i2c, motor_addresses=[0x61, 0x62, 0x63],
+                                          clock=self.robot.clock)
+        joystick.add_listener(self.probe.axis_changed)
+        ViridiaSystem.__init__(self, i2c=self.probe, joystick=joystick, gpio=self.robot.gpio, tick_rate=tick_rate,
+                               reuse_context=reuse_context, odometry=odometry, clock=clock, runtime=runtime,
+                               display=AsyncDisplay(sink=OutputSink(stream=NullStream(), clock=clock)))
+
+    def close(self):
+        ViridiaSystem.close(self)
+        self.task_manager.runtime.shutdown()
+
+
+def measure_allocations(task, task_manager, ticks=1000, warmup=100):
+    """
+    Measure steady state allocations per tick of a task. The task is initialised and polled for a number of warmup
+    ticks, the garbage collector is then disabled and the task polled again while allocations are measured.
+
+    :param task:
+        The task to measure
+    :param task_manager:
+        A task manager used to build the context for each tick
+    :param ticks:
+        The number of ticks to measure over, defaults to 1000
+    :param warmup:
+        The number of ticks to run before measurement starts, defaults to 100
+    :return:
+        A dict containing 'gc_objects_per_tick', the net number of garbage collected objects created per tick, and
+        'seconds_per_tick'. If tracemalloc is available this also contains 'blocks_per_tick' and 'bytes_per_tick', the
+        net number of memory blocks and bytes allocated per tick, and 'peak_bytes', the highest traced memory seen
+        above the starting point during the measurement.
+    """
+    stdout = sys.stdout
+    sys.stdout = NullStream()
+    try:
+        task.init_task(context=task_manager._build_context())
+        for tick in range(warmup):
+            task.poll_task(context=task_manager._build_context(), tick=tick)
+        gc.collect()
+        gc.disable()
+        if tracemalloc is not None:
+            tracemalloc.start()
+            before = tracemalloc.take_snapshot()
+            start_memory = tracemalloc.get_traced_memory()[0]
+        gc_before = gc.get_count()[0]
+        start = time()
+        for tick in range(warmup, warmup + ticks):
+            task.poll_task(context=task_manager._build_context(), tick=tick)
+        elapsed = time() - start
+        result = {'gc_objects_per_tick': float(gc.get_count()[0] - gc_before) / ticks,
+                  'seconds_per_tick': elapsed / ticks}
+        if tracemalloc is not None:
+            peak_memory = tracemalloc.get_traced_memory()[1]
+            after = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            differences = after.compare_to(before, 'filename')
+            result['blocks_per_tick'] = float(sum(d.count_diff for d in differences)) / ticks
+            result['bytes_per_tick'] = float(sum(d.size_diff for d in differences)) / ticks
+            result['peak_bytes'] = peak_memory - start_memory
+        return result
+    finally:
+        gc.enable()
+        sys.stdout = stdout
+
+
+def allocation_benchmark(ticks=1000):
+    """
+    Measure allocations per tick for the manual motion task with the sticks held still, with a fresh context each tick
+    and with a re-used context. The odometry sampler is disabled so only allocations made by the task loop are seen.
+    """
+    results = {}
+    for reuse_context in [False, True]:
+        joystick = ScriptedJoystick(script=[(0.0, {'lx': 0.3, 'ly': 0.6, 'rx': -0.2}, None)])
+        system = SimulatedSystem(joystick=joystick, reuse_context=reuse_context, odometry=False)
+        try:
+            results['reuse_context={}'.format(reuse_context)] = measure_allocations(
+                task=ManualMotionTask(), task_manager=system.task_manager, ticks=ticks)
+        finally:
+            system.close()
+    return results
+
+
+def cpu_time():
+    """
+    User and system CPU time used by this process, including all threads
+    """
+    times = os.times()
+    return times[0] + times[1]
+
+
+def loop_benchmark(task, script=None, duration=5.0, tick_rate=None):
+    """
+    Run the task manager with a single task against the simulated hardware for a fixed time
+
+    :param task:
+        The task to run
+    :param script:
+        Joystick script, see :class:`approxeng.viridia.simulation.ScriptedJoystick`. Defaults to None for no input
+    :param duration:
+        Time in seconds to run for, defaults to 5
+    :param tick_rate:
+        Default rate for the task manager, defaults to None to run as fast as possible
+    :return:
+        A dict containing 'ticks_per_second', 'cpu_seconds_per_tick', 'i2c_transactions_per_tick', the scheduler's
+        'missed_deadlines' and 'overruns', and 'setpoint_latency', the summary of the time from a scripted joystick
+        axis change to the corresponding motor setpoint write
+    """
+    joystick = ScriptedJoystick(script=script, repeat=True)
+    system = SimulatedSystem(joystick=joystick, tick_rate=tick_rate)
+    task_manager = system.task_manager
+    stdout = sys.stdout
+    sys.stdout = NullStream()
+    try:
+        thread = Thread(target=task_manager.run, kwargs={'initial_task': task})
+        thread.daemon = True
+        joystick.start()
+        transactions_before = system.robot.i2c.transactions
+        cpu_before = cpu_time()
+        start = time()
+        thread.start()
+        sleep(duration)
+        task_manager.stop()
+        thread.join()
+        elapsed = time() - start
+        cpu = cpu_time() - cpu_before
+        ticks = max(1, task_manager.scheduler.ticks)
+        return {'ticks_per_second': ticks / elapsed,
+                'cpu_seconds_per_tick': cpu / ticks,
+                'i2c_transactions_per_tick': float(system.robot.i2c.transactions - transactions_before) / ticks,
+                'missed_deadlines': task_manager.scheduler.missed_deadlines,
+                'overruns': task_manager.scheduler.overruns,
+                'setpoint_latency': system.probe.latencies.summary()}
+    finally:
+        sys.stdout = stdout
+        system.close()
+
+
+def task_benchmarks(duration=5.0, tick_rate=None):
+    """
+    Run :func:`approxeng.viridia.benchmark.loop_benchmark` for each of the built-in tasks which don't need a camera
+
+    :return:
+        A dict of task class name to results. ManualMotionTask is also run with its wheel speed cache enabled, as
+        'ManualMotionTask(cached)', the results for which include the cache's statistics as 'wheel_speed_cache'
+    """
+    cached_task = ManualMotionTask(wheel_speed_cache_size=256)
+    results = {'MenuTask': loop_benchmark(task=MenuTask(tasks=[ManualMotionTask(), LinearCalibrationTask()]),
+                                          script=MENU_SCRIPT, duration=duration, tick_rate=tick_rate),
+               'ManualMotionTask': loop_benchmark(task=ManualMotionTask(), script=STICK_SCRIPT, duration=duration,
+                                                  tick_rate=tick_rate),
+               'ManualMotionTask(cached)': loop_benchmark(task=cached_task, script=STICK_SCRIPT, duration=duration,
+                                                          tick_rate=tick_rate),
+               'LinearCalibrationTask': loop_benchmark(task=LinearCalibrationTask(), duration=duration,
+                                                       tick_rate=tick_rate),
+               'AngularCalibrationTask': loop_benchmark(task=AngularCalibrationTask(), duration=duration,
+                                                        tick_rate=tick_rate)}
+    results['ManualMotionTask(cached)']['wheel_speed_cache'] = cached_task.wheel_speed_cache.statistics()
+    return results
+
+
+def virtual_time_benchmark(duration=60.0, tick_rate=50):
+    """
+    Run manual control against the simulated hardware in virtual time, where waiting for the next tick just moves a
+    :class:`approxeng.viridia.clock.VirtualClock` on, to measure how much faster than real time the task system can be
+    simulated. The task loop runs in a :class:`approxeng.viridia.runtime.Runtime` on the virtual clock, with no worker
+    threads, along with the odometry service.
+
+    :param duration:
+        Simulated time in seconds to run for, defaults to 60
+    :param tick_rate:
+        Rate for the task manager, defaults to 50. There must be a rate, as without one virtual time never moves
+    :return:
+        A dict containing 'simulated_seconds', 'real_seconds', 'speedup', the ratio of the two, and 'ticks'
+    """
+    clock = VirtualClock()
+    joystick = ScriptedJoystick(script=STICK_SCRIPT, repeat=True, clock=clock.time)
+    system = SimulatedSystem(joystick=joystick, tick_rate=tick_rate, clock=clock,
+                             runtime=Runtime(workers=0, clock=clock))
+    task_manager = system.task_manager
+
+    def stop_after_duration():
+        yield Sleep(duration)
+        task_manager.stop()
+
+    task_manager.services.append(stop_after_duration())
+    stdout = sys.stdout
+    sys.stdout = NullStream()
+    try:
+        joystick.start()
+        start = time()
+        task_manager.run(initial_task=ManualMotionTask())
+        elapsed = time() - start
+        return {'simulated_seconds': duration,
+                'real_seconds': elapsed,
+                'speedup': duration / elapsed,
+                'ticks': task_manager.scheduler.ticks}
+    finally:
+        sys.stdout = stdout
+        system.close()
+
+
+def switch_benchmark(duration=4.0):
+    """
+    Measure the time taken to switch from the menu to the line follower, with and without the menu prewarming it. The
+    line follower is highlighted, left for long enough to prewarm, then started. From cold, the line follower warms the
+    camera up in its coroutine after init, so the cold switch is quick but the task then waits a couple of seconds for
+    the camera before following the line.
+
+    :return:
+        A dict containing 'cold' and 'warm', the summaries of the switch latency in each case, or None if the line
+        follower's dependencies aren't available
+    """
+    try:
+        from approxeng.viridia.tasks.camera import LineFollowerTask
+    except ImportError:
+        return None
+    script = [(0.2, None, ['dright']),
+              (duration - 0.5, None, ['cross'])]
+    results = {}
+    for name, prewarm in [('cold', False), ('warm', True)]:
+        task = LineFollowerTask(stream_factory=lambda resolution: SimulatedVideoStream(resolution=resolution))
+        system = SimulatedSystem(joystick=ScriptedJoystick(script=script), odometry=False)
+        task_manager = system.task_manager
+        stdout = sys.stdout
+        sys.stdout = NullStream()
+        try:
+            thread = Thread(target=task_manager.run,
+                            kwargs={'initial_task': MenuTask(tasks=[ManualMotionTask(), task], prewarm=prewarm)})
+            thread.daemon = True
+            thread.start()
+            sleep(duration + 0.5)
+            task_manager.stop()
+            thread.join()
+            latencies = task_manager.switch_latencies.get(task.task_name)
+            results[name] = None if latencies is None else latencies.summary()
+        finally:
+            sys.stdout = stdout
+            task.shutdown(task_manager.context)
+            system.close()
+    return results
+
+
+def import_benchmark(modules=SERVICE_MODULES):
+    """
+    Measure the time taken to import each module, each in a fresh interpreter so the cost includes everything the
+    module pulls in that the interpreter hasn't already loaded. This is what the module would add to service startup if
+    imported first, modules sharing dependencies will cost less in practice.
+
+    :param modules:
+        List of module names, defaults to the modules used by the service script and its tasks
+    :return:
+        A dict of module name to import time in seconds, or None if the module couldn't be imported
+    """
+    results = {}
+    for module in modules:
+        code = 'import time\nstart = time.time()\nimport {}\nprint(time.time() - start)'.format(module)
+        process = subprocess.Popen([sys.executable, '-c', code], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        output, _ = process.communicate()
+        results[module] = float(output) if process.returncode == 0 else None
+    return results
+
+
+def line_finder_benchmark(resolutions=(128, 256, 512, 1024), frames=200):
+    """
+    Time :class:`approxeng.viridia.vision.BandLineFinder`, and a three band
+    :class:`approxeng.viridia.vision.MultiBandLineFinder`, on simulated frames at a range of square camera resolutions.
+    The scan bands are scaled with the resolution, as they would need to be to cover the same part of the floor.
+
+    :return:
+        A dict of finder name to dict of resolution to seconds per frame, or None if numpy isn't available
+    """
+    try:
+        from approxeng.viridia.vision import BandLineFinder, MultiBandLineFinder
+    except ImportError:
+        return None
+    results = {'single_band': {}, 'three_bands': {}}
+    for resolution in resolutions:
+        scale = resolution // 128
+        image = SimulatedVideoStream(resolution=(resolution, resolution), line_width=8 * scale).read()
+        finders = {'single_band': BandLineFinder(scan_region_height=20 * scale, min_detection_area=40 * scale * scale,
+                                                 invert=True),
+                   'three_bands': MultiBandLineFinder(bands=[(0.0, 70, 140), (0.4, 110, 180), (0.8, 150, 220)],
+                                                      scan_region_height=20 * scale,
+                                                      min_detection_area=40 * scale * scale, invert=True)}
+        for name, finder in finders.items():
+            start = time()
+            for frame in range(frames):
+                finder.find_lines(image)
+            results[name][resolution] = (time() - start) / frames
+    return results
+
+
+def frame_store_benchmark(path, lookahead_bands=((0.0, 70, 140), (0.4, 110, 180), (0.8, 150, 220))):
+    """
+    Run the line finders, configured as LineFollowerTask's defaults, over every frame in a frame store recorded on the
+    robot, as fast as possible
+
+    :param path:
+        Path of a frame store written by :class:`approxeng.viridia.capture.FrameStoreWriter`
+    :param lookahead_bands:
+        Bands for the multi-band finder
+    :return:
+        A dict of finder name to dict containing 'seconds_per_frame' and 'detection_rate', the fraction of frames in
+        which at least one line was found
+    """
+    from approxeng.viridia.capture import FrameStore
+    from approxeng.viridia.vision import BandLineFinder, MultiBandLineFinder
+    store = FrameStore(path)
+    try:
+        finders = {'single_band': BandLineFinder(invert=True),
+                   'three_bands': MultiBandLineFinder(bands=lookahead_bands, invert=True)}
+        results = {}
+        for name, finder in finders.items():
+            detections = 0
+            start = time()
+            for frame in store:
+                lines = finder.find_lines(frame.image)
+                if finder.found(lines):
+                    detections += 1
+            frames = max(1, len(store))
+            results[name] = {'seconds_per_frame': (time() - start) / frames,
+                             'detection_rate': float(detections) / frames}
+        return results
+    finally:
+        store.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Viridia task loop benchmarks, results are written as JSON')
+    parser.add_argument('--ticks', type=int, default=1000, help='number of ticks for the allocation benchmark')
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds to run each task for')
+    parser.add_argument('--tick-rate', type=float, default=None, help='task manager tick rate, default unlimited')
+    parser.add_argument('--output', default=None, help='file to write results to, defaults to stdout')
+    parser.add_argument('--frames', default=None, help='frame store recorded by the line follower to benchmark')
+    args = parser.parse_args()
+    results = {'python': platform.python_version(),
+               'machine': platform.machine(),
+               'timestamp': time(),
+               'allocations': allocation_benchmark(ticks=args.ticks),
+               'tasks': task_benchmarks(duration=args.duration, tick_rate=args.tick_rate),
+               'line_finder': line_finder_benchmark(),
+               'switch': switch_benchmark(),
+               'virtual_time': virtual_time_benchmark(),
+               'imports': import_benchmark()}
+    if args.frames is not None:
+        results['frame_store'] = frame_store_benchmark(args.frames)
+    if args.output is None:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+    else:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+from threading import Condition, current_thread
+
+from approxeng.viridia.clock import SYSTEM_CLOCK
+
+PRIORITY_SETPOINT = 0
+'Priority for motor setpoints and enable / disable commands, these always go first'
+PRIORITY_ODOMETRY = 1
+'Priority for reading wheel angles'
+PRIORITY_LIGHTING = 2
+'Priority for lighting and display traffic, deferred or dropped when the bus budget for the current tick is used up'
+
+
+class BusScheduler:
+    """
+    Arbitrates access to a single :class:`approxeng.pi2arduino.I2CHelper` shared by several devices, potentially on
+    different threads. Every transaction is submitted with a priority. When the bus is busy, waiting transactions are
+    granted the bus highest priority (lowest number) first, and in submission order within a priority, so a motor
+    setpoint is never stuck behind a queue of lighting updates.
+
+    The scheduler also enforces a per-tick bus time budget. The task manager calls start_tick at the start of every
+    tick. Once the time spent on the bus during the tick exceeds the budget, transactions at or below the deferrable
+    priority are held back until the next tick. Droppable transactions are discarded instead. The exception is a
+    transaction submitted from the task loop thread itself, which can't wait for the next tick because it would be
+    waiting on itself. These are dropped if droppable, and otherwise sent over budget and counted as such.
+
+    Rather than passing the scheduler to devices directly, use the client method to create an object with the same
+    send and read methods as the I2CHelper, with priorities fixed by the client.
+    """
+
+    def __init__(self, i2c, tick_budget=None, deferrable_priority=PRIORITY_LIGHTING, clock=None):
+        """
+        Create a new scheduler
+
+        :param i2c:
+            The :class:`approxeng.pi2arduino.I2CHelper` used to actually perform transactions
+        :param tick_budget:
+            The bus time, in seconds, available to each tick before low priority traffic is deferred or dropped.
+            Defaults to None, for no limit
+        :param deferrable_priority:
+            Transactions with this priority or lower (numerically higher) are subject to the budget. Defaults to
+            PRIORITY_LIGHTING
+        :param clock:
+            Optional, the clock bus time is measured on, defaults to None for
+            :data:`approxeng.viridia.clock.SYSTEM_CLOCK`
+        """
+        self.i2c = i2c
+        self.clock = clock if clock is not None else SYSTEM_CLOCK
+        self.tick_budget = tick_budget
+        self.deferrable_priority = deferrable_priority
+        self.condition = Condition()
+        self.busy = False
+        self.waiting = []
+        self.sequence = 0
+        self.budget_used = 0.0
+        self.tick_thread = None
+        self.transactions = {}
+        self.bus_time = {}
+        self.deferred = {}
+        self.dropped = {}
+        self.over_budget = {}
+
+    def client(self, send_priority, read_priority=None, droppable=False):
+        """
+        Create a client, which can be used anywhere an I2CHelper is expected
+
+        :param send_priority:
+            Priority for send operations
+        :param read_priority:
+            Priority for read operations, defaults to None to use the send priority
+        :param droppable:
+            If True, this client's transactions may be dropped when over budget. Reads which are dropped return None.
+            Don't use this for devices using shadow registers, as they'd have no way to know their write was dropped.
+            Defaults to False
+        :return:
+            A :class:`approxeng.viridia.bus.BusClient`
+        """
+        if read_priority is None:
+            read_priority = send_priority
+        return BusClient(bus=self, send_priority=send_priority, read_priority=read_priority, droppable=droppable)
+
+    def start_tick(self):
+        """
+        Reset the bus time budget, releasing any transactions deferred from the previous tick. Called by the task
+        manager at the start of each tick.
+        """
+        with self.condition:
+            self.tick_thread = current_thread()
+            self.budget_used = 0.0
+            self.condition.notify_all()
+
+    def send(self, address, sequence, priority, droppable=False):
+        """
+        Send data to a device
+
+        :param address:
+            I2C address
+        :param sequence:
+            Sequence of values to send
+        :param priority:
+            Transaction priority
+        :param droppable:
+            Whether this transaction can be dropped if over budget, defaults to False
+        :return:
+            True if the data was sent, False if it was dropped
+        """
+        if not self._acquire(priority, droppable):
+            return False
+        start = self.clock.time()
+        try:
+            self.i2c.send(address, *sequence)
+        finally:
+            self._release(priority, self.clock.time() - start)
+        return True
+
+    def read(self, address, format_string, priority, droppable=False):
+        """
+        Read data from a device
+
+        :param address:
+            I2C address
+        :param format_string:
+            Struct format string describing the data to read
+        :param priority:
+            Transaction priority
+        :param droppable:
+            Whether this transaction can be dropped if over budget, defaults to False
+        :return:
+            The data read, or None if the read was dropped
+        """
+        if not self._acquire(priority, droppable):
+            return None
+        start = self.clock.time()
+        try:
+            return self.i2c.read(address, format_string)
+        finally:
+            self._release(priority, self.clock.time() - start)
+
+    def acquire_exclusive(self, timeout):
+        """
+        Take the bus for transactions made outside the scheduler, straight to its I2CHelper, as
+        :class:`approxeng.viridia.watchdog.TickWatchdog` does to stop the motors. Waits for any transaction in progress
+        to finish, and then takes the bus ahead of every transaction waiting for it. Call release_exclusive when done.
+
+        :param timeout:
+            Maximum time in seconds to wait for a transaction in progress
+        :return:
+            True if the bus was taken, False if the transaction in progress was still running when the timeout expired
+        """
+        # A real wait, whatever clock the rest of the system is using
+        deadline = SYSTEM_CLOCK.time() + timeout
+        with self.condition:
+            while self.busy:
+                remaining = deadline - SYSTEM_CLOCK.time()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+            self.busy = True
+            return True
+
+    def release_exclusive(self):
+        """
+        Release the bus after a successful call to acquire_exclusive
+        """
+        with self.condition:
+            self.busy = False
+            self.condition.notify_all()
+
+    def _budget_exhausted(self, priority):
+        return priority >= self.deferrable_priority and self.tick_budget is not None and \
+               self.budget_used >= self.tick_budget
+
+    def _next_waiting(self):
+        """
+        The highest priority waiting transaction which is allowed to run. Entries are tuples of priority, submission
+        sequence number, and a flag which is True if the entry is exempt from the budget.
+        """
+        best = None
+        for entry in self.waiting:
+            if (best is None or entry < best) and (entry[2] or not self._budget_exhausted(entry[0])):
+                best = entry
+        return best
+
+    def _acquire(self, priority, droppable):
+        with self.condition:
+            exempt = False
+            if self._budget_exhausted(priority):
+                if droppable:
+                    self.dropped[priority] = self.dropped.get(priority, 0) + 1
+                    return False
+                if current_thread() is self.tick_thread:
+                    self.over_budget[priority] = self.over_budget.get(priority, 0) + 1
+                    exempt = True
+                else:
+                    self.deferred[priority] = self.deferred.get(priority, 0) + 1
+            entry = (priority, self.sequence, exempt)
+            self.sequence += 1
+            self.waiting.append(entry)
+            while self.busy or self._next_waiting() is not entry:
+                self.condition.wait()
+            self.waiting.remove(entry)
+            self.busy = True
+            return True
+
+    def _release(self, priority, elapsed):
+        with self.condition:
+            self.busy = False
+            self.budget_used += elapsed
+            self.transactions[priority] = self.transactions.get(priority, 0) + 1
+            self.bus_time[priority] = self.bus_time.get(priority, 0.0) + elapsed
+            self.condition.notify_all()
+
+    def statistics(self):
+        """
+        Get bus usage statistics
+
+        :return:
+            A dict of priority to dict containing 'transactions', the number of completed transactions, 'bus_time',
+            the total time in seconds spent on them, 'deferred' and 'dropped', the number of transactions deferred to
+            a later tick or dropped, and 'over_budget', the number sent over budget from the task loop thread
+        """
+        priorities = set(self.transactions.keys()) | set(self.deferred.keys()) | set(self.dropped.keys()) | set(
+            self.over_budget.keys())
+        return dict((priority, {'transactions': self.transactions.get(priority, 0),
+                                'bus_time': self.bus_time.get(priority, 0.0),
+                                'deferred': self.deferred.get(priority, 0),
+                                'dropped': self.dropped.get(priority, 0),
+                                'over_budget': self.over_budget.get(priority, 0)}) for priority in priorities)
+
+
+class BusClient:
+    """
+    Presents the send and read methods of :class:`approxeng.pi2arduino.I2CHelper`, routing them through a
+    :class:`approxeng.viridia.bus.BusScheduler` with fixed priorities
+    """
+
+    def __init__(self, bus, send_priority, read_priority, droppable=False):
+        self.bus = bus
+        self.send_priority = send_priority
+        self.read_priority = read_priority
+        self.droppable = droppable
+
+    def send(self, address, *sequence):
+        self.bus.send(address, sequence, self.send_priority, self.droppable)
+
+    def read(self, address, format_string):
+        return self.bus.read(address, format_string, self.read_priority, self.droppable)
@@ -0,0 +1,491 @@
+import mmap
+import os
+import struct
+import traceback
+from collections import deque
+from threading import Condition, Thread
+from time import sleep
+
+from approxeng.viridia.clock import SYSTEM_CLOCK
+
+
+class Frame(object):
+    """
+    A single captured frame, tagged with a sequence number and the time it was captured. Consumers keep the sequence
+    number of the last frame they processed, and can then tell whether a frame is new, and how many frames they missed
+    in between.
+    """
+
+    __slots__ = ['sequence', 'timestamp', 'image']
+
+    def __init__(self, sequence, timestamp, image):
+        """
+        :param sequence:
+            Number of frames captured before this one
+        :param timestamp:
+            Time, in seconds, that the frame was captured
+        :param image:
+            The image itself, as returned by the underlying video stream
+        """
+        self.sequence = sequence
+        self.timestamp = timestamp
+        self.image = image
+
+    def age(self, now=None):
+        """
+        Time in seconds since this frame was captured
+
+        :param now:
+            The current time, from the clock the frame was timestamped with. Defaults to None to read
+            :data:`approxeng.viridia.clock.SYSTEM_CLOCK`
+        """
+        if now is None:
+            now = SYSTEM_CLOCK.time()
+        return now - self.timestamp
+
+
+class FrameCapture:
+    """
+    Wraps a video stream such as an imutils VideoStream, which only offers the most recent frame with no indication of
+    whether it has changed since the last read, and tags each new frame with a sequence number and capture timestamp.
+
+    The underlying stream is polled on a background thread. Streams like the imutils PiVideoStream replace their frame
+    object each time the camera produces one, so a frame is new when read returns a different object to the previous
+    read. The capture timestamp is the time the new frame was first seen, so is accurate to within the poll interval.
+    """
+
+    def __init__(self, stream, poll_interval=0.002, recorder=None, clock=None):
+        """
+        Create a new capture, call start() to start the stream and begin tagging frames
+
+        :param stream:
+            An un-started video stream, anything with start, read and stop methods
+        :param poll_interval:
+            Time in seconds between polls of the stream, defaults to 0.002
+        :param recorder:
+            Optional, a :class:`approxeng.viridia.capture.FrameStoreWriter` to which each new frame is passed. The
+            capture starts and stops the writer along with the stream. Defaults to None
+        :param clock:
+            Optional, the clock frames are timestamped with, which should be the task manager's so frame ages can be
+            measured against it. Defaults to None for :data:`approxeng.viridia.clock.SYSTEM_CLOCK`
+        """
+        self.stream = stream
+        self.clock = clock if clock is not None else SYSTEM_CLOCK
+        self.poll_interval = poll_interval
+        self.recorder = recorder
+        self.condition = Condition()
+        self.listeners = []
+        self.frame = None
+        self.frames = 0
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        """
+        Start the underlying stream and the polling thread
+
+        :return:
+            This capture, for chaining
+        """
+        if self.thread is None:
+            if self.recorder is not None:
+                self.recorder.start()
+            self.stream.start()
+            self.running = True
+            self.thread = Thread(target=self._poll_loop, name='frame-capture')
+            self.thread.daemon = True
+            self.thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stop the polling thread and the underlying stream
+        """
+        if self.thread is not None:
+            self.running = False
+            self.thread.join()
+            self.thread = None
+            self.stream.stop()
+            if self.recorder is not None:
+                self.recorder.stop()
+
+    def _poll_loop(self):
+        last_image = None
+        while self.running:
+            image = self.stream.read()
+            if image is not None and image is not last_image:
+                last_image = image
+                self.add_frame(image=image, timestamp=self.clock.time())
+            # Polling the camera is a real wait, whatever clock frames are timestamped with
+            sleep(self.poll_interval)
+
+    def add_frame(self, image, timestamp):
+        """
+        Tag and publish a new frame. Called from the polling thread, but can also be used to feed in frames from
+        elsewhere, for example when replaying recorded frames.
+
+        :param image:
+            The image
+        :param timestamp:
+            Time, in seconds, at which the image was captured
+        """
+        with self.condition:
+            self.frame = Frame(sequence=self.frames, timestamp=timestamp, image=image)
+            self.frames += 1
+            self.condition.notify_all()
+            frame = self.frame
+            listeners = list(self.listeners)
+        if self.recorder is not None:
+            self.recorder.add(frame)
+        for listener in listeners:
+            listener(frame)
+
+    def add_listener(self, listener):
+        """
+        Call a function with each new frame, on the thread which added the frame. Listeners must be quick, they hold up
+        the capture.
+
+        :param listener:
+            Function taking a :class:`approxeng.viridia.capture.Frame`
+        """
+        with self.condition:
+            self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        """
+        Stop calling a listener, does nothing if it isn't registered
+
+        :param listener:
+            The function passed to add_listener
+        """
+        with self.condition:
+            if listener in self.listeners:
+                self.listeners.remove(listener)
+
+    def latest(self):
+        """
+        Get the most recent frame
+
+        :return:
+            The most recent :class:`approxeng.viridia.capture.Frame`, or None if no frames have been captured yet
+        """
+        return self.frame
+
+    def wait_for_frame(self, sequence, timeout=None):
+        """
+        Wait for a frame newer than the one specified
+
+        :param sequence:
+            Sequence number of the last frame seen, or -1 to accept any frame
+        :param timeout:
+            Maximum time in seconds to wait, defaults to None to wait indefinitely
+        :return:
+            The most recent :class:`approxeng.viridia.capture.Frame` if it is newer than the specified one, otherwise
+            None if the timeout expired first
+        """
+        with self.condition:
+            deadline = None if timeout is None else SYSTEM_CLOCK.time() + timeout
+            while self.frame is None or self.frame.sequence <= sequence:
+                remaining = None if deadline is None else deadline - SYSTEM_CLOCK.time()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self.condition.wait(remaining)
+            return self.frame
+
+
+FRAME_STORE_MAGIC = b'VFRM'
+FRAME_STORE_VERSION = 1
+FRAME_STORE_HEADER = struct.Struct('<4sHHHHIQ')
+'Magic, version, height, width, channels, capacity in frames, and the number of frames written'
+FRAME_STORE_COUNT_OFFSET = 16
+'Offset of the frame count within the header'
+FRAME_STORE_ALIGNMENT = 64
+'Alignment of the start of the frame data within the file'
+
+
+def _frame_store_layout(height, width, channels, capacity):
+    """
+    Compute the layout of a frame store file. The header is followed by an array of capacity double precision
+    timestamps, then the frames themselves as raw 8 bit pixels with a fixed stride.
+
+    :return:
+        A tuple of the frame stride, offset of the first timestamp, offset of the first frame, and total file size
+    """
+    stride = height * width * channels
+    timestamps_offset = FRAME_STORE_HEADER.size
+    frames_offset = timestamps_offset + capacity * 8
+    frames_offset += -frames_offset % FRAME_STORE_ALIGNMENT
+    return stride, timestamps_offset, frames_offset, frames_offset + capacity * stride
+
+
+class FrameStoreWriter:
+    """
+    Records frames to a preallocated, memory mapped, frame store file. Frames are handed to the writer by
+    :class:`approxeng.viridia.capture.FrameCapture` and copied into the file on a separate thread, so recording never
+    holds up the capture or the task loop. If the writer falls behind by more than the queue size, or the store is
+    full, frames are counted in dropped rather than recorded. Frames which don't match the store's resolution and
+    channels, or which fail to write, are counted in failed and skipped, so one bad frame doesn't stop the recording.
+    """
+
+    def __init__(self, path, resolution, channels=3, capacity=3000, queue_size=8):
+        """
+        Create a new frame store, replacing any existing file at the path
+
+        :param path:
+            Path of the frame store file
+        :param resolution:
+            Tuple of width and height of the frames
+        :param channels:
+            Number of 8 bit channels per pixel, defaults to 3 for the BGR frames produced by the camera
+        :param capacity:
+            Maximum number of frames, defaults to 3000, a little over a minute and a half at 32 frames per second
+        :param queue_size:
+            Maximum number of frames waiting to be written, defaults to 8
+        """
+        import numpy as np
+        self.np = np
+        self.path = path
+        self.width, self.height = resolution
+        self.channels = channels
+        self.capacity = capacity
+        self.queue_size = queue_size
+        self.stride, self.timestamps_offset, self.frames_offset, size = _frame_store_layout(
+            self.height, self.width, channels, capacity)
+        self.file = open(path, 'w+b')
+        self.file.truncate(size)
+        self.map = mmap.mmap(self.file.fileno(), size)
+        FRAME_STORE_HEADER.pack_into(self.map, 0, FRAME_STORE_MAGIC, FRAME_STORE_VERSION, self.height, self.width,
+                                     channels, capacity, 0)
+        self.timestamps = np.frombuffer(self.map, dtype=np.float64, count=capacity, offset=self.timestamps_offset)
+        self.count = 0
+        self.dropped = 0
+        self.failed = 0
+        self.shapes = [(self.height, self.width, channels)]
+        if channels == 1:
+            self.shapes.append((self.height, self.width))
+        self.queue = deque()
+        self.condition = Condition()
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        """
+        Start the writer thread
+
+        :return:
+            This writer, for chaining
+        """
+        if self.thread is None:
+            self.running = True
+            self.thread = Thread(target=self._write_loop, name='frame-store-writer')
+            self.thread.daemon = True
+            self.thread.start()
+        return self
+
+    def stop(self):
+        """
+        Write any queued frames, stop the writer thread, and close the file
+        """
+        if self.thread is not None:
+            with self.condition:
+                self.running = False
+                self.condition.notify_all()
+            self.thread.join()
+            self.thread = None
+        if self.map is not None:
+            self.timestamps = None
+            self.map.flush()
+            self.map.close()
+            self.file.close()
+            self.map = None
+
+    def add(self, frame):
+        """
+        Queue a frame to be written, without waiting for it to be written
+
+        :param frame:
+            A :class:`approxeng.viridia.capture.Frame`
+        """
+        if self.np.shape(frame.image) not in self.shapes:
+            self.failed += 1
+            return
+        with self.condition:
+            if len(self.queue) >= self.queue_size or self.count + len(self.queue) >= self.capacity:
+                self.dropped += 1
+                return
+            self.queue.append(frame)
+            self.condition.notify_all()
+
+    def _write_loop(self):
+        while True:
+            with self.condition:
+                while self.running and not self.queue:
+                    self.condition.wait()
+                if not self.queue:
+                    return
+                frame = self.queue.popleft()
+            try:
+                self.write(frame)
+            except Exception as e:
+                self.failed += 1
+                print 'Frame store write failed: {}'.format(e)
+                traceback.print_exc()
+
+    def write(self, frame):
+        """
+        Write a frame immediately, on the calling thread. Normally called by the writer thread.
+
+        :param frame:
+            A :class:`approxeng.viridia.capture.Frame`, the image must match the store's resolution and channels
+        """
+        np = self.np
+        view = np.frombuffer(self.map, dtype=np.uint8, count=self.stride,
+                             offset=self.frames_offset + self.count * self.stride)
+        view[:] = np.asarray(frame.image, dtype=np.uint8).reshape(-1)
+        self.timestamps[self.count] = frame.timestamp
+        self.count += 1
+        struct.pack_into('<Q', self.map, FRAME_STORE_COUNT_OFFSET, self.count)
+
+
+class FrameStore:
+    """
+    Read access to a frame store written by :class:`approxeng.viridia.capture.FrameStoreWriter`. Images are returned
+    as numpy arrays backed directly by the memory mapped file, so reading a frame doesn't copy it. Each image holds a
+    reference to the map, so the file stays mapped for as long as any image from it is in use, even after the store is
+    closed.
+    """
+
+    def __init__(self, path):
+        """
+        Open a frame store
+
+        :param path:
+            Path of the frame store file
+        :raises ValueError:
+            If the file isn't a frame store of a supported version
+        """
+        import numpy as np
+        self.np = np
+        self.path = path
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), os.path.getsize(path), access=mmap.ACCESS_READ)
+        magic, version, self.height, self.width, self.channels, self.capacity, _ = FRAME_STORE_HEADER.unpack_from(
+            self.map, 0)
+        if magic != FRAME_STORE_MAGIC or version != FRAME_STORE_VERSION:
+            raise ValueError('{} is not a version {} frame store'.format(path, FRAME_STORE_VERSION))
+        self.stride, self.timestamps_offset, self.frames_offset, _ = _frame_store_layout(
+            self.height, self.width, self.channels, self.capacity)
+        self.timestamps = np.frombuffer(self.map, dtype=np.float64, count=self.capacity,
+                                        offset=self.timestamps_offset)
+
+    def __len__(self):
+        return struct.unpack_from('<Q', self.map, FRAME_STORE_COUNT_OFFSET)[0]
+
+    def image(self, index):
+        """
+        Get a single image
+
+        :param index:
+            Index of the frame
+        :return:
+            The image, as a read only numpy array of shape (height, width, channels)
+        """
+        np = self.np
+        return np.frombuffer(self.map, dtype=np.uint8, count=self.stride,
+                             offset=self.frames_offset + index * self.stride).reshape(
+            (self.height, self.width, self.channels))
+
+    def __getitem__(self, index):
+        count = len(self)
+        if index < 0:
+            index += count
+        if not 0 <= index < count:
+            raise IndexError('Frame {} out of range, store has {} frames'.format(index, count))
+        return Frame(sequence=index, timestamp=float(self.timestamps[index]), image=self.image(index))
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def close(self):
+        """
+        Close the store. The map isn't closed explicitly, as images returned by the store may still be viewing it, it
+        is unmapped once the store and the last of those images have been released.
+        """
+        self.timestamps = None
+        self.map = None
+        # The map has its own handle on the file, so the file itself can be closed now
+        self.file.close()
+
+
+class FrameStoreStream:
+    """
+    Stands in for an imutils VideoStream, serving frames from a :class:`approxeng.viridia.capture.FrameStore`. In real
+    time mode read returns the frame which was current at the equivalent point in the recording, so the consumer sees
+    the same frame rate, and the same repeated frames, as it would have live. Otherwise each read returns the next
+    frame, so frames can be processed as fast as the consumer can manage.
+    """
+
+    def __init__(self, path, realtime=True, loop=False, clock=None):
+        """
+        :param path:
+            Path of the frame store file
+        :param realtime:
+            True to play back at the recorded rate, False to return the next frame on each read. Defaults to True
+        :param loop:
+            True to restart from the first frame after the last, otherwise the last frame is returned once the end is
+            reached. Defaults to False
+        :param clock:
+            Callable returning the current time in seconds, defaults to the time method of
+            :data:`approxeng.viridia.clock.SYSTEM_CLOCK`
+        """
+        self.path = path
+        self.realtime = realtime
+        self.loop = loop
+        self.clock = clock if clock is not None else SYSTEM_CLOCK.time
+        self.store = None
+        self.index = None
+        self.image = None
+        self.start_time = None
+
+    def start(self):
+        self.store = FrameStore(self.path)
+        self.index = None
+        self.image = None
+        self.start_time = self.clock()
+        return self
+
+    @property
+    def finished(self):
+        """
+        True once the last frame has been served, never True when looping
+        """
+        return not self.loop and self.index is not None and self.index >= len(self.store) - 1
+
+    def read(self):
+        count = len(self.store)
+        if count == 0:
+            return None
+        if self.realtime:
+            elapsed = self.clock() - self.start_time
+            duration = self.store.timestamps[count - 1] - self.store.timestamps[0]
+            if self.loop and duration > 0:
+                elapsed %= duration
+            index = int(self.store.timestamps[:count].searchsorted(self.store.timestamps[0] + elapsed, 'right')) - 1
+        elif self.index is None:
+            index = 0
+        else:
+            index = self.index + 1
+            if index >= count:
+                index = 0 if self.loop else count - 1
+        index = min(max(index, 0), count - 1)
+        if index != self.index:
+            self.index = index
+            self.image = self.store.image(index)
+        return self.image
+
+    def stop(self):
+        if self.store is not None:
+            self.image = None
+            self.store.close()
+            self.store = None
@@ -0,0 +1,124 @@
+"""
+Clocks for the task loop. The task manager reads its clock once at the start of every tick, and tasks see that reading
+as the context's timestamp, so everything which happens in a tick agrees on when it happened. The clock is monotonic,
+so changes to the system time, such as an NTP update once the Pi finds a network, can't make intervals jump or run
+backwards. For simulation the clock can be replaced with a :class:`approxeng.viridia.clock.VirtualClock`, in which
+sleeping just moves time on, so the whole task system can run many times faster than real time.
+
+Clocks have three methods, time() returning the current time in seconds, sleep(seconds), and wait_readable(fd, timeout)
+used by :class:`approxeng.viridia.runtime.Runtime` to wait for its next timer or for another thread to wake it.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import time as system_time
+
+CLOCK_MONOTONIC = 1
+
+
+class _Timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+def _monotonic_function():
+    # Python 3 has time.monotonic, for Python 2 call clock_gettime directly
+    if hasattr(system_time, 'monotonic'):
+        return system_time.monotonic
+    try:
+        clock_gettime = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True).clock_gettime
+    except (OSError, AttributeError):
+        return None
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_Timespec)]
+    timespec = _Timespec()
+    timespec_pointer = ctypes.pointer(timespec)
+
+    def monotonic():
+        if clock_gettime(CLOCK_MONOTONIC, timespec_pointer) != 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        return timespec.tv_sec + timespec.tv_nsec * 1e-9
+
+    return monotonic
+
+
+class MonotonicClock:
+    """
+    Real time, from the system's monotonic clock. Readings are seconds from an arbitrary starting point, typically
+    boot, so can only be compared with other readings from a monotonic clock and not with time.time(). Falls back to
+    time.time() where there is no monotonic clock.
+    """
+
+    def __init__(self):
+        self.monotonic = _monotonic_function()
+        if self.monotonic is None:
+            self.monotonic = system_time.time
+
+    def time(self):
+        return self.monotonic()
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            system_time.sleep(seconds)
+
+    def wait_readable(self, fd, timeout):
+        """
+        Wait until a file descriptor is readable or a timeout passes
+
+        :param fd:
+            The file descriptor
+        :param timeout:
+            Maximum time in seconds to wait, or None to wait indefinitely
+        :return:
+            True if the file descriptor is readable
+        """
+        readable, _, _ = select.select([fd], [], [], timeout)
+        return len(readable) > 0
+
+
+class VirtualClock:
+    """
+    Virtual time. Time only moves when advance or sleep is called, so a simulation can be run much faster (or slower)
+    than real time, or stepped exactly. A task manager using this clock never waits, sleeping to the next tick just
+    moves time on to it. Only suitable for a single thread, as sleeps in different threads would each move time on, so
+    background threads such as the odometry sampler's shouldn't be started, and a
+    :class:`approxeng.viridia.runtime.Runtime` should be created with no workers so calls are made on its own thread.
+    """
+
+    def __init__(self, start=0.0):
+        self.now = start
+
+    def time(self):
+        return self.now
+
+    def advance(self, seconds):
+        """
+        Move time forwards
+
+        :param seconds:
+            Number of seconds to advance
+        """
+        self.now += seconds
+
+    def sleep(self, seconds):
+        """
+        Equivalent of time.sleep, advances time rather than waiting for it to pass
+        """
+        if seconds > 0:
+            self.advance(seconds)
+
+    def wait_readable(self, fd, timeout):
+        """
+        Equivalent of :meth:`approxeng.viridia.clock.MonotonicClock.wait_readable`. If the file descriptor isn't already
+        readable time is moved on by the timeout, rather than waiting for it to pass. With no timeout this waits in real
+        time, as only another thread can make the file descriptor readable.
+        """
+        readable, _, _ = select.select([fd], [], [], None if timeout is None else 0)
+        if not readable and timeout is not None:
+            self.sleep(timeout)
+        return len(readable) > 0
+
+
+SYSTEM_CLOCK = MonotonicClock()
+'The clock used by default, a single shared :class:`approxeng.viridia.clock.MonotonicClock`'
@@ -0,0 +1,157 @@
+import numpy as np
+from time import time
+
+from approxeng.holochassis.chassis import Pose
+from euclid import Point2
+
+from approxeng.viridia.kinematics import CompiledKinematics
+
+
+class BatchDeadReckoning:
+    """
+    Dead reckoning which integrates a whole block of wheel angle samples in a handful of numpy operations, rather than
+    calling into python once per sample. This is intended to be fed from the ring buffer of an
+    :class:`approxeng.viridia.odometry.OdometrySampler`, so the sampler can run at a high rate for accuracy without the
+    control loop paying a per-sample cost to use every sample.
+
+    The chassis kinematics are linear, so the change in the robot's pose over a sample interval, in the robot's frame of
+    reference, is a fixed matrix times the change in wheel angles. Over each interval the robot is assumed to move
+    along an arc, with constant speed and rate of turn, as holochassis's own dead reckoning does, and the moves are
+    rotated into the world frame and summed. As both the pose change and the arc depend only on the wheel angle deltas,
+    sample timestamps are only used to estimate the robot's current velocity.
+
+    This can be used in place of :class:`approxeng.holochassis.chassis.DeadReckoning`, it has the same reset and
+    update_from_revolutions methods and pose property, and angles are in radians with positive values clockwise.
+    """
+
+    def __init__(self, chassis, sampler=None):
+        """
+        Create a new integrator
+
+        :param chassis:
+            The :class:`approxeng.holochassis.chassis.HoloChassis` whose wheel angles are being integrated
+        :param sampler:
+            Optional, the :class:`approxeng.viridia.odometry.OdometrySampler` this will be fed from with
+            update_from_sampler. If specified, integration starts from the sampler's latest sample whenever the
+            integrator is created or reset, rather than from the oldest sample in its ring buffer, so movement from
+            before then isn't included in the pose. Defaults to None
+        """
+        self.chassis = chassis
+        self.sampler = sampler
+        self.wheels = len(chassis.wheels)
+        # Maps changes in motor angle, in revolutions, to changes in pose. Our motors turn in the opposite sense to the
+        # chassis wheels, as the drive sends them speed * -60 RPM, so the kinematics include the same sign change
+        self.inverse_kinematics = CompiledKinematics(chassis=chassis, scale=-1).inverse()
+        self.sequence = -1
+        self.samples = 0
+        self.reset()
+
+    def reset(self):
+        """
+        Reset the pose to the origin. The next sample becomes the reference from which wheel movement is measured, or
+        if there's a sampler its latest sample.
+        """
+        self.x = 0.0
+        self.y = 0.0
+        self.orientation = 0.0
+        self.velocity = (0.0, 0.0, 0.0)
+        self.last_revolutions = None
+        self.last_timestamp = None
+        self._pose = None
+        if self.sampler is not None:
+            latest = self.sampler.latest()
+            if latest is not None:
+                # Just before the latest sample, so the next update starts with it as the reference
+                self.sequence = latest[0] - 1
+        return self
+
+    @property
+    def pose(self):
+        """
+        The current pose, as a :class:`approxeng.holochassis.chassis.Pose`
+        """
+        if self._pose is None:
+            self._pose = Pose(position=Point2(self.x, self.y), orientation=self.orientation)
+        return self._pose
+
+    def update(self, timestamps, revolutions):
+        """
+        Integrate a block of samples
+
+        :param timestamps:
+            Sequence of sample times in seconds, oldest first
+        :param revolutions:
+            Motor angles in revolutions, as read by :class:`approxeng.viridia.motors.Motors`, either an array of shape
+            (samples, wheels) or a flat sequence with the angles for each sample in turn
+        :return:
+            The updated pose
+        """
+        revolutions = np.asarray(revolutions, dtype=np.float64).reshape(-1, self.wheels)
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        if len(revolutions) == 0:
+            return self.pose
+        if self.last_revolutions is None:
+            # First sample after a reset only sets the reference point
+            self.last_revolutions = revolutions[0]
+            self.last_timestamp = timestamps[0]
+            revolutions = revolutions[1:]
+            timestamps = timestamps[1:]
+            if len(revolutions) == 0:
+                return self.pose
+        deltas = np.diff(np.vstack((self.last_revolutions[np.newaxis], revolutions)), axis=0)
+        # Robot frame displacement and rotation over each interval, one row per interval
+        moves = deltas.dot(self.inverse_kinematics.T)
+        dx, dy, dtheta = moves[:, 0], moves[:, 1], moves[:, 2]
+        orientations = self.orientation + np.cumsum(dtheta)
+        start_orientations = orientations - dtheta
+        # Displacement along an arc, in the frame at the start of the interval. The series form is used when the turn
+        # is small enough that sin(a)/a and (1-cos(a))/a would lose precision
+        small = np.abs(dtheta) < 1e-6
+        safe = np.where(small, 1.0, dtheta)
+        along = np.where(small, 1.0 - dtheta * dtheta / 6.0, np.sin(safe) / safe)
+        across = np.where(small, dtheta / 2.0, (1.0 - np.cos(safe)) / safe)
+        arc_x = along * dx + across * dy
+        arc_y = along * dy - across * dx
+        # Rotate into the world frame, clockwise by the orientation at the start of each interval
+        cos_o = np.cos(start_orientations)
+        sin_o = np.sin(start_orientations)
+        self.x += float(np.sum(cos_o * arc_x + sin_o * arc_y))
+        self.y += float(np.sum(cos_o * arc_y - sin_o * arc_x))
+        self.orientation = float(orientations[-1])
+        elapsed = timestamps[-1] - self.last_timestamp
+        if elapsed > 0:
+            total = moves.sum(axis=0) / elapsed
+            self.velocity = (float(total[0]), float(total[1]), float(total[2]))
+        self.last_revolutions = revolutions[-1]
+        self.last_timestamp = timestamps[-1]
+        self.samples += len(revolutions)
+        self._pose = None
+        return self.pose
+
+    def update_from_revolutions(self, revolutions):
+        """
+        Integrate a single sample, timestamped now. Provided for compatibility with
+        :class:`approxeng.holochassis.chassis.DeadReckoning`
+
+        :param revolutions:
+            Sequence of wheel angles in revolutions
+        :return:
+            The updated pose
+        """
+        return self.update(timestamps=[time()], revolutions=revolutions)
+
+    def update_from_sampler(self, sampler):
+        """
+        Integrate every sample taken by an odometry sampler since the last call, as far as they're still held in its
+        ring buffer
+
+        :param sampler:
+            A :class:`approxeng.viridia.odometry.OdometrySampler`
+        :return:
+            The updated pose
+        """
+        self.sequence, timestamps, revolutions = sampler.block_since(self.sequence)
+        if len(timestamps) == 0:
+            return self.pose
+        return self.update(timestamps=np.frombuffer(timestamps, dtype=np.float64),
+                           revolutions=np.frombuffer(revolutions, dtype=np.float64))
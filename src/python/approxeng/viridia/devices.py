@@ -0,0 +1,231 @@
+"""
+Event driven detection of input devices. The kernel creates a node in /dev/input when a device such as a DualShock4
+connects, and removes it when the device disconnects, so watching that directory with inotify tells us about
+controllers coming and going as it happens, rather than having to poll for them.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+from threading import Lock, Thread
+from time import sleep
+
+IN_ATTRIB = 0x00000004
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+INOTIFY_EVENT = struct.Struct('iIII')
+'Header of each inotify event: watch descriptor, mask, cookie and the length of the name which follows'
+
+
+class InputDeviceWatcher:
+    """
+    Watches a directory of device nodes with inotify, calling a listener from a background thread whenever a device
+    node is added or removed. A node is reported as added both when it's created and when its attributes change, as
+    udev sets the permissions on new nodes just after creating them and they may not be usable until it has.
+    """
+
+    def __init__(self, listener, directory='/dev/input', prefix='event'):
+        """
+        Create a new watcher, call start() to start watching
+
+        :param listener:
+            Function called with the name of the device node and True if it was added, False if it was removed
+        :param directory:
+            Directory to watch, defaults to '/dev/input'
+        :param prefix:
+            Only nodes whose names start with this are reported, defaults to 'event' for evdev devices
+        """
+        self.listener = listener
+        self.directory = directory
+        self.prefix = prefix
+        self.fd = None
+        self.wake_read = None
+        self.wake_write = None
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        """
+        Start watching
+
+        :return:
+            This watcher, for chaining
+        :raises OSError:
+            If inotify isn't available or the directory can't be watched
+        """
+        if self.thread is None:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd < 0:
+                error = ctypes.get_errno()
+                raise OSError(error, os.strerror(error))
+            if libc.inotify_add_watch(fd, self.directory.encode(), IN_CREATE | IN_DELETE | IN_ATTRIB) < 0:
+                error = ctypes.get_errno()
+                os.close(fd)
+                raise OSError(error, os.strerror(error), self.directory)
+            self.fd = fd
+            self.wake_read, self.wake_write = os.pipe()
+            self.running = True
+            self.thread = Thread(target=self._watch_loop, name='input-device-watcher')
+            self.thread.daemon = True
+            self.thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stop watching
+        """
+        if self.thread is not None:
+            self.running = False
+            os.write(self.wake_write, b'x')
+            self.thread.join()
+            self.thread = None
+            for fd in [self.fd, self.wake_read, self.wake_write]:
+                os.close(fd)
+            self.fd = None
+
+    def _watch_loop(self):
+        while self.running:
+            readable, _, _ = select.select([self.fd, self.wake_read], [], [])
+            if self.fd not in readable:
+                continue
+            try:
+                data = os.read(self.fd, 4096)
+            except OSError:
+                continue
+            for name, added in parse_events(data):
+                if name.startswith(self.prefix):
+                    self.listener(name, added)
+
+
+def parse_events(data):
+    """
+    Parse a buffer read from an inotify file descriptor
+
+    :param data:
+        The bytes read
+    :return:
+        A list of (name, added) tuples, one for each event naming a file
+    """
+    events = []
+    offset = 0
+    while offset + INOTIFY_EVENT.size <= len(data):
+        _, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+        offset += INOTIFY_EVENT.size
+        name = data[offset:offset + length].rstrip(b'\0').decode()
+        offset += length
+        if name:
+            events.append((name, not mask & IN_DELETE))
+    return events
+
+
+class ControllerMonitor:
+    """
+    Keeps a :class:`approxeng.viridia.task.TaskManager` supplied with a bound controller. A controller is bound as soon
+    as its device appears in /dev/input and handed to the task manager with set_joystick, and when an input device
+    disappears the controller is released and the task manager told it has no joystick, which stops the motors until a
+    controller is bound again. The task manager, and everything it holds such as the active task, keep running
+    throughout.
+
+    Device nodes don't say which controller they belong to, so when any input device is removed the controller is
+    released and immediately re-bound if it's still present. While no controller is bound, binding is also retried
+    every retry_interval seconds in case a device appeared but couldn't be bound at the time.
+    """
+
+    def __init__(self, task_manager, resource_factory, display=None, directory='/dev/input', retry_interval=1.0):
+        """
+        Create a new monitor, call start() to bind any controller which is already connected and start watching
+
+        :param task_manager:
+            The :class:`approxeng.viridia.task.TaskManager` to supply with a joystick
+        :param resource_factory:
+            Function returning a new, un-entered, context manager which binds to the controller when entered and returns
+            the joystick, raising IOError if the controller isn't there. Typically an approxeng.input ControllerResource
+        :param display:
+            Optional, a :class:`approxeng.viridia.display.Display` on which to report connections. Defaults to None
+        :param directory:
+            Directory of input device nodes, defaults to '/dev/input'
+        :param retry_interval:
+            Time in seconds between attempts to bind while no controller is bound, defaults to 1.0
+        """
+        self.task_manager = task_manager
+        self.resource_factory = resource_factory
+        self.display = display
+        self.retry_interval = retry_interval
+        self.watcher = InputDeviceWatcher(listener=self._device_changed, directory=directory)
+        self.lock = Lock()
+        self.resource = None
+        self.connections = 0
+        self.running = False
+        self.retry_thread = None
+
+    def start(self):
+        """
+        Bind the controller if it's already connected, and start watching for it to come and go
+
+        :return:
+            This monitor, for chaining
+        """
+        self.watcher.start()
+        self.running = True
+        with self.lock:
+            self._connect()
+        self.retry_thread = Thread(target=self._retry_loop, name='controller-retry')
+        self.retry_thread.daemon = True
+        self.retry_thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stop watching and release the controller
+        """
+        self.running = False
+        self.watcher.stop()
+        with self.lock:
+            self._disconnect()
+
+    @property
+    def connected(self):
+        return self.resource is not None
+
+    def _device_changed(self, name, added):
+        with self.lock:
+            if not added and self.resource is not None:
+                self._disconnect()
+            if self.resource is None:
+                self._connect()
+
+    def _retry_loop(self):
+        while self.running:
+            sleep(self.retry_interval)
+            with self.lock:
+                if self.running and self.resource is None:
+                    self._connect()
+
+    def _connect(self):
+        resource = self.resource_factory()
+        try:
+            joystick = resource.__enter__()
+        except IOError:
+            return
+        self.resource = resource
+        self.connections += 1
+        self.task_manager.set_joystick(joystick)
+        if self.display is not None:
+            self.display.show('Found joystick', str(joystick))
+
+    def _disconnect(self):
+        if self.resource is None:
+            return
+        self.task_manager.set_joystick(None)
+        resource, self.resource = self.resource, None
+        try:
+            resource.__exit__(None, None, None)
+        except Exception as e:
+            # The device has gone, so releasing it may well fail
+            print 'Error releasing controller: {}'.format(e)
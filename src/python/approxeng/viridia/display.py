@@ -1,4 +1,9 @@
+import sys
 from abc import ABCMeta, abstractmethod
+from collections import deque
+from threading import Condition, Thread
+
+from approxeng.viridia.clock import SYSTEM_CLOCK
 
 
 class Display:
@@ -18,6 +23,21 @@ class Display:
         """
         pass
 
+    def log(self, source, message, *args):
+        """
+        Write a line of diagnostic output, such as the current pose. The default implementation prints it immediately,
+        displays which write from a background thread may drop messages rather than hold up the caller.
+
+        :param source:
+            Name of the source of the message, used for rate limiting, i.e. 'pose'
+        :param message:
+            The message, a format string if args are supplied. Formatting may be deferred, so args must not be changed
+            after the call
+        :param args:
+            Any arguments to the format string
+        """
+        print message.format(*args) if args else message
+
 
 class PrintDisplay(Display):
     """
@@ -49,3 +69,220 @@ class PrintDisplay(Display):
                 print message2
         self.last_message1 = message1
         self.last_message2 = message2
+
+
+class OutputSink:
+    """
+    Writes lines of text to a stream from a background thread, so callers never block on the stream, such as stdout
+    when it goes to journald through a slow pipe. Lines are queued in a ring buffer, when it's full the oldest line is
+    dropped. Each line has a source, and sources can be rate limited so that a task logging every tick can't flood the
+    buffer, lines from a source arriving sooner than its interval after the last one accepted are dropped. Lines which
+    are written, rate limited, and dropped from a full buffer are counted for each source.
+    """
+
+    def __init__(self, stream=None, capacity=256, default_interval=0.0, intervals=None, clock=None):
+        """
+        Create a new sink, call start() to start writing
+
+        :param stream:
+            The stream to write to, defaults to None for sys.stdout
+        :param capacity:
+            Maximum number of lines held waiting to be written, defaults to 256
+        :param default_interval:
+            Minimum time in seconds between lines from any one source, defaults to 0 for no rate limit
+        :param intervals:
+            Optional, a dict of source name to the minimum time between lines from that source, overriding the default
+        :param clock:
+            Optional, the clock rate limits are measured on, defaults to None for
+            :data:`approxeng.viridia.clock.SYSTEM_CLOCK`
+        """
+        self.clock = clock if clock is not None else SYSTEM_CLOCK
+        self.stream = stream if stream is not None else sys.stdout
+        self.capacity = capacity
+        self.default_interval = default_interval
+        self.intervals = dict(intervals) if intervals is not None else {}
+        self.lines = deque()
+        self.condition = Condition()
+        self.last_accepted = {}
+        self.counts = {}
+        self.writing = False
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        """
+        Start the writer thread
+
+        :return:
+            This sink, for chaining
+        """
+        if self.thread is None:
+            self.running = True
+            self.thread = Thread(target=self._write_loop, name='output-sink')
+            self.thread.daemon = True
+            self.thread.start()
+        return self
+
+    def stop(self, timeout=1.0):
+        """
+        Write any queued lines and stop the writer thread
+
+        :param timeout:
+            Maximum time in seconds to wait for queued lines to be written, defaults to 1.0
+        """
+        if self.thread is not None:
+            self.flush(timeout=timeout)
+            with self.condition:
+                self.running = False
+                self.condition.notify_all()
+            self.thread.join(timeout)
+            self.thread = None
+
+    def set_interval(self, source, interval):
+        """
+        Set the rate limit for a source
+
+        :param source:
+            Name of the source
+        :param interval:
+            Minimum time in seconds between lines from the source, 0 for no limit
+        """
+        self.intervals[source] = interval
+
+    def write(self, source, message, *args):
+        """
+        Queue a line to be written, this never blocks on the stream
+
+        :param source:
+            Name of the source of the line
+        :param message:
+            The line, a format string if args are supplied. Formatting happens on the writer thread, so args must not
+            be changed after the call
+        :param args:
+            Any arguments to the format string
+        :return:
+            True if the line was queued, False if it was dropped by the source's rate limit
+        """
+        now = self.clock.time()
+        with self.condition:
+            counts = self.counts.get(source)
+            if counts is None:
+                counts = self.counts[source] = [0, 0, 0]
+            interval = self.intervals.get(source, self.default_interval)
+            last = self.last_accepted.get(source)
+            if interval > 0 and last is not None and now - last < interval:
+                counts[1] += 1
+                return False
+            self.last_accepted[source] = now
+            if len(self.lines) >= self.capacity:
+                dropped_source = self.lines.popleft()[0]
+                self.counts[dropped_source][2] += 1
+            self.lines.append((source, message, args))
+            self.condition.notify_all()
+            return True
+
+    def flush(self, timeout=None):
+        """
+        Wait for all queued lines to be written
+
+        :param timeout:
+            Maximum time in seconds to wait, defaults to None to wait indefinitely
+        :return:
+            True if everything was written, False if the timeout expired first
+        """
+        # A real wait for the writer thread, whatever clock rate limits are measured on
+        deadline = None if timeout is None else SYSTEM_CLOCK.time() + timeout
+        with self.condition:
+            while self.lines or self.writing:
+                remaining = None if deadline is None else deadline - SYSTEM_CLOCK.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+    def _write_loop(self):
+        while True:
+            with self.condition:
+                while self.running and not self.lines:
+                    self.condition.wait()
+                if not self.lines:
+                    return
+                source, message, args = self.lines.popleft()
+                self.writing = True
+            try:
+                self.stream.write((message.format(*args) if args else str(message)) + '\n')
+                self.stream.flush()
+            except Exception as e:
+                # Don't let a bad format string or a closed stream kill the writer
+                sys.stderr.write('Output sink failed to write from {}: {}\n'.format(source, e))
+            with self.condition:
+                self.writing = False
+                self.counts[source][0] += 1
+                self.condition.notify_all()
+
+    def statistics(self):
+        """
+        :return:
+            A dict of source name to a dict of the number of lines 'written', 'rate_limited' and 'overflowed', the last
+            being those dropped because the buffer was full
+        """
+        with self.condition:
+            return {source: {'written': counts[0], 'rate_limited': counts[1], 'overflowed': counts[2]}
+                    for source, counts in self.counts.items()}
+
+    def __str__(self):
+        return 'OutputSink[ queued={}, {} ]'.format(
+            len(self.lines), ', '.join('{}={written}/{rate_limited}/{overflowed}'.format(source, **counts)
+                                       for source, counts in sorted(self.statistics().items())))
+
+
+class AsyncDisplay(Display):
+    """
+    Implementation of Display which prints to stdout, like :class:`approxeng.viridia.display.PrintDisplay`, but through
+    an :class:`approxeng.viridia.display.OutputSink` so the task loop never waits for the write. Messages shown on the
+    display are never rate limited, diagnostic output from log is limited to one line per log_interval for each source.
+    """
+
+    def __init__(self, sink=None, log_interval=0.5, clock=None):
+        """
+        Create a new display, starting its sink
+
+        :param sink:
+            Optional, the :class:`approxeng.viridia.display.OutputSink` to write to, defaults to None to create one
+            writing to stdout
+        :param log_interval:
+            Used when creating a sink, the minimum time in seconds between lines from each log source, defaults to 0.5
+        :param clock:
+            Used when creating a sink, the clock rate limits are measured on, defaults to None for
+            :data:`approxeng.viridia.clock.SYSTEM_CLOCK`
+        """
+        super(AsyncDisplay, self).__init__()
+        self.sink = sink
+        if self.sink is None:
+            self.sink = OutputSink(default_interval=log_interval, intervals={'display': 0.0}, clock=clock)
+        self.sink.start()
+        self.last_message1 = None
+        self.last_message2 = None
+
+    def show(self, message1=None, message2=None):
+        """
+        Show a message, made up of two components both of which are optional and default to None. As with
+        :class:`approxeng.viridia.display.PrintDisplay`, messages are only written when they change.
+
+        :param message1:
+            String 1
+        :param message2:
+            String 2
+        """
+        if message1 != self.last_message1 and message2 != self.last_message2:
+            if message2 is not None and message1 is not None:
+                self.sink.write('display', '{}\n{}', message1, message2)
+            elif message2 is None and message1 is not None:
+                self.sink.write('display', message1)
+            elif message1 is None and message2 is not None:
+                self.sink.write('display', message2)
+        self.last_message1 = message1
+        self.last_message2 = message2
+
+    def log(self, source, message, *args):
+        self.sink.write(source, message, *args)
@@ -1,21 +1,36 @@
 from approxeng.holochassis.drive import Drive
 
+from approxeng.viridia.kinematics import CompiledKinematics
+
 
 class ViridiaDrive(Drive):
     """
     Implementation of Drive to use Viridia's motors
     """
 
-    def __init__(self, chassis, motors):
+    def __init__(self, chassis, motors, odometry=None):
         """
         Create a new Drive instance
         :param motors: 
             A :class:`approxeng.viridia.motors.Motors` instance used to set motor speeds and read wheel angles
         :param chassis: 
             A :class:`approxeng.holochassis.chassis.HoloChassis` used to compute kinematics
+        :param odometry:
+            Optional, a :class:`approxeng.viridia.odometry.OdometrySampler` which is already reading wheel angles in
+            the background. If provided, dead reckoning integrates every sample it has taken since the last update
+            using a :class:`approxeng.viridia.dead_reckoning.BatchDeadReckoning`, instead of reading from the motors.
+            Defaults to None
         """
         super(ViridiaDrive, self).__init__(chassis=chassis)
         self.motors = motors
+        self.odometry = odometry
+        if self.odometry is not None:
+            from approxeng.viridia.dead_reckoning import BatchDeadReckoning
+            self.dead_reckoning = BatchDeadReckoning(chassis=chassis, sampler=self.odometry)
+        # Wheel speeds in RPM, this list is re-used for every update rather than being created each time
+        self.wheel_speeds = [0.0] * len(chassis.wheels)
+        # Kinematics to compute motor RPM directly, our motors run in the opposite sense to the chassis wheels
+        self.kinematics = CompiledKinematics(chassis=chassis, scale=-60)
 
     def enable_drive(self):
         """
@@ -31,9 +46,55 @@ class ViridiaDrive(Drive):
         self.motors.disable()
 
     def set_wheel_speeds_from_motion(self, motion):
-        speeds = [speed * -60 for speed in self.chassis.get_wheel_speeds(motion=motion).speeds]
-        self.motors.set_speeds(speeds)
+        self.set_wheel_speeds(motion.translation.x, motion.translation.y, motion.rotation)
+
+    def set_wheel_speeds(self, x, y, rotation):
+        """
+        Set the wheel speeds from the components of a motion, without requiring a Motion object. The speeds are
+        computed into the pre-allocated wheel_speeds list, so this can be called from the control loop without creating
+        any new objects.
+
+        :param x:
+            Translation along the x axis, mm/s
+        :param y:
+            Translation along the y axis, mm/s
+        :param rotation:
+            Rotation, radians/s
+        """
+        self.compute_wheel_speeds(x, y, rotation, self.wheel_speeds)
+        self.motors.set_speeds(self.wheel_speeds)
+
+    def apply_wheel_speeds(self, speeds):
+        """
+        Send previously computed motor speeds, for example from a cache. The speeds are copied into wheel_speeds.
+
+        :param speeds:
+            Sequence of motor speeds in RPM, as computed by compute_wheel_speeds
+        """
+        self.wheel_speeds[:] = speeds
+        self.motors.set_speeds(self.wheel_speeds)
+
+    def compute_wheel_speeds(self, x, y, rotation, speeds):
+        """
+        Compute motor speeds in RPM, including the sign change needed by our motors, writing them into an existing list.
+        Speeds are scaled back in the same way as :meth:`approxeng.holochassis.chassis.HoloChassis.get_wheel_speeds`
+        if any wheel would otherwise exceed its maximum speed.
+
+        :param x:
+            Translation along the x axis, mm/s
+        :param y:
+            Translation along the y axis, mm/s
+        :param rotation:
+            Rotation, radians/s
+        :param speeds:
+            A list with one entry per wheel, into which the speeds will be written
+        """
+        self.kinematics.wheel_speeds(x, y, rotation, speeds)
 
     def update_dead_reckoning(self):
-        self.dead_reckoning.update_from_revolutions(self.motors.read_angles())
+        if self.odometry is None:
+            self.dead_reckoning.update_from_revolutions(self.motors.read_angles())
+        else:
+            # Integrate every sample from the background sampler since we last looked
+            self.dead_reckoning.update_from_sampler(self.odometry)
         return self.dead_reckoning.pose
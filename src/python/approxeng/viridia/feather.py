@@ -1,8 +1,10 @@
 __author__ = 'tom'
 
+import traceback
+from threading import Condition, Thread
 from time import sleep
 
-import RPi.GPIO as gpio
+from approxeng.viridia.clock import SYSTEM_CLOCK
 
 
 class Feather:
@@ -11,9 +13,19 @@ class Feather:
     'src/arduino/feather' code for what's going to be listening to messages from here. This class wraps any calls
     to i2c send with a GPIO operation to pause the light-show, otherwise we get a lot of I2C failures as the FastLED
     library on the feather clashes badly with the I2C reception.
+
+    Pausing the lights takes around 20ms per message, so the feather can optionally send from a background thread. In
+    this mode calls return immediately. Lighting commands (hue, brightness, direction and mode) are coalesced so only
+    the most recent value of each is sent, and everything pending is sent within a single pause of the lights. Other
+    commands, such as kicks, are never dropped and are sent in the order they were requested. Call stop to send anything
+    pending and stop the thread.
     """
 
-    def __init__(self, i2c, i2c_address=0x31, led_disable_pin=27):
+    COALESCED_COMMANDS = [4, 1, 2, 3]
+    'Commands where only the latest value matters, in the order they should be sent'
+
+    def __init__(self, i2c, i2c_address=0x31, led_disable_pin=27, asynchronous=False, registers=None,
+                 direction_tolerance=0.01, gpio=None):
         """
         Create a new Feather proxy
         
@@ -23,13 +35,39 @@ class Feather:
             I2C address of the feather, defaults to 0x31
         :param led_disable_pin:
             The BCM number of the pin which is used to signal that the feather should pause and wait for data
+        :param asynchronous:
+            If True, send commands from a background thread rather than blocking the caller. Defaults to False
+        :param registers:
+            Optional, an instance of :class:`approxeng.viridia.registers.ShadowRegisters` used to skip lighting and
+            relay commands which wouldn't change the state of the feather. Kicks are always sent. Defaults to None
+        :param direction_tolerance:
+            If using shadow registers, direction changes in radians smaller than this won't be sent. Defaults to 0.01
+        :param gpio:
+            Optional, the GPIO module used to drive the LED disable pin. Defaults to None to import and use RPi.GPIO,
+            supply :class:`approxeng.viridia.simulation.SimulatedGPIO` to run without hardware
         """
+        if gpio is None:
+            import RPi.GPIO as gpio
+        self.gpio = gpio
         self.i2c = i2c
+        self.registers = registers
+        self.direction_tolerance = direction_tolerance
         self.i2c_address = i2c_address
         self.led_disable_pin = led_disable_pin
-        gpio.setmode(gpio.BCM)
-        gpio.setup(led_disable_pin, gpio.OUT)
-        gpio.output(self.led_disable_pin, 0)
+        self.gpio.setmode(self.gpio.BCM)
+        self.gpio.setup(led_disable_pin, self.gpio.OUT)
+        self.gpio.output(self.led_disable_pin, 0)
+        self.condition = Condition()
+        self.pending_state = {}
+        self.pending_commands = []
+        self.sending = False
+        self.errors = 0
+        self.running = asynchronous
+        self.sender = None
+        if asynchronous:
+            self.sender = Thread(target=self._send_loop, name='feather-sender')
+            self.sender.daemon = True
+            self.sender.start()
 
     def set_ring_hue(self, hue, spread=30):
         """
@@ -39,7 +77,7 @@ class Feather:
         :param spread: 
             Optional, the amount of hue spread. Defaults to 30, not used by all modes
         """
-        self._send(1, hue, spread)
+        self._write('hue', (1, hue, spread))
 
     def set_lighting_mode(self, mode):
         """
@@ -52,7 +90,7 @@ class Feather:
             2 - Show highlighted bar with single direction LED, used to indicate line follower progress. Direction must
                 be -1 to 1, other values lead to no highlight
         """
-        self._send(4, mode)
+        self._write('mode', (4, mode))
 
     def set_direction(self, radians):
         """
@@ -61,7 +99,7 @@ class Feather:
         :param radians: 
             Angle in radians to display
         """
-        self._send(3, float(radians))
+        self._write('direction', (3, float(radians)), self.direction_tolerance)
 
     def kick(self):
         """
@@ -76,13 +114,131 @@ class Feather:
         :param active: True to activate, False to de-activate
         """
         if active:
-            self._send(91)
+            self._write('relay', (91,))
         else:
-            self._send(90)
+            self._write('relay', (90,))
+
+    def flush(self, timeout=None):
+        """
+        If sending asynchronously, wait until all pending commands have been sent. Returns immediately otherwise.
+
+        :param timeout:
+            Maximum time in seconds to wait, defaults to None to wait indefinitely
+        :return:
+            True if everything has been sent, False if the timeout expired first
+        """
+        if timeout is not None:
+            deadline = SYSTEM_CLOCK.time() + timeout
+        with self.condition:
+            if self.sender is not None:
+                while self.pending_state or self.pending_commands or self.sending:
+                    if timeout is None:
+                        self.condition.wait()
+                    elif SYSTEM_CLOCK.time() >= deadline:
+                        return False
+                    else:
+                        self.condition.wait(deadline - SYSTEM_CLOCK.time())
+            return True
+
+    def stop(self, timeout=1.0):
+        """
+        If sending asynchronously, wait for pending commands to be sent and then stop the sender thread. Any commands
+        requested after this are sent synchronously. Does nothing otherwise.
+
+        :param timeout:
+            Maximum time in seconds to wait for pending commands, defaults to 1.0. Commands still pending when the
+            timeout expires are discarded
+        :return:
+            True if everything was sent, False if the timeout expired first
+        """
+        if self.sender is None:
+            return True
+        sent = self.flush(timeout=timeout)
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        self.sender.join()
+        self.sender = None
+        return sent
+
+    def _write(self, register, sequence, tolerance=0.0):
+        """
+        Send a command which sets some piece of state on the feather, unless shadow registers are in use and show that
+        it wouldn't change anything.
+        """
+        if self.registers is not None and \
+                not self.registers.should_write(self.i2c_address, register, sequence, tolerance):
+            return
+        try:
+            self._send(*sequence)
+        except:
+            if self.registers is not None:
+                self.registers.invalidate(self.i2c_address, register)
+            raise
 
     def _send(self, *sequence):
-        gpio.output(self.led_disable_pin, 1)
-        sleep(0.01)
-        self.i2c.send(self.i2c_address, *sequence)
+        with self.condition:
+            # Checked under the lock, so nothing can be queued once stop has told the sender to finish
+            if self.running:
+                if sequence[0] in Feather.COALESCED_COMMANDS:
+                    self.pending_state[sequence[0]] = sequence
+                else:
+                    self.pending_commands.append(sequence)
+                self.condition.notify_all()
+                return
+        self._send_sequences([sequence])
+
+    def _send_loop(self):
+        """
+        Run by the background sender thread, waits for commands then sends everything pending in one go
+        """
+        while True:
+            with self.condition:
+                while self.running and not (self.pending_state or self.pending_commands):
+                    self.condition.wait()
+                if not self.running:
+                    return
+                state = [self.pending_state[command] for command in Feather.COALESCED_COMMANDS if
+                         command in self.pending_state]
+                commands = self.pending_commands
+                self.pending_state = {}
+                self.pending_commands = []
+                self.sending = True
+            sent = []
+            try:
+                self._send_sequences(state + commands, sent)
+            except Exception as e:
+                self.errors += 1
+                # Resume from the failed command. A bus error is worth trying again, anything else is a bug which would
+                # just fail again, so skip that one command, but keep the sender running so flush doesn't wait forever
+                # and the rest are still sent.
+                resume = len(sent)
+                if not isinstance(e, IOError):
+                    print 'Feather sender failed: {}'.format(e)
+                    traceback.print_exc()
+                    resume += 1
+                # We don't know whether the failed command arrived, so make sure the next write to any register is sent
+                if self.registers is not None:
+                    self.registers.invalidate(self.i2c_address)
+                # Commands go back ahead of any queued since, so kicks are never dropped or re-ordered, and lighting
+                # state is only put back if it hasn't been set again in the meantime
+                with self.condition:
+                    for sequence in state[resume:]:
+                        self.pending_state.setdefault(sequence[0], sequence)
+                    self.pending_commands[:0] = commands[max(0, resume - len(state)):]
+            finally:
+                with self.condition:
+                    self.sending = False
+                    self.condition.notify_all()
+
+    def _send_sequences(self, sequences, sent=None):
+        self.gpio.output(self.led_disable_pin, 1)
         sleep(0.01)
-        gpio.output(self.led_disable_pin, 0)
+        try:
+            for sequence in sequences:
+                self.i2c.send(self.i2c_address, *sequence)
+                if sent is not None:
+                    sent.append(sequence)
+        finally:
+            sleep(0.01)
+            self.gpio.output(self.led_disable_pin, 0)
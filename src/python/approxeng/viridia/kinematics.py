@@ -0,0 +1,99 @@
+from approxeng.holochassis.chassis import Motion
+from euclid import Vector2
+
+
+class CompiledKinematics:
+    """
+    The kinematics of a :class:`approxeng.holochassis.chassis.HoloChassis`, reduced to a matrix. Wheel speeds are
+    linear in the translation and rotation of the robot, so the speed of each wheel is a weighted sum of the motion's
+    x, y and rotation components. The weights are found once, by asking the chassis for the wheel speeds for a unit
+    motion along each axis and undoing any scaling the chassis applied. They can include a constant factor, such as the
+    conversion from revolutions per second to our motors' RPM along with the sign change the motors need.
+
+    Saturation matches :meth:`approxeng.holochassis.chassis.HoloChassis.get_wheel_speeds`: if any wheel would exceed its
+    maximum speed, all wheel speeds are scaled back by the same factor so the fastest wheel runs at its maximum.
+
+    Single motions are computed in plain python, writing into an existing list, so the control loop doesn't need numpy
+    and doesn't allocate. Batches of motions, for simulation and replay, are computed with numpy.
+    """
+
+    def __init__(self, chassis, scale=1.0):
+        """
+        Compile the kinematics for a chassis
+
+        :param chassis:
+            The :class:`approxeng.holochassis.chassis.HoloChassis`
+        :param scale:
+            Factor applied to every wheel speed, defaults to 1.0 for revolutions per second. Use -60 for Viridia's
+            motors, which take RPM in the opposite sense to the chassis, or -1 to invert angles read from them
+        """
+        self.chassis = chassis
+        self.scale = scale
+        self.wheels = len(chassis.wheels)
+        columns = []
+        for motion in [Motion(translation=Vector2(1, 0), rotation=0),
+                       Motion(translation=Vector2(0, 1), rotation=0),
+                       Motion(translation=Vector2(0, 0), rotation=1)]:
+            wheel_speeds = chassis.get_wheel_speeds(motion=motion)
+            columns.append([speed * scale / wheel_speeds.scaling for speed in wheel_speeds.speeds])
+        self.matrix = [tuple(row) for row in zip(*columns)]
+        'One (x, y, rotation) row of weights per wheel'
+        self.max_speeds = [None if wheel.max_speed is None else abs(wheel.max_speed * scale)
+                           for wheel in chassis.wheels]
+        'Maximum speed of each wheel, in the scaled units, or None if unlimited'
+
+    def wheel_speeds(self, x, y, rotation, speeds):
+        """
+        Compute wheel speeds for a motion, writing them into an existing list
+
+        :param x:
+            Translation along the x axis, mm/s
+        :param y:
+            Translation along the y axis, mm/s
+        :param rotation:
+            Rotation, radians/s
+        :param speeds:
+            A list with one entry per wheel, into which the speeds will be written
+        :return:
+            The scaling applied to bring the speeds within range, 1.0 if none was needed
+        """
+        scale = 1.0
+        for index, (cx, cy, cr) in enumerate(self.matrix):
+            speed = cx * x + cy * y + cr * rotation
+            speeds[index] = speed
+            max_speed = self.max_speeds[index]
+            if max_speed is not None and abs(speed) > max_speed:
+                scale = min(scale, max_speed / abs(speed))
+        if scale < 1.0:
+            for index in range(len(speeds)):
+                speeds[index] *= scale
+        return scale
+
+    def wheel_speeds_batch(self, motions):
+        """
+        Compute wheel speeds for many motions at once
+
+        :param motions:
+            Array-like of shape (n, 3), each row holding the x and y translation in mm/s and rotation in radians/s
+        :return:
+            A tuple of a numpy array of shape (n, wheels) containing the wheel speeds, and a numpy array of shape (n,)
+            containing the scaling applied to each motion
+        """
+        import numpy as np
+        speeds = np.asarray(motions, dtype=np.float64).reshape(-1, 3).dot(np.array(self.matrix).T)
+        limits = np.array([np.inf if max_speed is None else max_speed for max_speed in self.max_speeds])
+        with np.errstate(divide='ignore'):
+            scaling = np.minimum(1.0, np.min(limits / np.abs(speeds), axis=1))
+        return speeds * scaling[:, np.newaxis], scaling
+
+    def inverse(self):
+        """
+        The pseudo-inverse of the kinematics matrix, which maps wheel movements back to the robot's motion. Wheel
+        movements must be in the scaled units, including the sign, so to map changes in angle read from Viridia's
+        motors, which turn in the opposite sense to the chassis wheels, compile the kinematics with scale=-1.
+
+        :return:
+            A numpy array of shape (3, wheels)
+        """
+        import numpy as np
+        return np.linalg.pinv(np.array(self.matrix))
@@ -6,7 +6,7 @@ class Motors:
     Handles the mechaduino servo motors over I2C
     """
 
-    def __init__(self, i2c, base_address=0x61, motor_count=3):
+    def __init__(self, i2c, base_address=0x61, motor_count=3, registers=None, speed_tolerance=0.0):
         """
         Create a new instance, using the supplied :class:approxeng.pi2arduino.I2CHelper to manage communication
         
@@ -18,10 +18,18 @@ class Motors:
         :param motor_count:
             The number of motors, used when sending messages such as enable / disable to all controllers.
             Defaults to 3
+        :param registers:
+            Optional, an instance of :class:`approxeng.viridia.registers.ShadowRegisters` used to skip writes which
+            wouldn't change the state of a motor. Defaults to None, sending every write
+        :param speed_tolerance:
+            If using shadow registers, speed changes in RPM smaller than this won't be sent. Defaults to 0.0
         """
         self.i2c = i2c
         self.base_address = base_address
         self.motor_count = motor_count
+        self.registers = registers
+        self.speed_tolerance = speed_tolerance
+        self.last_angles = None
 
     def set_speeds(self, speeds):
         """
@@ -32,14 +40,14 @@ class Motors:
         """
         for address_offset, speed in enumerate(speeds):
             # Command 0 sets velocity mode and setpoint
-            self.i2c.send(self.base_address + address_offset, 0, float(speed))
+            self._write(self.base_address + address_offset, 'speed', (0, float(speed)), self.speed_tolerance)
 
     def enable_motor(self, motor):
         """
         Enable a single motor, motors are specified by offset from base address, so in [0,1,2] for our robot
         """
         # Command 1 enables closed loop control
-        self.i2c.send(self.base_address + motor, 1)
+        self._write(self.base_address + motor, 'enable', (1,))
 
     def enable(self):
         """
@@ -53,7 +61,7 @@ class Motors:
         Disable a single motor, motors are specified by offset from base address, so in [0,1,2] for our robot
         """
         # Command 2 disables closed loop control
-        self.i2c.send(self.base_address + motor, 2)
+        self._write(self.base_address + motor, 'enable', (2,))
 
     def disable(self):
         """
@@ -64,12 +72,52 @@ class Motors:
         for motor in range(0, self.motor_count):
             self.disable_motor(motor)
 
+    def disable_direct(self, i2c):
+        """
+        Disable all motors by writing straight to an I2C interface, bypassing this instance's own I2C interface and the
+        shadow registers. Used by :class:`approxeng.viridia.watchdog.TickWatchdog` to stop the motors from its own
+        thread when the task loop is stuck, possibly holding the bus scheduler with a hung transaction. The shadow
+        'enable' registers are invalidated afterwards, so the next enable from the task loop is always sent.
+
+        :param i2c:
+            The raw :class:`approxeng.pi2arduino.I2CHelper`, not a client of the bus scheduler
+        :raises IOError:
+            If any motor couldn't be disabled, after trying all of them
+        """
+        error = None
+        for motor in range(0, self.motor_count):
+            try:
+                # Command 2 disables closed loop control
+                i2c.send(self.base_address + motor, 2)
+            except IOError as e:
+                error = e
+        if self.registers is not None:
+            for motor in range(0, self.motor_count):
+                self.registers.invalidate(self.base_address + motor, 'enable')
+        if error is not None:
+            raise error
+
+    def _write(self, address, register, sequence, tolerance=0.0):
+        """
+        Send a command to a motor, unless shadow registers are in use and show it wouldn't change anything
+        """
+        if self.registers is not None and not self.registers.should_write(address, register, sequence, tolerance):
+            return
+        try:
+            self.i2c.send(address, *sequence)
+        except:
+            if self.registers is not None:
+                self.registers.invalidate(address, register)
+            raise
+
     def read_angles(self):
         """
         Read angle data from all motors
         
         :return: 
-            A sequence of floating point values, specified in overall revolutions since initialisation
+            A sequence of floating point values, specified in overall revolutions since initialisation. This is also
+            kept as last_angles
         """
-        return [self.i2c.read(self.base_address + address_offset, 'f')[0]
-                for address_offset in range(0, self.motor_count)]
+        self.last_angles = [self.i2c.read(self.base_address + address_offset, 'f')[0]
+                            for address_offset in range(0, self.motor_count)]
+        return self.last_angles
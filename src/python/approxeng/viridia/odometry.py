@@ -0,0 +1,161 @@
+import traceback
+from array import array
+from threading import Lock, Thread
+
+from approxeng.viridia.clock import SYSTEM_CLOCK
+
+
+class OdometrySampler:
+    """
+    Reads the wheel angles from the mechaduinos at a fixed rate on a background thread, storing each set of angles
+    along with the time it was read in a ring buffer. Consumers such as the drive's dead reckoning and the tasks can
+    then pick up the latest sample, or every sample since the last one they used, without waiting on the I2C bus.
+
+    The sampler reads from the motors on its own thread, so the motors must be using an I2C interface which is safe to
+    share between threads, such as a client of :class:`approxeng.viridia.bus.BusScheduler`.
+    """
+
+    def __init__(self, motors, rate=100, capacity=1024, clock=None):
+        """
+        Create a new sampler, call start() to begin sampling
+
+        :param motors:
+            The :class:`approxeng.viridia.motors.Motors` to read from
+        :param rate:
+            Samples per second, defaults to 100
+        :param capacity:
+            The number of samples held in the ring buffer, defaults to 1024
+        :param clock:
+            Optional, the clock samples are timed and scheduled on, defaults to None for
+            :data:`approxeng.viridia.clock.SYSTEM_CLOCK`. This should be the task manager's clock, so sample timestamps
+            can be compared with tick timestamps
+        """
+        self.motors = motors
+        self.clock = clock if clock is not None else SYSTEM_CLOCK
+        self.period = 1.0 / rate
+        self.capacity = capacity
+        self.wheels = motors.motor_count
+        self.timestamps = array('d', [0.0] * capacity)
+        self.angles = array('d', [0.0] * (capacity * self.wheels))
+        self.count = 0
+        self.errors = 0
+        self.lock = Lock()
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        """
+        Start the background sampling thread, if not already running
+        """
+        if self.thread is None:
+            self.running = True
+            self.thread = Thread(target=self._sample_loop, name='odometry-sampler')
+            self.thread.daemon = True
+            self.thread.start()
+
+    def stop(self):
+        """
+        Stop the background sampling thread, waiting for it to finish
+        """
+        if self.thread is not None:
+            self.running = False
+            self.thread.join()
+            self.thread = None
+
+    def _sample_loop(self):
+        deadline = self.clock.time()
+        while self.running:
+            try:
+                self.add_sample(timestamp=self.clock.time(), angles=self.motors.read_angles())
+            except IOError:
+                self.errors += 1
+            except Exception as e:
+                # Anything else is a bug rather than a bus glitch, but dead reckoning is blind without samples, so log
+                # it and carry on sampling rather than letting the thread die
+                self.errors += 1
+                print 'Odometry sample failed: {}'.format(e)
+                traceback.print_exc()
+            deadline += self.period
+            now = self.clock.time()
+            if deadline > now:
+                self.clock.sleep(deadline - now)
+            else:
+                # Running late, don't try to catch up
+                deadline = now
+
+    def add_sample(self, timestamp, angles):
+        """
+        Add a sample to the ring buffer, this is called by the sampling thread but can also be used to feed in samples
+        from elsewhere, for example when replaying a log
+
+        :param timestamp:
+            Time, in seconds, that the angles were read
+        :param angles:
+            Sequence of wheel angles, in revolutions
+        """
+        with self.lock:
+            index = self.count % self.capacity
+            self.timestamps[index] = timestamp
+            offset = index * self.wheels
+            for wheel in range(self.wheels):
+                self.angles[offset + wheel] = angles[wheel]
+            self.count += 1
+
+    def latest(self):
+        """
+        Get the most recent sample
+
+        :return:
+            A tuple of (sequence, timestamp, angles), where sequence is the number of samples taken before this one, or
+            None if no samples have been taken yet
+        """
+        with self.lock:
+            if self.count == 0:
+                return None
+            return self._sample(self.count - 1)
+
+    def samples_since(self, sequence):
+        """
+        Get all samples taken after a given sample, as far as they're still held in the ring buffer
+
+        :param sequence:
+            The sequence number of the last sample already seen, or -1 to get every sample in the buffer
+        :return:
+            A list of (sequence, timestamp, angles) tuples, oldest first
+        """
+        with self.lock:
+            first = max(sequence + 1, self.count - self.capacity, 0)
+            return [self._sample(s) for s in range(first, self.count)]
+
+    def block_since(self, sequence):
+        """
+        Get all samples taken after a given sample as flat arrays, without building a tuple per sample. This is the
+        form used by :class:`approxeng.viridia.dead_reckoning.BatchDeadReckoning`.
+
+        :param sequence:
+            The sequence number of the last sample already seen, or -1 to get every sample in the buffer
+        :return:
+            A tuple of (last_sequence, timestamps, angles), where last_sequence is the sequence number of the last
+            sample returned, or the supplied sequence if there are no new samples, timestamps is an array('d') of
+            sample times, oldest first, and angles an array('d') holding the wheel angles for each sample in turn
+        """
+        with self.lock:
+            first = max(sequence + 1, self.count - self.capacity, 0)
+            if first >= self.count:
+                return sequence, array('d'), array('d')
+            start = first % self.capacity
+            end = start + self.count - first
+            if end <= self.capacity:
+                timestamps = self.timestamps[start:end]
+                angles = self.angles[start * self.wheels:end * self.wheels]
+            else:
+                # Samples wrap around the end of the ring
+                end -= self.capacity
+                timestamps = self.timestamps[start:] + self.timestamps[:end]
+                angles = self.angles[start * self.wheels:] + self.angles[:end * self.wheels]
+            return self.count - 1, timestamps, angles
+
+    def _sample(self, sequence):
+        index = sequence % self.capacity
+        offset = index * self.wheels
+        return sequence, self.timestamps[index], list(self.angles[offset:offset + self.wheels])
@@ -0,0 +1,259 @@
+import sys
+
+from approxeng.viridia.clock import SYSTEM_CLOCK
+
+
+class LatencyHistogram:
+    """
+    Rolling record of the most recent latency samples for a single phase of the task loop, used to compute percentiles
+    over a window of recent ticks. Samples are held in a fixed size ring so recording a value never allocates a new
+    container, the sort needed to compute percentiles only happens when the histogram is queried.
+    """
+
+    def __init__(self, window=1000):
+        """
+        Create a new histogram
+
+        :param window:
+            The number of most recent samples to retain, defaults to 1000
+        """
+        self.window = window
+        self.samples = [0.0] * window
+        self.index = 0
+        self.count = 0
+
+    def add(self, value):
+        """
+        Record a sample
+
+        :param float value:
+            The sample, in seconds
+        """
+        self.samples[self.index] = value
+        self.index = (self.index + 1) % self.window
+        self.count += 1
+
+    def _retained(self):
+        return sorted(self.samples[:min(self.count, self.window)])
+
+    def percentile(self, p):
+        """
+        Get a percentile over the retained samples
+
+        :param p:
+            The percentile, between 0 and 100
+        :return:
+            The sample value at that percentile, or None if no samples have been recorded
+        """
+        retained = self._retained()
+        if len(retained) == 0:
+            return None
+        return retained[min(len(retained) - 1, int(len(retained) * p / 100.0))]
+
+    def summary(self):
+        """
+        Summarise the retained samples
+
+        :return:
+            A dict containing 'count', the total number of samples ever recorded, and 'p50', 'p99' and 'max' computed
+            over the retained samples. The latter three are None if nothing has been recorded.
+        """
+        retained = self._retained()
+        if len(retained) == 0:
+            return {'count': 0, 'p50': None, 'p99': None, 'max': None}
+        return {'count': self.count,
+                'p50': retained[int(len(retained) * 0.5)],
+                'p99': retained[min(len(retained) - 1, int(len(retained) * 0.99))],
+                'max': retained[-1]}
+
+
+class TickProfiler:
+    """
+    Times each phase of every tick of the task loop and keeps a :class:`approxeng.viridia.profiling.LatencyHistogram`
+    for each phase, separately for each class of task. The phases recorded are:
+
+    'context' - building the task context, including the joystick button history
+    'buttons' - just the call to get_and_clear_button_press_history
+    'init' - the active task's init_task
+    'poll' - the active task's poll_task, this includes any I2C traffic it causes
+    'i2c' - the total time spent in I2C transactions during the tick, requires the I2CHelper to be wrapped with
+    :meth:`approxeng.viridia.profiling.TickProfiler.instrument`
+    'switch' - shutting down the outgoing task and setting up the ClearStateTask when switching tasks
+    'tick' - the entire tick, excluding any time the scheduler spends sleeping
+
+    The task manager drives this through start_tick, start, stop and end_tick.
+    """
+
+    PHASES = ('context', 'buttons', 'init', 'poll', 'i2c', 'switch', 'tick')
+
+    def __init__(self, window=1000, clock=None):
+        """
+        Create a new profiler
+
+        :param window:
+            The number of most recent samples to retain for each histogram, defaults to 1000
+        :param clock:
+            Optional, the clock used to time phases, defaults to None for :data:`approxeng.viridia.clock.SYSTEM_CLOCK`.
+            Profiles measure the real time spent in each phase, so keep the default when the task loop is on a virtual
+            clock unless the simulation advances it to model processing time
+        """
+        self.window = window
+        self.clock = clock if clock is not None else SYSTEM_CLOCK
+        self.histograms = {}
+        self.task_name = None
+        self.phase = None
+        self.tick_start = None
+        self.phase_start = None
+        self.i2c_time = 0.0
+        self._task_histograms = None
+
+    def instrument(self, i2c):
+        """
+        Wrap an I2CHelper such that time spent in its send and read calls is recorded against the current tick
+
+        :param i2c:
+            An instance of :class:`approxeng.pi2arduino.I2CHelper`
+        :return:
+            A :class:`approxeng.viridia.profiling.TimedI2C` which should be used in place of the supplied helper
+        """
+        return TimedI2C(i2c=i2c, profiler=self)
+
+    def start_tick(self, task):
+        """
+        Start timing a tick
+
+        :param task:
+            The task which is active for this tick, histograms are kept per task class
+        """
+        task_name = task.__class__.__name__
+        if task_name != self.task_name:
+            self.task_name = task_name
+            if task_name not in self.histograms:
+                self.histograms[task_name] = dict((phase, LatencyHistogram(window=self.window))
+                                                  for phase in TickProfiler.PHASES)
+            self._task_histograms = self.histograms[task_name]
+        self.i2c_time = 0.0
+        self.phase = None
+        self.tick_start = self.clock.time()
+
+    def start(self, phase):
+        """
+        Start timing a phase within the current tick
+        """
+        self.phase = phase
+        self.phase_start = self.clock.time()
+
+    def stop(self):
+        """
+        Stop timing the current phase and record its duration
+        """
+        if self.phase is not None:
+            self._task_histograms[self.phase].add(self.clock.time() - self.phase_start)
+            self.phase = None
+
+    def record(self, phase, seconds):
+        """
+        Record a duration for a phase which was timed externally
+        """
+        self._task_histograms[phase].add(seconds)
+
+    def add_i2c_time(self, seconds):
+        """
+        Add time spent on the I2C bus to the current tick
+        """
+        self.i2c_time += seconds
+
+    def end_tick(self):
+        """
+        Finish timing the current tick, recording the total tick time and the I2C time
+        """
+        if self.tick_start is not None:
+            self._task_histograms['tick'].add(self.clock.time() - self.tick_start)
+            self._task_histograms['i2c'].add(self.i2c_time)
+            self.tick_start = None
+
+    def summary(self):
+        """
+        Get the current latency summaries
+
+        :return:
+            A dict of task class name to dict of phase name to the summary dict produced by
+            :meth:`approxeng.viridia.profiling.LatencyHistogram.summary`, phases with no samples are omitted
+        """
+        result = {}
+        for task_name, histograms in self.histograms.items():
+            result[task_name] = dict((phase, histogram.summary()) for phase, histogram in histograms.items()
+                                     if histogram.count > 0)
+        return result
+
+    def dump(self, stream=None):
+        """
+        Write a table of the current latency summaries, in milliseconds
+
+        :param stream:
+            A file-like object to write to, defaults to stdout
+        """
+        if stream is None:
+            stream = sys.stdout
+        stream.write('{:<24}{:<10}{:>10}{:>10}{:>10}{:>10}\n'.format('task', 'phase', 'count', 'p50', 'p99', 'max'))
+        summary = self.summary()
+        for task_name in sorted(summary):
+            for phase in TickProfiler.PHASES:
+                if phase in summary[task_name]:
+                    s = summary[task_name][phase]
+                    stream.write('{:<24}{:<10}{:>10}{:>10.3f}{:>10.3f}{:>10.3f}\n'.format(
+                        task_name, phase, s['count'], s['p50'] * 1000, s['p99'] * 1000, s['max'] * 1000))
+        stream.flush()
+
+
+class NullProfiler:
+    """
+    Stands in for a :class:`approxeng.viridia.profiling.TickProfiler` when profiling is disabled, all operations are
+    no-ops.
+    """
+
+    def instrument(self, i2c):
+        return i2c
+
+    def start_tick(self, task):
+        pass
+
+    def start(self, phase):
+        pass
+
+    def stop(self):
+        pass
+
+    def record(self, phase, seconds):
+        pass
+
+    def add_i2c_time(self, seconds):
+        pass
+
+    def end_tick(self):
+        pass
+
+
+class TimedI2C:
+    """
+    Wraps an :class:`approxeng.pi2arduino.I2CHelper` and reports the time spent in each send or read to a
+    :class:`approxeng.viridia.profiling.TickProfiler`
+    """
+
+    def __init__(self, i2c, profiler):
+        self.i2c = i2c
+        self.profiler = profiler
+
+    def send(self, address, *sequence):
+        start = self.profiler.clock.time()
+        try:
+            return self.i2c.send(address, *sequence)
+        finally:
+            self.profiler.add_i2c_time(self.profiler.clock.time() - start)
+
+    def read(self, address, format_string):
+        start = self.profiler.clock.time()
+        try:
+            return self.i2c.read(address, format_string)
+        finally:
+            self.profiler.add_i2c_time(self.profiler.clock.time() - start)
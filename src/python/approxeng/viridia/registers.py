@@ -0,0 +1,111 @@
+from approxeng.viridia.clock import SYSTEM_CLOCK
+
+
+class ShadowRegisters:
+    """
+    Keeps a shadow copy of the last value written to each register of each I2C device, so that writes which wouldn't
+    change the state of the device can be skipped. Device classes such as :class:`approxeng.viridia.motors.Motors` and
+    :class:`approxeng.viridia.feather.Feather` ask this class whether a write is needed before sending anything over
+    the bus.
+
+    A register here is just a name for a piece of device state, it doesn't need to correspond to a single command. For
+    example, the mechaduino enable and disable commands both write to the same 'enable' register, as sending one
+    replaces the effect of the other.
+
+    To stop the device state going stale, for example if a device was reset or a write was lost, every register is
+    re-sent once the keepalive interval has passed since it was last written, even if the value hasn't changed.
+    """
+
+    def __init__(self, keepalive=1.0, clock=None):
+        """
+        Create a new, empty, set of shadow registers
+
+        :param keepalive:
+            The maximum time in seconds for which an unchanged value will be suppressed before it is sent again. Set to
+            None to never re-send unchanged values. Defaults to 1.0
+        :param clock:
+            Optional, the clock the keepalive interval is measured on, defaults to None for
+            :data:`approxeng.viridia.clock.SYSTEM_CLOCK`
+        """
+        self.keepalive = keepalive
+        self.clock = clock if clock is not None else SYSTEM_CLOCK
+        self.registers = {}
+        self.writes = {}
+        self.saved = {}
+
+    def should_write(self, address, register, sequence, tolerance=0.0):
+        """
+        Determine whether a write is needed, updating the shadow copy if it is. Callers must then actually perform the
+        write, and should call invalidate if the write fails.
+
+        :param address:
+            The I2C address of the device
+        :param register:
+            Name of the register being written
+        :param sequence:
+            The sequence of values which would be sent to the device
+        :param tolerance:
+            Numeric values in the sequence which differ by no more than this from the last value sent are treated as
+            unchanged. Defaults to 0.0
+        :return:
+            True if the write should be sent, False if it can be skipped
+        """
+        now = self.clock.time()
+        key = (address, register)
+        shadow = self.registers.get(key)
+        if shadow is not None:
+            last_sequence, last_time = shadow
+            if (self.keepalive is None or now - last_time < self.keepalive) and \
+                    ShadowRegisters._matches(last_sequence, sequence, tolerance):
+                self.saved[address] = self.saved.get(address, 0) + 1
+                return False
+        self.registers[key] = (sequence, now)
+        self.writes[address] = self.writes.get(address, 0) + 1
+        return True
+
+    @staticmethod
+    def _matches(a, b, tolerance):
+        if len(a) != len(b):
+            return False
+        for value_a, value_b in zip(a, b):
+            if isinstance(value_a, float) or isinstance(value_b, float):
+                if abs(value_a - value_b) > tolerance:
+                    return False
+            elif value_a != value_b:
+                return False
+        return True
+
+    def invalidate(self, address=None, register=None):
+        """
+        Forget shadow values, so that the next write to the affected registers is always sent
+
+        :param address:
+            If specified, only forget values for this device address. Defaults to None, forgetting all devices
+        :param register:
+            If specified, only forget values for this register. Defaults to None, forgetting all registers
+        """
+        for key in list(self.registers.keys()):
+            if (address is None or key[0] == address) and (register is None or key[1] == register):
+                # Another thread may have invalidated the same key since the copy of the keys was taken
+                self.registers.pop(key, None)
+
+    @property
+    def total_saved(self):
+        """
+        The total number of writes which have been skipped across all devices
+        """
+        return sum(self.saved.values())
+
+    def statistics(self):
+        """
+        Get write statistics for each device
+
+        :return:
+            A dict of I2C address to dict containing 'writes', the number of writes which were sent, and 'saved', the
+            number which were skipped
+        """
+        return dict((address, {'writes': self.writes.get(address, 0), 'saved': self.saved.get(address, 0)})
+                    for address in set(self.writes.keys()) | set(self.saved.keys()))
+
+    def __str__(self):
+        return 'ShadowRegisters[ writes={}, saved={} ]'.format(sum(self.writes.values()), self.total_saved)
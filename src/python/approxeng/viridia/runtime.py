@@ -0,0 +1,703 @@
+"""
+Cooperative task runtime. Python 2 has no asyncio, so this is a small event loop built on generators in the same style:
+a coroutine is a generator which yields the things it's waiting for - a :class:`approxeng.viridia.runtime.Sleep`, a
+:class:`approxeng.viridia.runtime.Future`, a blocking :class:`approxeng.viridia.runtime.Call` to be run on a worker
+thread, another coroutine, or None to just let everything else run - and is resumed with the result once it's
+available. While one coroutine waits, the others run, so background services such as odometry sampling can share the
+loop with the active task rather than each needing a thread.
+
+:class:`approxeng.viridia.runtime.RuntimeTaskManager` runs the task loop itself as a coroutine. Existing tasks are
+polled exactly as by :class:`approxeng.viridia.task.TaskManager`, while subclasses of
+:class:`approxeng.viridia.runtime.CoroutineTask` are written as a single coroutine which waits for ticks, frames, timers
+and I2C as it needs them. Coroutine tasks also run on the plain task manager, which steps them once per tick through a
+:class:`approxeng.viridia.runtime.PolledCoroutine`.
+"""
+
+import heapq
+import os
+import traceback
+from abc import abstractmethod
+from collections import deque
+from threading import Condition, Lock, Thread
+
+from approxeng.viridia.clock import SYSTEM_CLOCK
+from approxeng.viridia.task import TaskManager, Task, ExitTask
+
+
+class Cancelled(Exception):
+    """
+    Raised by :meth:`approxeng.viridia.runtime.Future.result` for a coroutine which was cancelled
+    """
+    pass
+
+
+class Future:
+    """
+    A result which will be available at some point, possibly set from another thread. Yield a future from a coroutine
+    to wait for it, the coroutine is resumed with the result or has the exception raised into it.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.is_done = False
+        self.value = None
+        self.exception = None
+        self.callbacks = []
+
+    def done(self):
+        return self.is_done
+
+    def result(self):
+        """
+        Get the result
+
+        :return:
+            The result
+        :raises:
+            The exception the future completed with, if any
+        """
+        if not self.is_done:
+            raise RuntimeError('Future is not done')
+        if self.exception is not None:
+            raise self.exception
+        return self.value
+
+    def set_result(self, value):
+        self._complete(value, None)
+
+    def set_exception(self, exception):
+        self._complete(None, exception)
+
+    def _complete(self, value, exception):
+        with self.lock:
+            if self.is_done:
+                return
+            self.value = value
+            self.exception = exception
+            self.is_done = True
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+    def add_done_callback(self, callback):
+        """
+        Call a function with this future once it completes, immediately if it already has
+
+        :param callback:
+            Function taking the future
+        """
+        with self.lock:
+            if not self.is_done:
+                self.callbacks.append(callback)
+                return
+        callback(self)
+
+
+class Sleep:
+    """
+    Yield to wait for a number of seconds
+    """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+
+class Call:
+    """
+    Yield to run a blocking function, such as an I2C transaction, on one of the runtime's worker threads. The
+    coroutine is resumed with the function's return value, or has its exception raised into it.
+    """
+
+    def __init__(self, function, *args, **kwargs):
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+
+
+class Coroutine:
+    """
+    Handle for a coroutine running in a :class:`approxeng.viridia.runtime.Runtime`. Yield the handle from another
+    coroutine to wait for it to finish.
+
+    :ivar future:
+        A :class:`approxeng.viridia.runtime.Future` which completes when the coroutine finishes, with None or with the
+        exception which ended it
+    """
+
+    def __init__(self, runtime, generator, name, stepped=False):
+        self.runtime = runtime
+        self.generator = generator
+        self.name = name
+        self.stepped = stepped
+        self.future = Future()
+        self.wake_count = 0
+        self.wakeup = None
+
+    def done(self):
+        return self.future.done()
+
+    def cancel(self):
+        """
+        Stop the coroutine. GeneratorExit is raised at the point it's waiting, so finally blocks run.
+        """
+        if not self.future.done():
+            self.generator.close()
+            self.future.set_exception(Cancelled(self.name))
+
+    def __str__(self):
+        return 'Coroutine[ name={}, done={} ]'.format(self.name, self.done())
+
+
+class Runtime:
+    """
+    Single threaded event loop for generator based coroutines. Blocking calls are passed to worker threads, which
+    wake the loop through a pipe when they finish, so the loop itself never polls.
+    """
+
+    def __init__(self, workers=1, clock=None):
+        """
+        Create a new runtime
+
+        :param workers:
+            The number of worker threads used for :class:`approxeng.viridia.runtime.Call`, defaults to 1. A single
+            worker keeps I2C transactions from coroutines in submission order. With no workers calls are made straight
+            away on the loop's own thread, blocking it, which is what's needed to run on a virtual clock
+        :param clock:
+            Optional, the clock timers run on, defaults to None for :data:`approxeng.viridia.clock.SYSTEM_CLOCK`. With a
+            :class:`approxeng.viridia.clock.VirtualClock` the loop moves time on to its next timer rather than waiting
+        """
+        self.clock = clock if clock is not None else SYSTEM_CLOCK
+        self.ready = deque()
+        self.timers = []
+        self.timer_sequence = 0
+        self.woken = deque()
+        self.wake_read, self.wake_write = os.pipe()
+        self.calls = deque()
+        self.call_condition = Condition()
+        self.workers = [Thread(target=self._worker_loop, name='runtime-worker-{}'.format(index))
+                        for index in range(workers)]
+        for worker in self.workers:
+            worker.daemon = True
+            worker.start()
+        self.coroutines = []
+        self.running = False
+        self.errors = []
+
+    def spawn(self, generator, name=None, stepped=False):
+        """
+        Start running a coroutine
+
+        :param generator:
+            A generator, as returned by calling a coroutine function
+        :param name:
+            Name used in diagnostics, defaults to the generator's name
+        :param stepped:
+            If True the loop never runs the coroutine itself, it's only run when step() is called for it. Use this to
+            run a coroutine at a particular point in some other coroutine, as the task loop does with the active task.
+            Defaults to False
+        :return:
+            A :class:`approxeng.viridia.runtime.Coroutine`
+        """
+        coroutine = Coroutine(runtime=self, generator=generator, name=name or generator.__name__, stepped=stepped)
+        self.coroutines.append(coroutine)
+        self.ready.append((coroutine, coroutine.wake_count, None, None))
+        return coroutine
+
+    def run(self, until=None):
+        """
+        Run the loop
+
+        :param until:
+            Optional, a :class:`approxeng.viridia.runtime.Coroutine` or :class:`approxeng.viridia.runtime.Future`. The
+            loop returns once this completes. Defaults to None, to run until there are no coroutines left or stop() is
+            called
+        :return:
+            The result of until, if specified
+        """
+        future = until.future if isinstance(until, Coroutine) else until
+        self.running = True
+        while self.running:
+            # Checked after every pass, as the last coroutine may have finished in it, in which case there may be
+            # nothing left to wake the loop
+            if future is not None and future.done():
+                return future.result()
+            if future is None and not self.coroutines:
+                return None
+            if not self.ready:
+                self._wait()
+            self._run_ready()
+
+    def stop(self):
+        """
+        Make run return once the coroutine currently running yields
+        """
+        self.running = False
+        self._wake_loop()
+
+    def shutdown(self):
+        """
+        Cancel all coroutines and stop the worker threads
+        """
+        for coroutine in list(self.coroutines):
+            coroutine.cancel()
+        self.coroutines = []
+        with self.call_condition:
+            self.calls.append(None)
+            self.call_condition.notify_all()
+
+    def step(self, coroutine):
+        """
+        Run a coroutine started with stepped=True, if whatever it was waiting for has happened, and carry on running it
+        until it has to wait for something which hasn't. A coroutine which yields None waits for the next call to step.
+
+        :param coroutine:
+            The :class:`approxeng.viridia.runtime.Coroutine` to run
+        """
+        entry, coroutine.wakeup = coroutine.wakeup, None
+        while not coroutine.done():
+            self._collect_ready()
+            if entry is None:
+                for queued in self.ready:
+                    if queued[0] is coroutine and queued[1] == coroutine.wake_count:
+                        entry = queued
+                        break
+                if entry is None:
+                    return
+                self.ready.remove(entry)
+            if entry[1] != coroutine.wake_count:
+                return
+            self._step(coroutine, entry[2], entry[3])
+            entry = None
+
+    def _collect_ready(self):
+        now = self.clock.time()
+        while self.timers and self.timers[0][0] <= now:
+            _, _, coroutine, wake_count = heapq.heappop(self.timers)
+            self.ready.append((coroutine, wake_count, None, None))
+        while self.woken:
+            self.ready.append(self.woken.popleft())
+
+    def _run_ready(self):
+        self._collect_ready()
+        for _ in range(len(self.ready)):
+            entry = self.ready.popleft()
+            coroutine, wake_count, value, exception = entry
+            # Ignore stale wake ups, for example from a future a cancelled coroutine was waiting on
+            if coroutine.done() or wake_count != coroutine.wake_count:
+                continue
+            if coroutine.stepped:
+                # Held until the coroutine is next stepped
+                coroutine.wakeup = entry
+            else:
+                self._step(coroutine, value, exception)
+
+    def _wait(self):
+        timeout = None
+        if self.timers:
+            timeout = max(0.0, self.timers[0][0] - self.clock.time())
+        if self.woken:
+            timeout = 0.0
+        if self.clock.wait_readable(self.wake_read, timeout):
+            os.read(self.wake_read, 4096)
+
+    def _wake_loop(self):
+        os.write(self.wake_write, b'x')
+
+    def _step(self, coroutine, value, exception):
+        coroutine.wake_count += 1
+        try:
+            if exception is not None:
+                awaited = coroutine.generator.throw(exception)
+            else:
+                awaited = coroutine.generator.send(value)
+        except StopIteration:
+            self._finish(coroutine, None)
+        except Exception as e:
+            self.errors.append((coroutine.name, e))
+            self._finish(coroutine, e)
+        else:
+            self._await(coroutine, awaited)
+
+    def _finish(self, coroutine, exception):
+        self.coroutines.remove(coroutine)
+        if exception is None:
+            coroutine.future.set_result(None)
+        else:
+            coroutine.future.set_exception(exception)
+
+    def _await(self, coroutine, awaited):
+        wake_count = coroutine.wake_count
+        if awaited is None:
+            if coroutine.stepped:
+                coroutine.wakeup = (coroutine, wake_count, None, None)
+            else:
+                self.ready.append((coroutine, wake_count, None, None))
+        elif isinstance(awaited, Sleep):
+            self.timer_sequence += 1
+            heapq.heappush(self.timers, (self.clock.time() + awaited.seconds, self.timer_sequence, coroutine,
+                                         wake_count))
+        elif isinstance(awaited, Coroutine):
+            self._await(coroutine, awaited.future)
+        elif isinstance(awaited, Call):
+            future = Future()
+            if self.workers:
+                with self.call_condition:
+                    self.calls.append((awaited, future))
+                    self.call_condition.notify()
+            else:
+                self._make_call(awaited, future)
+            self._await(coroutine, future)
+        elif isinstance(awaited, Future):
+            def resume(completed):
+                self.woken.append((coroutine, wake_count, completed.value, completed.exception))
+                self._wake_loop()
+
+            awaited.add_done_callback(resume)
+        else:
+            self.ready.append((coroutine, wake_count, None,
+                               TypeError('Coroutine {} yielded {!r}, which cannot be awaited'.format(coroutine.name,
+                                                                                                   awaited))))
+
+    def _worker_loop(self):
+        while True:
+            with self.call_condition:
+                while not self.calls:
+                    self.call_condition.wait()
+                item = self.calls.popleft()
+                if item is None:
+                    # Shutdown, leave the marker for any other workers
+                    self.calls.append(None)
+                    return
+            call, future = item
+            self._make_call(call, future)
+
+    @staticmethod
+    def _make_call(call, future):
+        try:
+            future.set_result(call.function(*call.args, **call.kwargs))
+        except Exception as e:
+            future.set_exception(e)
+
+
+def periodic(function, interval, blocking=False, clock=None):
+    """
+    Coroutine which calls a function at a fixed rate, with deadlines advancing by exactly one interval so the rate
+    doesn't drift. If a call overruns the schedule re-anchors rather than trying to catch up.
+
+    :param function:
+        Function to call, taking no arguments
+    :param interval:
+        Time in seconds between calls
+    :param blocking:
+        If True, the function is run on a worker thread so it doesn't hold up the loop, use this for anything which
+        waits on I2C. Defaults to False
+    :param clock:
+        Optional, the runtime's clock, defaults to None for :data:`approxeng.viridia.clock.SYSTEM_CLOCK`
+    """
+    if clock is None:
+        clock = SYSTEM_CLOCK
+    deadline = clock.time()
+    while True:
+        if blocking:
+            yield Call(function)
+        else:
+            function()
+        deadline += interval
+        now = clock.time()
+        if deadline > now:
+            yield Sleep(deadline - now)
+        else:
+            deadline = now
+            yield None
+
+
+def odometry_service(sampler):
+    """
+    Coroutine which samples wheel angles into an :class:`approxeng.viridia.odometry.OdometrySampler`, in place of the
+    sampler's own thread. Reads go through the runtime's worker thread. Samples are timed on the sampler's clock, which
+    must be the runtime's.
+
+    :param sampler:
+        The sampler, which should not be started
+    """
+    clock = sampler.clock
+    deadline = clock.time()
+    while True:
+        try:
+            angles = yield Call(sampler.motors.read_angles)
+            sampler.add_sample(timestamp=clock.time(), angles=angles)
+        except IOError:
+            sampler.errors += 1
+        except Exception as e:
+            sampler.errors += 1
+            print 'Odometry sample failed: {}'.format(e)
+            traceback.print_exc()
+        deadline += sampler.period
+        now = clock.time()
+        if deadline > now:
+            yield Sleep(deadline - now)
+        else:
+            deadline = now
+            yield None
+
+
+def next_frame(capture, sequence):
+    """
+    Wait for a new camera frame without blocking the loop
+
+    :param capture:
+        A running :class:`approxeng.viridia.capture.FrameCapture`
+    :param sequence:
+        Sequence number of the last frame seen, or -1 for any frame
+    :return:
+        A :class:`approxeng.viridia.runtime.Future` to yield, which completes with the next
+        :class:`approxeng.viridia.capture.Frame`
+    """
+    future = Future()
+
+    def listener(frame):
+        if frame.sequence > sequence:
+            capture.remove_listener(listener)
+            future.set_result(frame)
+
+    capture.add_listener(listener)
+    # Check after adding the listener, in case a frame arrived in between
+    frame = capture.latest()
+    if frame is not None and frame.sequence > sequence:
+        capture.remove_listener(listener)
+        future.set_result(frame)
+    return future
+
+
+class TickSource:
+    """
+    Hands each tick's :class:`approxeng.viridia.task.TaskContext` to coroutine tasks. A coroutine task yields the future
+    returned by next_tick, and is resumed with the context at the start of the next tick.
+    """
+
+    def __init__(self):
+        self.future = Future()
+
+    def next_tick(self):
+        """
+        :return:
+            A :class:`approxeng.viridia.runtime.Future` which completes with the next tick's context
+        """
+        return self.future
+
+    def tick(self, context):
+        future, self.future = self.future, Future()
+        future.set_result(context)
+
+
+class PolledCoroutine:
+    """
+    Runs a coroutine from a polling loop rather than a :class:`approxeng.viridia.runtime.Runtime`, advancing it as far
+    as it can go on each poll. This is how a :class:`approxeng.viridia.runtime.CoroutineTask` runs on the plain
+    :class:`approxeng.viridia.task.TaskManager`. Sleeps are timed against the context's timestamp, and futures,
+    including the next tick, are checked on each poll. There are no worker threads, so a
+    :class:`approxeng.viridia.runtime.Call` is made straight away on the polling thread, blocking it just as the same
+    call would from poll_task.
+    """
+
+    def __init__(self, generator, ticks):
+        """
+        :param generator:
+            The coroutine, not yet started
+        :param ticks:
+            The :class:`approxeng.viridia.runtime.TickSource` the coroutine waits on, which is given each poll's context
+        """
+        self.generator = generator
+        self.ticks = ticks
+        self.wake_time = None
+        self.awaited = None
+
+    def poll(self, context):
+        """
+        Advance the coroutine until it has to wait for a later poll
+
+        :param context:
+            The :class:`approxeng.viridia.task.TaskContext` for the current tick
+        :return:
+            True once the coroutine has finished, False if it's still running
+        :raises:
+            Any exception which ended the coroutine
+        """
+        self.ticks.tick(context)
+        value = None
+        exception = None
+        if self.wake_time is not None:
+            if context.timestamp < self.wake_time:
+                return False
+            self.wake_time = None
+        elif self.awaited is not None:
+            if not self.awaited.done():
+                return False
+            value, exception = self.awaited.value, self.awaited.exception
+            self.awaited = None
+        while True:
+            try:
+                if exception is not None:
+                    awaited = self.generator.throw(exception)
+                else:
+                    awaited = self.generator.send(value)
+            except StopIteration:
+                return True
+            value = None
+            exception = None
+            if awaited is None:
+                return False
+            elif isinstance(awaited, Sleep):
+                self.wake_time = context.timestamp + awaited.seconds
+                return False
+            elif isinstance(awaited, Call):
+                try:
+                    value = awaited.function(*awaited.args, **awaited.kwargs)
+                except Exception as e:
+                    exception = e
+            elif isinstance(awaited, Future):
+                if not awaited.done():
+                    self.awaited = awaited
+                    return False
+                value, exception = awaited.value, awaited.exception
+            else:
+                exception = TypeError('Coroutine yielded {!r}, which cannot be awaited when polled'.format(awaited))
+
+    def close(self):
+        """
+        Stop the coroutine, GeneratorExit is raised at the point it's waiting
+        """
+        self.generator.close()
+
+
+class CoroutineTask(Task):
+    """
+    Base class for tasks written as a single coroutine, run concurrently with background services by
+    :class:`approxeng.viridia.runtime.RuntimeTaskManager`, or a tick at a time by the plain
+    :class:`approxeng.viridia.task.TaskManager`. Implement run rather than poll_task, and yield ticks.next_tick()
+    whenever the task wants the next tick's context, for example to check the buttons. To switch to another task set
+    next_task and return from run, if next_task is None when run returns the task manager treats it as an
+    :class:`approxeng.viridia.task.ExitTask`.
+
+    init_task and shutdown are called as for any other task, and pressing home cancels the coroutine before shutdown
+    is called. Subclasses overriding init_task or shutdown must call this class's implementation.
+    """
+
+    def __init__(self, task_name='New Task', tick_rate=None):
+        super(CoroutineTask, self).__init__(task_name=task_name, tick_rate=tick_rate)
+        self.next_task = None
+        self.polled = None
+
+    def init_task(self, context):
+        self.next_task = None
+        self.polled = None
+
+    def poll_task(self, context, tick):
+        """
+        Adapter for the plain task manager, which runs the coroutine through a
+        :class:`approxeng.viridia.runtime.PolledCoroutine`
+        """
+        if self.polled is None:
+            ticks = TickSource()
+            self.polled = PolledCoroutine(generator=self.run(context=context, ticks=ticks), ticks=ticks)
+        if self.polled.poll(context):
+            self.polled = None
+            return self.next_task if self.next_task is not None else ExitTask()
+        return None
+
+    def shutdown(self, context):
+        if self.polled is not None:
+            self.polled.close()
+            self.polled = None
+
+    @abstractmethod
+    def run(self, context, ticks):
+        """
+        The task's coroutine
+
+        :param context:
+            The :class:`approxeng.viridia.task.TaskContext` for the tick in which the task started
+        :param ticks:
+            A :class:`approxeng.viridia.runtime.TickSource`, yield ticks.next_tick() to wait for the next tick
+        """
+        pass
+
+
+class RuntimeTaskManager(TaskManager):
+    """
+    Runs the task loop as a coroutine in a :class:`approxeng.viridia.runtime.Runtime`, sharing it with background
+    services. The loop behaves exactly as the plain :class:`approxeng.viridia.task.TaskManager`, including for tasks
+    which only implement poll_task, except that waiting for the next tick lets other coroutines run rather than
+    sleeping. Tasks derived from :class:`approxeng.viridia.runtime.CoroutineTask` are run as coroutines, but only ever
+    stepped from within the task loop's init and poll phases, so their work is profiled, covered by the watchdog and
+    finished before the tick is recorded. A timer or call the task is waiting on which completes between ticks is picked
+    up at the start of the next poll.
+    """
+
+    def __init__(self, chassis, joystick, i2c, motors, feather, display, runtime=None, services=None, **kwargs):
+        """
+        Create a new task manager, taking the same arguments as :class:`approxeng.viridia.task.TaskManager` plus:
+
+        :param runtime:
+            Optional, the :class:`approxeng.viridia.runtime.Runtime` to use, which should be on the same clock as the
+            task manager. Defaults to None to create one on the task manager's clock
+        :param services:
+            Optional, a list of coroutines, such as :func:`approxeng.viridia.runtime.odometry_service`, started along
+            with the task loop. Defaults to None
+        """
+        TaskManager.__init__(self, chassis=chassis, joystick=joystick, i2c=i2c, motors=motors, feather=feather,
+                             display=display, **kwargs)
+        self.runtime = runtime if runtime is not None else Runtime(clock=self.clock)
+        self.services = services if services is not None else []
+        self.ticks = TickSource()
+        self.task_coroutine = None
+
+    def run(self, initial_task):
+        """
+        Start the services and the task loop, returning when stop() is called. Services are cancelled on return.
+        """
+        services = [self.runtime.spawn(service) for service in self.services]
+        try:
+            self.runtime.run(until=self.runtime.spawn(self._task_loop(initial_task), name='task-loop'))
+        finally:
+            for service in services:
+                service.cancel()
+
+    def _task_loop(self, initial_task):
+        self._start(initial_task)
+        while self.running:
+            self._run_tick()
+            self._update_rate()
+            delay = self.scheduler.end_tick()
+            if delay > 0:
+                yield Sleep(delay)
+            else:
+                yield None
+            self.scheduler.start_tick()
+
+    def _init_task(self, task, context):
+        TaskManager._init_task(self, task, context)
+        if isinstance(task, CoroutineTask):
+            self.task_coroutine = self.runtime.spawn(task.run(context=context, ticks=self.ticks),
+                                                     name=task.__class__.__name__, stepped=True)
+            self.runtime.step(self.task_coroutine)
+
+    def _poll_task(self, task, context):
+        if not isinstance(task, CoroutineTask):
+            return TaskManager._poll_task(self, task, context)
+        if not self.task_coroutine.done():
+            # Run the task up to the point it next waits, here in the poll phase rather than on the loop's next pass
+            self.ticks.tick(context)
+            self.runtime.step(self.task_coroutine)
+        if self.task_coroutine.done():
+            coroutine, self.task_coroutine = self.task_coroutine, None
+            # Raises the coroutine's exception, if it failed, for the task loop to handle
+            coroutine.future.result()
+            return task.next_task if task.next_task is not None else ExitTask()
+        return None
+
+    def _shutdown_task(self, task, context):
+        if self.task_coroutine is not None:
+            self.task_coroutine.cancel()
+            self.task_coroutine = None
+        task.shutdown(context)
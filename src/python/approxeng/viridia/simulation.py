@@ -0,0 +1,409 @@
+"""
+Simulated hardware, used to run the task system on a development machine without the robot. The simulated I2C bus and
+GPIO implement the same interfaces as :class:`approxeng.pi2arduino.I2CHelper` and RPi.GPIO, and the simulated devices
+behind them implement the command protocols of the arduino code in 'src/arduino/motors' and 'src/arduino/feather'.
+"""
+
+from math import exp, sin
+from threading import Lock
+from time import sleep
+from approxeng.viridia.clock import SYSTEM_CLOCK
+
+
+class SimulatedMechaduino:
+    """
+    Simulates a single mechaduino motor controller running 'src/arduino/motors/motors.ino'. Command 0 sets the velocity
+    setpoint in RPM, command 1 enables closed loop control and command 2 disables it. Reads return the wheel position in
+    revolutions as a single float. The motor's velocity approaches the setpoint as a first order lag while enabled,
+    and falls to zero when disabled.
+    """
+
+    def __init__(self, clock, time_constant=0.05):
+        """
+        :param clock:
+            Callable returning the current time in seconds
+        :param time_constant:
+            Time constant in seconds of the motor's response to a change of setpoint, defaults to 0.05
+        """
+        self.clock = clock
+        self.time_constant = time_constant
+        self.enabled = False
+        self.setpoint = 0.0
+        self.velocity = 0.0
+        self.angle = 0.0
+        self.last_time = clock()
+
+    def step(self):
+        """
+        Bring the simulated state up to date with the clock
+        """
+        now = self.clock()
+        dt = now - self.last_time
+        self.last_time = now
+        if dt <= 0:
+            return
+        target = self.setpoint if self.enabled else 0.0
+        decay = exp(-dt / self.time_constant)
+        # Integrate the first order response exactly, so the result doesn't depend on how often we're stepped.
+        # Velocity is in RPM, angle in revolutions.
+        self.angle += (target * dt + (self.velocity - target) * self.time_constant * (1 - decay)) / 60
+        self.velocity = target + (self.velocity - target) * decay
+
+    def receive(self, sequence):
+        self.step()
+        command = sequence[0]
+        if command == 0:
+            self.setpoint = float(sequence[1])
+        elif command == 1:
+            self.enabled = True
+        elif command == 2:
+            self.enabled = False
+
+    def respond(self, format_string):
+        self.step()
+        return self.angle,
+
+
+class SimulatedFeather:
+    """
+    Simulates the feather running 'src/arduino/feather/feather.ino'. Command 1 sets hue and hue variation, 2 sets
+    brightness, 3 sets direction, 4 sets lighting mode, 90 and 91 turn the solid state relay off and on, and 100 fires
+    the kicker. Messages which arrive while the LED disable pin is low are counted as clashes, as on the real hardware
+    these would be likely to fail, but are still processed.
+    """
+
+    KICKER_TIME = 0.1
+    'Time the kicker stays active after being fired'
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.hue = 0
+        self.hue_variation = 0
+        self.brightness = 255
+        self.direction = 0.0
+        self.mode = 0
+        self.relay_on = False
+        self.kicks = 0
+        self.kicked_at = None
+        self.leds_paused = False
+        self.clashes = 0
+
+    @property
+    def kicker_active(self):
+        return self.kicked_at is not None and self.clock() - self.kicked_at < SimulatedFeather.KICKER_TIME
+
+    def set_led_disable(self, value):
+        self.leds_paused = bool(value)
+
+    def receive(self, sequence):
+        if not self.leds_paused:
+            self.clashes += 1
+        command = sequence[0]
+        if command == 1:
+            self.hue = sequence[1]
+            self.hue_variation = sequence[2]
+        elif command == 2:
+            self.brightness = sequence[1]
+        elif command == 3:
+            self.direction = float(sequence[1])
+        elif command == 4:
+            self.mode = sequence[1]
+        elif command == 90:
+            self.relay_on = False
+        elif command == 91:
+            self.relay_on = True
+        elif command == 100:
+            self.kicks += 1
+            self.kicked_at = self.clock()
+
+    def respond(self, format_string):
+        raise IOError('Feather does not respond to reads')
+
+
+class SimulatedI2C:
+    """
+    Drop in replacement for :class:`approxeng.pi2arduino.I2CHelper` which passes messages to simulated devices. Sending
+    to or reading from an address with no device raises IOError, as the real helper would.
+    """
+
+    def __init__(self, latency=0.0):
+        """
+        :param latency:
+            Real time, in seconds, to wait for each transaction to simulate the time taken on the bus. Defaults to 0
+        """
+        self.devices = {}
+        self.latency = latency
+        self.lock = Lock()
+        self.sends = 0
+        self.reads = 0
+
+    def add_device(self, address, device):
+        self.devices[address] = device
+
+    def _device(self, address):
+        if address not in self.devices:
+            raise IOError('No device at address {}'.format(address))
+        return self.devices[address]
+
+    def send(self, address, *sequence):
+        with self.lock:
+            if self.latency > 0:
+                sleep(self.latency)
+            self.sends += 1
+            self._device(address).receive(sequence)
+
+    def read(self, address, format_string):
+        with self.lock:
+            if self.latency > 0:
+                sleep(self.latency)
+            self.reads += 1
+            return self._device(address).respond(format_string)
+
+    @property
+    def transactions(self):
+        """
+        Total number of sends and reads
+        """
+        return self.sends + self.reads
+
+
+class SimulatedGPIO:
+    """
+    Stands in for the RPi.GPIO module, as used by :class:`approxeng.viridia.feather.Feather`. Outputs can be connected
+    to simulated devices, which are then called with the new value whenever the output changes.
+    """
+
+    BCM = 11
+    OUT = 0
+
+    def __init__(self):
+        self.mode = None
+        self.outputs = {}
+        self.listeners = {}
+
+    def connect(self, pin, listener):
+        """
+        Call a function whenever the specified output pin is set
+
+        :param pin:
+            BCM pin number
+        :param listener:
+            Function taking the new pin value
+        """
+        self.listeners[pin] = listener
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def setup(self, pin, direction):
+        self.outputs[pin] = 0
+
+    def output(self, pin, value):
+        self.outputs[pin] = value
+        if pin in self.listeners:
+            self.listeners[pin](value)
+
+
+class SimulatedRobot:
+    """
+    Viridia's I2C devices and GPIO, wired together. Pass i2c and gpio to :class:`approxeng.viridia.motors.Motors` and
+    :class:`approxeng.viridia.feather.Feather` in place of the real ones.
+
+    :ivar i2c:
+        The :class:`approxeng.viridia.simulation.SimulatedI2C`
+    :ivar gpio:
+        The :class:`approxeng.viridia.simulation.SimulatedGPIO`
+    :ivar motors:
+        List of :class:`approxeng.viridia.simulation.SimulatedMechaduino`, in address order
+    :ivar feather:
+        The :class:`approxeng.viridia.simulation.SimulatedFeather`
+    """
+
+    def __init__(self, clock=None, motor_base_address=0x61, motor_count=3, feather_address=0x31, led_disable_pin=27,
+                 latency=0.0):
+        """
+        :param clock:
+            Callable returning the current time in seconds, defaults to None for the time method of
+            :data:`approxeng.viridia.clock.SYSTEM_CLOCK`. Use the time method of a
+            :class:`approxeng.viridia.clock.VirtualClock` to run in virtual time
+        :param latency:
+            Real time to wait for each I2C transaction, defaults to 0
+        """
+        if clock is None:
+            clock = SYSTEM_CLOCK.time
+        self.clock = clock
+        self.i2c = SimulatedI2C(latency=latency)
+        self.gpio = SimulatedGPIO()
+        self.motors = []
+        for offset in range(motor_count):
+            motor = SimulatedMechaduino(clock=clock)
+            self.motors.append(motor)
+            self.i2c.add_device(motor_base_address + offset, motor)
+        self.feather = SimulatedFeather(clock=clock)
+        self.i2c.add_device(feather_address, self.feather)
+        self.gpio.connect(led_disable_pin, self.feather.set_led_disable)
+
+    def wheel_angles(self):
+        """
+        The current angle of each wheel, in revolutions
+        """
+        for motor in self.motors:
+            motor.step()
+        return [motor.angle for motor in self.motors]
+
+
+class SimulatedVideoStream:
+    """
+    Stands in for an imutils VideoStream, producing frames containing a single dark vertical line on a light background.
+    By default the line sweeps slowly from side to side. As with the real stream, read returns the same frame object
+    until the camera would have produced a new one.
+    """
+
+    def __init__(self, resolution=(128, 128), line_position=None, line_width=8, clock=None, frame_rate=30):
+        """
+        :param resolution:
+            Tuple of width and height of the generated frames
+        :param line_position:
+            Function taking the current time and returning the line's position from -1.0 (left) to 1.0 (right),
+            defaults to a slow sweep
+        :param line_width:
+            Width of the line in pixels, defaults to 8
+        :param clock:
+            Callable returning the current time in seconds, defaults to the time method of
+            :data:`approxeng.viridia.clock.SYSTEM_CLOCK`
+        :param frame_rate:
+            Frames per second produced by the simulated camera, defaults to 30
+        """
+        self.width, self.height = resolution
+        self.line_position = line_position
+        if self.line_position is None:
+            self.line_position = lambda t: 0.5 * sin(t / 2)
+        self.line_width = line_width
+        self.clock = clock
+        if self.clock is None:
+            self.clock = SYSTEM_CLOCK.time
+        self.frame_period = 1.0 / frame_rate
+        self.frame_index = None
+        self.frame = None
+
+    def start(self):
+        return self
+
+    def read(self):
+        import numpy as np
+        now = self.clock()
+        frame_index = int(now / self.frame_period)
+        if frame_index != self.frame_index:
+            frame = np.full((self.height, self.width, 3), 200, dtype=np.uint8)
+            centre = int((self.line_position(frame_index * self.frame_period) + 1) / 2 * self.width)
+            left = max(0, centre - self.line_width // 2)
+            frame[:, left:max(left, min(self.width, centre + self.line_width // 2))] = 20
+            self.frame_index = frame_index
+            self.frame = frame
+        return self.frame
+
+    def stop(self):
+        pass
+
+
+class NullDisplay:
+    """
+    Stand-in for :class:`approxeng.viridia.display.Display` which discards messages
+    """
+
+    def show(self, message1=None, message2=None):
+        pass
+
+    def log(self, source, message, *args):
+        pass
+
+
+class ScriptedButtonPresses:
+    """
+    Stands in for :class:`approxeng.input.ButtonPresses`
+    """
+
+    def __init__(self, buttons):
+        self.buttons = buttons
+
+    def was_pressed(self, sname):
+        return sname in self.buttons
+
+
+class ScriptedJoystick:
+    """
+    Stands in for a DualShock4, playing back a script of axis changes and button presses. The script is a list of
+    (time, axes, buttons) tuples, where time is the number of seconds after start() that the event happens, axes is a
+    dict of axis name to new value, and buttons is a list of names of buttons pressed at that time. Events are applied
+    when the joystick is next queried after their time has passed.
+    """
+
+    def __init__(self, script=None, repeat=False, clock=None):
+        """
+        :param script:
+            List of (time, axes, buttons) tuples in time order, defaults to None for no events
+        :param repeat:
+            If True, the script starts again once the last event has been applied. Defaults to False
+        :param clock:
+            Callable returning the current time in seconds, defaults to the time method of
+            :data:`approxeng.viridia.clock.SYSTEM_CLOCK`
+        """
+        self.script = script if script is not None else []
+        self.repeat = repeat
+        self.clock = clock if clock is not None else SYSTEM_CLOCK.time
+        self.axes = {}
+        self.pressed = set()
+        self.listeners = []
+        self.buttons = self
+        self.no_presses = ScriptedButtonPresses(frozenset())
+        self.start_time = None
+        self.position = 0
+
+    def add_listener(self, listener):
+        """
+        Call a function whenever an axis value changes
+
+        :param listener:
+            Function taking the axis name, the new value, and the time the change was scripted to happen
+        """
+        self.listeners.append(listener)
+
+    def start(self):
+        """
+        Start playing the script from the beginning
+        """
+        self.start_time = self.clock()
+        self.position = 0
+        return self
+
+    def _apply_events(self):
+        if self.start_time is None:
+            self.start()
+        now = self.clock()
+        while self.position < len(self.script) and self.start_time + self.script[self.position][0] <= now:
+            offset, axes, buttons = self.script[self.position]
+            when = self.start_time + offset
+            if axes:
+                for sname, value in axes.items():
+                    if self.axes.get(sname) != value:
+                        self.axes[sname] = value
+                        for listener in self.listeners:
+                            listener(sname, value, when)
+            if buttons:
+                self.pressed.update(buttons)
+            self.position += 1
+            if self.repeat and self.position == len(self.script) and self.script[-1][0] > 0:
+                self.start_time += self.script[-1][0]
+                self.position = 0
+
+    def get_axis_value(self, sname):
+        self._apply_events()
+        return self.axes.get(sname, 0.0)
+
+    def get_and_clear_button_press_history(self):
+        self._apply_events()
+        if not self.pressed:
+            return self.no_presses
+        presses = ScriptedButtonPresses(self.pressed)
+        self.pressed = set()
+        return presses
@@ -0,0 +1,124 @@
+from approxeng.holochassis.chassis import get_regular_triangular_chassis
+
+from approxeng.viridia.bus import BusScheduler, PRIORITY_SETPOINT, PRIORITY_ODOMETRY, PRIORITY_LIGHTING
+from approxeng.viridia.display import AsyncDisplay
+from approxeng.viridia.feather import Feather
+from approxeng.viridia.motors import Motors
+from approxeng.viridia.odometry import OdometrySampler
+from approxeng.viridia.registers import ShadowRegisters
+from approxeng.viridia.runtime import Runtime, RuntimeTaskManager, odometry_service
+from approxeng.viridia.watchdog import TickWatchdog
+
+
+class ViridiaSystem:
+    """
+    Viridia's software stack, everything between the raw I2C bus and the task loop, wired up in one place so the service
+    script and the simulation in :mod:`approxeng.viridia.benchmark` run the same configuration.
+
+    All I2C traffic goes through a :class:`approxeng.viridia.bus.BusScheduler`, so motor setpoints take priority over
+    odometry reads, which in turn take priority over lighting, and lighting is held back to the next tick once the tick
+    budget has been used. Writes which wouldn't change anything are skipped by shared
+    :class:`approxeng.viridia.registers.ShadowRegisters`. The task loop runs as a coroutine in a
+    :class:`approxeng.viridia.runtime.RuntimeTaskManager`, sharing its thread with the odometry service, and a
+    :class:`approxeng.viridia.watchdog.TickWatchdog` disables the motors, writing straight to the raw I2C bus, if a tick
+    overruns its deadline.
+    """
+
+    def __init__(self, i2c, joystick=None, display=None, profiler=None, gpio=None, tick_rate=50, tick_budget=0.01,
+                 keepalive=1.0, odometry=True, watchdog_deadline=0.1, reuse_context=False, recorder=None,
+                 publisher=None, clock=None, runtime=None):
+        """
+        Create the stack, starting the watchdog and the feather's sender thread. Call run to start the task loop.
+
+        :param i2c:
+            The raw :class:`approxeng.pi2arduino.I2CHelper`, or anything with the same send and read methods
+        :param joystick:
+            Optional, the joystick, defaults to None to start without one
+        :param display:
+            Optional, the :class:`approxeng.viridia.display.Display`, defaults to None to create an
+            :class:`approxeng.viridia.display.AsyncDisplay`
+        :param profiler:
+            Optional, a :class:`approxeng.viridia.profiling.TickProfiler`. If supplied the I2C bus is instrumented with
+            it, so I2C time is included in each tick's profile. Defaults to None, disabling profiling
+        :param gpio:
+            Optional, the GPIO module used by the feather, defaults to None for RPi.GPIO
+        :param tick_rate:
+            Default loop rate in ticks per second, tasks such as the menu may ask for a lower rate. Defaults to 50
+        :param tick_budget:
+            Bus time in seconds available to each tick before lighting traffic is held back, defaults to 0.01
+        :param keepalive:
+            Interval in seconds after which unchanged register values are sent again, in case a device has been reset,
+            defaults to 1.0
+        :param odometry:
+            If True the wheel angles are sampled in the background by a service alongside the task loop, defaults to
+            True
+        :param watchdog_deadline:
+            Maximum time in seconds for a tick before the watchdog disables the motors, or None for no watchdog.
+            Defaults to 0.1
+        :param reuse_context:
+            Passed to the task manager, defaults to False
+        :param recorder:
+            Optional, a :class:`approxeng.viridia.telemetry.TelemetryRecorder`, defaults to None
+        :param publisher:
+            Optional, a running :class:`approxeng.viridia.telemetry.TelemetryPublisher`, defaults to None
+        :param clock:
+            Optional, the clock used throughout, defaults to None for :data:`approxeng.viridia.clock.SYSTEM_CLOCK`
+        :param runtime:
+            Optional, the :class:`approxeng.viridia.runtime.Runtime` the task loop runs in, which must use the same
+            clock. Defaults to None to create one
+        """
+        self.raw_i2c = i2c
+        self.profiler = profiler
+        self.recorder = recorder
+        self.publisher = publisher
+        timed_i2c = profiler.instrument(i2c) if profiler is not None else i2c
+        self.bus = BusScheduler(i2c=timed_i2c, tick_budget=tick_budget, clock=clock)
+        self.display = display if display is not None else AsyncDisplay(clock=clock)
+        self.registers = ShadowRegisters(keepalive=keepalive, clock=clock)
+        self.motors = Motors(i2c=self.bus.client(send_priority=PRIORITY_SETPOINT, read_priority=PRIORITY_ODOMETRY),
+                             registers=self.registers, speed_tolerance=0.1)
+        self.feather = Feather(i2c=self.bus.client(send_priority=PRIORITY_LIGHTING), asynchronous=True,
+                               registers=self.registers, gpio=gpio)
+        self.odometry = None
+        services = []
+        if odometry:
+            self.odometry = OdometrySampler(motors=self.motors, rate=100, clock=clock)
+            services.append(odometry_service(self.odometry))
+        self.watchdog = None
+        if watchdog_deadline is not None:
+            self.watchdog = TickWatchdog(motors=self.motors, deadline=watchdog_deadline, i2c=i2c, bus=self.bus,
+                                         clock=clock).start()
+        self.task_manager = RuntimeTaskManager(
+            chassis=get_regular_triangular_chassis(wheel_distance=204, wheel_radius=29.5,
+                                                   max_rotations_per_second=500 / 60),
+            joystick=joystick, i2c=self.bus.client(send_priority=PRIORITY_LIGHTING), motors=self.motors,
+            feather=self.feather, display=self.display, tick_rate=tick_rate, profiler=profiler,
+            reuse_context=reuse_context, bus=self.bus, odometry=self.odometry, recorder=recorder, publisher=publisher,
+            watchdog=self.watchdog, clock=clock,
+            runtime=runtime if runtime is not None else Runtime(clock=clock), services=services)
+
+    def run(self, initial_task):
+        """
+        Run the task loop until the task manager is stopped
+
+        :param initial_task:
+            The first task, and the task the home button returns to
+        """
+        self.task_manager.run(initial_task=initial_task)
+
+    def close(self):
+        """
+        Stop the watchdog and the motors, send queued lighting commands and stop the feather's sender thread, and close
+        the telemetry recorder and publisher if there are any. Call once the task loop has stopped, or from a signal
+        handler before exiting.
+        """
+        if self.watchdog is not None:
+            self.watchdog.stop()
+        self.motors.disable()
+        self.feather.stop(timeout=1.0)
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.publisher is not None:
+            self.publisher.stop()
+        if isinstance(self.display, AsyncDisplay):
+            self.display.sink.stop()
@@ -1,7 +1,11 @@
-import time
+import importlib
 import traceback
 from abc import ABCMeta, abstractmethod
+from collections import deque
+from threading import Condition, Event, Lock, Thread
+from approxeng.viridia.clock import SYSTEM_CLOCK
 from approxeng.viridia.drive import ViridiaDrive
+from approxeng.viridia.profiling import NullProfiler, LatencyHistogram
 
 
 class TaskManager:
@@ -9,79 +13,381 @@ class TaskManager:
     Manages the task loop
     """
 
-    def __init__(self, chassis, joystick, i2c, motors, feather, display):
+    def __init__(self, chassis, joystick, i2c, motors, feather, display, tick_rate=None, profiler=None,
+                 reuse_context=False, bus=None, odometry=None, recorder=None, publisher=None, watchdog=None,
+                 clock=None):
+        """
+        Create a new task manager
+
+        :param tick_rate:
+            Optional, the default rate in ticks per second at which the task loop should run. Tasks may override this
+            by declaring their own tick_rate. If neither this nor the active task specify a rate the loop runs as fast
+            as it can, which was the original behaviour. Defaults to None
+        :param profiler:
+            Optional, an instance of :class:`approxeng.viridia.profiling.TickProfiler` which will be used to time each
+            phase of every tick. To include I2C time the I2CHelper used by the motors and feather should be wrapped
+            with the profiler's instrument method. Defaults to None, disabling profiling
+        :param reuse_context:
+            If True a single :class:`approxeng.viridia.task.TaskContext` is created and refreshed in place at the start
+            of each tick, rather than a new one being created. This avoids allocating a new context every tick, but
+            means tasks must not hold on to the context between ticks. Defaults to False
+        :param bus:
+            Optional, the :class:`approxeng.viridia.bus.BusScheduler` shared by the motors and feather, if any. The
+            task manager resets its bus time budget at the start of every tick. Defaults to None
+        :param odometry:
+            Optional, a running :class:`approxeng.viridia.odometry.OdometrySampler`, made available to tasks through
+            the context and used by the drive for dead reckoning. Defaults to None
+        :param recorder:
+            Optional, a :class:`approxeng.viridia.telemetry.TelemetryRecorder` to which the joystick state, commanded
+            wheel speeds, wheel angles and pose are written after the active task is polled each tick. Defaults to None
+        :param publisher:
+            Optional, a running :class:`approxeng.viridia.telemetry.TelemetryPublisher` which is passed each tick after
+            the active task is polled, to stream the robot's state to local listeners. Defaults to None
+        :param watchdog:
+            Optional, a running :class:`approxeng.viridia.watchdog.TickWatchdog` which disables the motors if a tick
+            overruns its deadline. It's fed through the profiler, which the task manager wraps with the watchdog.
+            Defaults to None
+        :param clock:
+            Optional, the clock used to time and schedule the task loop, read once at the start of each tick to set
+            the context's timestamp. Defaults to None for :data:`approxeng.viridia.clock.SYSTEM_CLOCK`, the system's
+            monotonic clock. Pass a :class:`approxeng.viridia.clock.VirtualClock` to run faster than real time, in
+            which case there must be a tick rate as virtual time only moves while sleeping to the next tick
+        """
         self.chassis = chassis
         self.joystick = joystick
         self.i2c = i2c
         self.motors = motors
         self.feather = feather
         self.display = display
-        self.drive = ViridiaDrive(chassis=self.chassis, motors=self.motors)
+        self.odometry = odometry
+        self.drive = ViridiaDrive(chassis=self.chassis, motors=self.motors, odometry=self.odometry)
         self.home_task = None
+        self.tick_rate = tick_rate
+        self.clock = clock if clock is not None else SYSTEM_CLOCK
+        self.scheduler = TickScheduler(clock=self.clock)
+        self.profiler = profiler
+        if self.profiler is None:
+            self.profiler = NullProfiler()
+        self.watchdog = watchdog
+        if self.watchdog is not None:
+            self.profiler = self.watchdog.wrap(self.profiler)
+        self.reuse_context = reuse_context
+        self.context = None
+        self.bus = bus
+        self.recorder = recorder
+        self.publisher = publisher
+        self.running = False
+        self.active_task = None
+        self.task_initialised = False
+        self.tick = 0
+        self.waiting_for_joystick = False
+        self.switch_started = None
+        self.switch_latencies = {}
+        'Dict of task name to a LatencyHistogram of the time from a task switch being requested to that task starting'
+
+    def set_joystick(self, joystick):
+        """
+        Swap the joystick used by the task loop, safe to call from another thread while the loop is running. Set this
+        to None when the controller disconnects: the active task is then no longer polled, and the motors are held at
+        zero speed, until a joystick is set again, at which point the task carries on from where it was.
+
+        :param joystick:
+            The new joystick, or None if there isn't one
+        """
+        self.joystick = joystick
 
-    def _build_context(self):
-        return TaskContext(chassis=self.chassis,
-                           joystick=self.joystick,
-                           buttons_pressed=self.joystick.buttons.get_and_clear_button_press_history(),
-                           i2c=self.i2c, feather=self.feather, motors=self.motors, display=self.display,
-                           drive=self.drive)
+    def _build_context(self, joystick=None):
+        if joystick is None:
+            joystick = self.joystick
+        # The only clock read for the tick, everything in the tick shares this timestamp
+        now = self.clock.time()
+        buttons_pressed = joystick.buttons.get_and_clear_button_press_history()
+        self.profiler.record('buttons', self.clock.time() - now)
+        if self.reuse_context and self.context is not None and self.context.joystick is joystick:
+            self.context.refresh(buttons_pressed=buttons_pressed, timestamp=now)
+            return self.context
+        self.context = TaskContext(chassis=self.chassis,
+                                   joystick=joystick,
+                                   buttons_pressed=buttons_pressed,
+                                   i2c=self.i2c, feather=self.feather, motors=self.motors, display=self.display,
+                                   drive=self.drive, odometry=self.odometry, timestamp=now, clock=self.clock)
+        return self.context
 
     def run(self, initial_task):
         """
         Start the task loop. Handles task switching and initialisation as well as any exceptions thrown within tasks.
+        The loop runs until stop() is called, which is typically never when running on the robot.
 
         :param initial_task:
             An instance of :class:`approxeng.viridia.task.Task` to use as the first task. Typically this is a menu or 
             startup task of some kind.
         """
-        active_task = initial_task
-        task_initialised = False
-        tick = 0
-
+        self._start(initial_task)
+        while self.running:
+            self._run_tick()
+            # Sleep until the next deadline, using the active task's preferred rate if it has one
+            self._update_rate()
+            self.scheduler.wait()
+
+    def _start(self, initial_task):
+        """
+        Set up the task loop state, ready for the first tick
+        """
+        self.active_task = initial_task
+        self.task_initialised = False
+        self.tick = 0
         if self.home_task is None:
             self.home_task = initial_task
+        self.running = True
 
-        while 1:
-            try:
-                context = self._build_context()
-                if context.pressed('home'):
-                    if active_task is not None:
-                        active_task.shutdown(context)
-                    active_task = ClearStateTask(self.home_task)
-                    task_initialised = False
-                    tick = 0
-                if task_initialised:
-                    new_task = active_task.poll_task(context=context, tick=tick)
-                    if new_task is None:
-                        tick += 1
-                    else:
-                        active_task.shutdown(context)
-                        active_task = new_task
-                        if isinstance(active_task, ExitTask):
-                            active_task = ClearStateTask(self.home_task)
-                        task_initialised = False
-                        tick = 0
+    def _run_tick(self):
+        """
+        Run a single tick of the task loop, polling or initialising the active task and handling task switches
+        """
+        # Reset the bus budget every tick, including those spent waiting for a joystick, so deferred transactions are
+        # still released and a new tick never starts with the budget used up
+        if self.bus is not None:
+            self.bus.start_tick()
+        joystick = self.joystick
+        if joystick is None:
+            self._wait_for_joystick()
+            return
+        if self.waiting_for_joystick:
+            self.waiting_for_joystick = False
+            self.display.show('Joystick connected', self.active_task.task_name)
+        profiler = self.profiler
+        profiler.start_tick(self.active_task)
+        context = None
+        try:
+            profiler.start('context')
+            context = self._build_context(joystick)
+            profiler.stop()
+            if context.pressed('home'):
+                profiler.start('switch')
+                self.switch_started = context.timestamp
+                if self.active_task is not None:
+                    self._shutdown_task(self.active_task, context)
+                self.active_task = ClearStateTask(self.home_task)
+                self.task_initialised = False
+                self.tick = 0
+                profiler.stop()
+            if self.task_initialised:
+                profiler.start('poll')
+                new_task = self._poll_task(self.active_task, context)
+                profiler.stop()
+                if self.recorder is not None:
+                    self.recorder.record(timestamp=context.timestamp, tick=self.tick, task=self.active_task,
+                                         context=context)
+                if self.publisher is not None:
+                    self.publisher.record(timestamp=context.timestamp, tick=self.tick, task=self.active_task,
+                                          context=context)
+                if new_task is None:
+                    self.tick += 1
                 else:
-                    active_task.init_task(context=context)
-                    task_initialised = True
-            except Exception as e:
-                if active_task is not None:
-                    active_task.shutdown()
-                active_task = ClearStateTask(ErrorTask(e))
-                task_initialised = False
+                    profiler.start('switch')
+                    if self.switch_started is None:
+                        self.switch_started = context.timestamp
+                    self._shutdown_task(self.active_task, context)
+                    self.active_task = new_task
+                    if isinstance(self.active_task, ExitTask):
+                        self.active_task = ClearStateTask(self.home_task)
+                    self.task_initialised = False
+                    self.tick = 0
+                    profiler.stop()
+            else:
+                profiler.start('init')
+                self._init_task(self.active_task, context)
+                self.task_initialised = True
+                profiler.stop()
+                if self.switch_started is not None and not isinstance(self.active_task, ClearStateTask):
+                    self._record_switch(self.active_task)
+        except Exception as e:
+            # Created first, as it prints the traceback of the exception currently being handled
+            error_task = ErrorTask(e)
+            if self.active_task is not None:
+                try:
+                    self._shutdown_task(self.active_task, context)
+                except Exception as shutdown_error:
+                    print 'Shutdown of failed task failed: {}'.format(shutdown_error)
+                    traceback.print_exc()
+            self.active_task = ClearStateTask(error_task)
+            self.task_initialised = False
+            self.switch_started = None
+        profiler.end_tick()
+
+    def _wait_for_joystick(self):
+        # Stop, but leave the motors enabled so the active task can carry on when the controller is back. The speeds
+        # are re-sent every tick, if the motors have shadow registers the writes which don't change anything are dropped
+        try:
+            self.motors.set_speeds([0.0] * self.motors.motor_count)
+        except IOError:
+            pass
+        if not self.waiting_for_joystick:
+            self.waiting_for_joystick = True
+            self.display.show('Waiting for joystick')
+
+    def _init_task(self, task, context):
+        handover = getattr(task, 'prewarm_handover', None)
+        if handover is not None:
+            # Prewarmed tasks are handed over without waiting for their prewarm to finish, so wait here, in the init
+            # phase, where the watchdog expects tasks to take a while
+            handover.wait()
+            task.prewarm_handover = None
+        task.init_task(context=context)
+
+    def _poll_task(self, task, context):
+        return task.poll_task(context=context, tick=self.tick)
+
+    def _shutdown_task(self, task, context):
+        task.shutdown(context)
+
+    def _record_switch(self, task):
+        # Switches pass through a ClearStateTask, so are timed from the request to the end of the real task's init
+        latencies = self.switch_latencies.get(task.task_name)
+        if latencies is None:
+            latencies = self.switch_latencies[task.task_name] = LatencyHistogram()
+        latencies.add(self.clock.time() - self.switch_started)
+        self.switch_started = None
+
+    def _update_rate(self):
+        if self.active_task.tick_rate is not None:
+            self.scheduler.set_rate(self.active_task.tick_rate)
+        else:
+            self.scheduler.set_rate(self.tick_rate)
+
+    def stop(self):
+        """
+        Ask the task loop to exit at the end of the current tick. The active task is not shut down, so callers should
+        ensure the motors are stopped if necessary.
+        """
+        self.running = False
+
+
+class TickScheduler:
+    """
+    Deadline driven scheduler used by the task manager to run the task loop at a fixed rate. Rather than sleeping for
+    a fixed time after each tick, which would add the duration of the tick to the loop period, this tracks an absolute
+    deadline for the end of each tick and sleeps until that deadline. Deadlines advance by exactly one period each tick
+    so the loop doesn't drift. If a tick finishes after its deadline the schedule is re-anchored to the current time,
+    rather than attempting to catch up with a burst of back-to-back ticks.
+
+    :ivar ticks:
+        The number of ticks completed
+    :ivar missed_deadlines:
+        The number of ticks which completed after their deadline
+    :ivar overruns:
+        The number of ticks where the work done by the tick, ignoring any time spent sleeping, took longer than the
+        entire tick period. These are ticks which could never have met their deadline at the requested rate.
+    """
+
+    def __init__(self, rate=None, clock=None):
+        """
+        Create a new scheduler
+
+        :param rate:
+            The rate in ticks per second, or None to run without any delay between ticks. Defaults to None
+        :param clock:
+            Optional, the clock to schedule against, defaults to None for :data:`approxeng.viridia.clock.SYSTEM_CLOCK`
+        """
+        self.clock = clock if clock is not None else SYSTEM_CLOCK
+        self.period = None
+        self.deadline = None
+        self.tick_start = None
+        self.ticks = 0
+        self.missed_deadlines = 0
+        self.overruns = 0
+        self.set_rate(rate)
+
+    @property
+    def rate(self):
+        """
+        The current rate in ticks per second, or None if the scheduler is not limiting the rate
+        """
+        if self.period is None:
+            return None
+        return 1.0 / self.period
+
+    def set_rate(self, rate):
+        """
+        Change the tick rate. If this actually changes the period the schedule is re-anchored to the end of the current
+        tick, so changing rate never counts as a missed deadline.
 
+        :param rate:
+            The new rate in ticks per second, or None to run without any delay between ticks.
+        """
+        if rate is None or rate <= 0:
+            period = None
+        else:
+            period = 1.0 / rate
+        if period != self.period:
+            self.period = period
+            self.deadline = None
+
+    def wait(self):
+        """
+        Called at the end of each tick, sleeps until the deadline for this tick is reached then advances the deadline
+        by one period. If the deadline has already passed this doesn't sleep, records the missed deadline and starts
+        the next tick immediately.
+        """
+        delay = self.end_tick()
+        if delay > 0:
+            self.clock.sleep(delay)
+        self.start_tick()
+
+    def end_tick(self):
+        """
+        The bookkeeping part of wait, for callers which need to do their own waiting. Records the end of a tick and
+        advances the deadline, without sleeping. Call start_tick once the delay has passed.
+
+        :return:
+            The time in seconds to wait before starting the next tick, zero if it should start immediately
+        """
+        now = self.clock.time()
+        self.ticks += 1
+        delay = 0.0
+        if self.period is not None:
+            if self.deadline is None:
+                self.deadline = now
+            elif now > self.deadline:
+                self.missed_deadlines += 1
+                if self.tick_start is not None and now - self.tick_start > self.period:
+                    self.overruns += 1
+                self.deadline = now
+            else:
+                delay = self.deadline - now
+            self.deadline += self.period
+        return delay
+
+    def start_tick(self):
+        """
+        Record the start of a tick, used to detect overruns
+        """
+        self.tick_start = self.clock.time()
 
-class TaskContext:
+    def __str__(self):
+        return 'TickScheduler[ rate={}, ticks={}, missed_deadlines={}, overruns={} ]'.format(
+            self.rate, self.ticks, self.missed_deadlines, self.overruns)
+
+
+class TaskContext(object):
     """
     Contains the resources a task might need to perform its function
 
     :ivar timestamp:
-        The time, in seconds since the epoch, that this context was created. In effect this is also the task creation
-        time as they're created at the same time.
+        The time in seconds, from the task manager's clock, at which the current tick started. This is the time tasks
+        should use for anything they schedule or measure, rather than reading the system time themselves, so that
+        everything in a tick agrees on the time and tasks run correctly against a virtual clock in simulation. The
+        clock is monotonic, so timestamps can only be compared with each other and not with time.time().
+    :ivar clock:
+        The task manager's clock, for the rare task which needs the time part way through a tick
 
     """
 
-    def __init__(self, chassis, joystick, buttons_pressed, i2c, motors, feather, display, drive):
+    __slots__ = ['chassis', 'joystick', 'buttons_pressed', 'timestamp', 'i2c', 'motors', 'feather', 'display', 'drive',
+                 'odometry', 'clock']
+
+    def __init__(self, chassis, joystick, buttons_pressed, i2c, motors, feather, display, drive, odometry=None,
+                 timestamp=None, clock=None):
         """
         Create a new task context
 
@@ -106,16 +412,39 @@ class TaskContext:
             by displaying them on a hardware module or by printing to stdout
         :param drive:
             An instance of :class:`approxeng.viridia.drive.Drive` providing high level motion functionality
+        :param odometry:
+            Optional, an instance of :class:`approxeng.viridia.odometry.OdometrySampler` providing recent wheel angles
+            without blocking on the I2C bus. Defaults to None, in which case tasks must read from the motors directly
+        :param timestamp:
+            Optional, the time at which the tick started. Defaults to None to read the clock
+        :param clock:
+            Optional, the task manager's clock. Defaults to None for :data:`approxeng.viridia.clock.SYSTEM_CLOCK`
         """
         self.chassis = chassis
         self.joystick = joystick
         self.buttons_pressed = buttons_pressed
-        self.timestamp = time.time()
+        self.clock = clock if clock is not None else SYSTEM_CLOCK
+        self.timestamp = timestamp if timestamp is not None else self.clock.time()
         self.i2c = i2c
         self.motors = motors
         self.feather = feather
         self.display = display
         self.drive = drive
+        self.odometry = odometry
+
+    def refresh(self, buttons_pressed, timestamp=None):
+        """
+        Update this context in place for a new tick, used by the task manager when it's been asked to re-use a single
+        context rather than creating a new one every tick.
+
+        :param buttons_pressed:
+            An instance of :class:`approxeng.input.ButtonPresses` containing the buttons pressed since the last tick
+            started
+        :param timestamp:
+            Optional, the time at which the tick started. Defaults to None to read the clock
+        """
+        self.buttons_pressed = buttons_pressed
+        self.timestamp = timestamp if timestamp is not None else self.clock.time()
 
     def pressed(self, sname):
         return self.buttons_pressed.was_pressed(sname)
@@ -130,14 +459,20 @@ class Task:
 
     __metaclass__ = ABCMeta
 
-    def __init__(self, task_name='New Task'):
+    def __init__(self, task_name='New Task', tick_rate=None):
         """
         Create a new task with the specified name
 
         :param task_name:
             Name for this task, used in debug mostly. Defaults to 'New Task'
+        :param tick_rate:
+            Optional, the rate in ticks per second at which this task would like to be polled. If None the task
+            manager's default rate is used. Defaults to None
         """
         self.task_name = task_name
+        self.tick_rate = tick_rate
+        self.prewarm_handover = None
+        'Set by whoever starts a prewarmed task to an Event which the task manager waits for before calling init_task'
 
     def __str__(self):
         return 'Task[ task_name={} ]'.format(self.task_name)
@@ -176,11 +511,245 @@ class Task:
         Called when the task exits, clear up any state which won't be handled by the ClearStateTask
         
         :param context:
-            The context
+            The context, or None if the task is being shut down after an error which happened before the tick's
+            context could be built
+        """
+        pass
+
+    def prewarm(self, context):
+        """
+        Optional, called on a background thread by a :class:`approxeng.viridia.task.TaskPrewarmer` when the task looks
+        likely to be started soon, for example when it's highlighted in a menu. Use this to start anything slow, such
+        as a camera, so init_task finds it already running. init_task must still work if prewarm was never called.
+        Only the long-lived objects in the context, such as the drive, motors and feather, should be used, as the
+        context may be refreshed in place while this runs.
+
+        :param context:
+            The context from the tick which requested the prewarm
+        """
+        pass
+
+    def release(self, context):
+        """
+        Optional, called on a background thread to undo prewarm when the task wasn't started after all. Not called if
+        the task was started, in which case its shutdown method is responsible for everything prewarm acquired.
+
+        :param context:
+            The context from the tick which requested the release
         """
         pass
 
 
+class LazyTask(Task):
+    """
+    Stands in for a task, by name, without importing the module which defines it until the task is needed. This keeps
+    heavy dependencies, such as OpenCV and the camera libraries used by the line follower, out of service startup.
+    :class:`approxeng.viridia.tasks.main_menu.MenuTask` shows the name and description, imports the task when it's
+    prewarmed or started, and runs the real task in place of this one. If run directly this delegates to the real task,
+    but the task manager will see this task's tick rate and class name rather than the real task's.
+    """
+
+    def __init__(self, module, class_name, task_name, description=None, **kwargs):
+        """
+        Create a new lazy task
+
+        :param module:
+            Name of the module containing the task class, i.e. 'approxeng.viridia.tasks.camera'
+        :param class_name:
+            Name of the task class within the module
+        :param task_name:
+            Name to show for the task before it's loaded, this should match the task's own name
+        :param description:
+            Optional, a longer description of the task. Defaults to None
+        :param kwargs:
+            Any further arguments are passed to the task's constructor
+        """
+        super(LazyTask, self).__init__(task_name=task_name)
+        self.module = module
+        self.class_name = class_name
+        self.description = description
+        self.kwargs = kwargs
+        self.task = None
+        self.lock = Lock()
+
+    def load(self):
+        """
+        Import the task's module and create the task, if this hasn't already been done. Safe to call from a background
+        thread, such as the prewarmer's.
+
+        :return:
+            The real :class:`approxeng.viridia.task.Task`
+        """
+        with self.lock:
+            if self.task is None:
+                task_class = getattr(importlib.import_module(self.module), self.class_name)
+                self.task = task_class(**self.kwargs)
+            return self.task
+
+    @property
+    def loaded(self):
+        return self.task is not None
+
+    def init_task(self, context):
+        self.load().init_task(context)
+
+    def poll_task(self, context, tick):
+        return self.task.poll_task(context, tick)
+
+    def shutdown(self, context):
+        if self.task is not None:
+            self.task.shutdown(context)
+
+    def prewarm(self, context):
+        self.load().prewarm(context)
+
+    def release(self, context):
+        if self.task is not None:
+            self.task.release(context)
+
+    def __str__(self):
+        return 'LazyTask[ task_name={}, module={}, loaded={} ]'.format(self.task_name, self.module, self.loaded)
+
+
+class TaskPrewarmer:
+    """
+    Prewarms tasks in the background, one at a time, so switching to them is instant. Used by
+    :class:`approxeng.viridia.tasks.main_menu.MenuTask` for the highlighted task. Prewarmed resources are held in line
+    with these rules:
+
+    * A task is only prewarmed once it's been selected for settle_time, so scrolling through a menu doesn't start and
+      stop every camera on the way
+    * Selecting a different task releases the previous one
+    * If the selection doesn't change for idle_timeout the task is released, so a camera and enabled motors aren't
+      left running indefinitely by an idle menu. It is prewarmed again when next selected
+    * When a task is started it claims its prewarmed resources, and releases them in its own shutdown. Any other task
+      is released. Claiming doesn't block the menu's tick, the task manager waits for the prewarm before the task's init
+
+    Prewarm and release calls are made in order on a single worker thread, so a task is never released while its
+    prewarm is still running.
+    """
+
+    def __init__(self, settle_time=0.5, idle_timeout=30.0):
+        """
+        Create a new prewarmer
+
+        :param settle_time:
+            Time in seconds a task must be selected before it's prewarmed, defaults to 0.5
+        :param idle_timeout:
+            Time in seconds after which a selected task is released if the selection hasn't changed, defaults to 30
+        """
+        self.settle_time = settle_time
+        self.idle_timeout = idle_timeout
+        self.condition = Condition()
+        self.actions = deque()
+        self.busy = False
+        self.thread = None
+        self.warm_task = None
+        self.selected_task = None
+        self.selected_time = None
+        self.prewarms = 0
+        self.releases = 0
+
+    def select(self, task, context):
+        """
+        Called every tick with the task currently selected, prewarms and releases tasks according to the rules above
+
+        :param task:
+            The selected :class:`approxeng.viridia.task.Task`
+        :param context:
+            The current context
+        """
+        now = context.timestamp
+        if task is not self.selected_task:
+            self.selected_task = task
+            self.selected_time = now
+            if self.warm_task is not None and self.warm_task is not task:
+                self.release(context)
+        selected_for = now - self.selected_time
+        if self.warm_task is None and self.settle_time <= selected_for < self.idle_timeout:
+            self.warm_task = task
+            self.prewarms += 1
+            self._submit(task.prewarm, context)
+        elif self.warm_task is not None and selected_for >= self.idle_timeout:
+            self.release(context)
+
+    def release(self, context):
+        """
+        Release the prewarmed task, if there is one
+
+        :param context:
+            The current context
+        """
+        if self.warm_task is not None:
+            self.releases += 1
+            self._submit(self.warm_task.release, context)
+            self.warm_task = None
+
+    def reset(self, context):
+        """
+        Release the prewarmed task, if there is one, and forget the selection so the next task selected is treated as
+        newly selected. Call this when the menu using the prewarmer exits.
+
+        :param context:
+            The current context
+        """
+        self.release(context)
+        self.selected_task = None
+
+    def claim(self, task):
+        """
+        Hand the prewarmed resources over to a task which is about to be started. This doesn't wait for any prewarm or
+        release still running, as that would hold up the tick which started the task, instead it returns an event
+        which is set once they've finished. Set this as the started task's prewarm_handover, and the task manager will
+        wait for it before calling init_task. Any other prewarmed task is left warm, call release for it.
+
+        :param task:
+            The :class:`approxeng.viridia.task.Task` about to be started
+        :return:
+            A threading.Event, set once every prewarm and release requested so far has finished
+        """
+        handover = Event()
+        with self.condition:
+            pending = self.actions or self.busy
+        if pending:
+            self._submit(lambda context: handover.set(), None)
+        else:
+            handover.set()
+        if self.warm_task is task:
+            self.warm_task = None
+            self.selected_task = None
+        return handover
+
+    def _submit(self, action, context):
+        with self.condition:
+            self.actions.append((action, context))
+            self.condition.notify_all()
+            if self.thread is None:
+                self.thread = Thread(target=self._worker_loop, name='task-prewarmer')
+                self.thread.daemon = True
+                self.thread.start()
+
+    def _worker_loop(self):
+        while True:
+            with self.condition:
+                while not self.actions:
+                    self.condition.wait()
+                action, context = self.actions.popleft()
+                self.busy = True
+            try:
+                action(context)
+            except Exception as e:
+                print 'Prewarm failed: {}'.format(e)
+                traceback.print_exc()
+            with self.condition:
+                self.busy = False
+                self.condition.notify_all()
+
+    def __str__(self):
+        return 'TaskPrewarmer[ warm_task={}, prewarms={}, releases={} ]'.format(
+            None if self.warm_task is None else self.warm_task.task_name, self.prewarms, self.releases)
+
+
 class ClearStateTask(Task):
     """
     Task which clears the state, turns the lights off and stops the motors, then immediately passes control to another
@@ -219,7 +788,7 @@ class ErrorTask(Task):
         :param exception:
             An exception which caused this display to be shown
         """
-        super(ErrorTask, self).__init__(task_name='Error')
+        super(ErrorTask, self).__init__(task_name='Error', tick_rate=5)
         self.exception = exception
         print exception
         traceback.print_exc()
@@ -229,8 +798,8 @@ class ErrorTask(Task):
         pass
 
     def poll_task(self, context, tick):
-        # Just hang around, if we had a display we'd print the error message
-        time.sleep(0.2)
+        # Just hang around, if we had a display we'd print the error message. The low tick rate stops us spinning.
+        pass
 
 
 class ExitTask(Task):
@@ -278,11 +847,10 @@ class PauseTask(Task):
         self.pause_time = pause_time
 
     def init_task(self, context):
-        self.start_time = time.time()
+        self.start_time = context.timestamp
 
     def poll_task(self, context, tick):
-        now = time.time()
-        if now - self.start_time >= self.pause_time:
+        if context.timestamp - self.start_time >= self.pause_time:
             return self.task
         else:
             return None
@@ -1,7 +1,6 @@
 from approxeng.viridia.task import Task
 from approxeng.holochassis.chassis import Motion
 from euclid import Vector2
-from time import time
 from math import pi
 
 
@@ -25,10 +24,10 @@ class LinearCalibrationTask(Task):
     def poll_task(self, context, tick):
         if self.motion is None:
             self.motion = Motion(Vector2(0, 150), 0)
-            self.start_time = time()  # Time in seconds
-        elif time() - self.start_time > 3:
+            self.start_time = context.timestamp  # Time in seconds
+        elif context.timestamp - self.start_time > 3:
             self.motion = Motion(Vector2(0, 0), 0)
-            print context.drive.dead_reckoning.pose
+            context.display.log('pose', '{}', context.drive.dead_reckoning.pose)
         context.drive.set_motion(self.motion)
         context.drive.update_dead_reckoning()
 
@@ -52,9 +51,9 @@ class AngularCalibrationTask(Task):
     def poll_task(self, context, tick):
         if self.motion is None:
             self.motion = Motion(Vector2(0, 0), pi / 2)
-            self.start_time = time()
-        elif time() - self.start_time > 4:
+            self.start_time = context.timestamp
+        elif context.timestamp - self.start_time > 4:
             self.motion = Motion(Vector2(0, 0), 0)
-            print context.drive.dead_reckoning.pose
+            context.display.log('pose', '{}', context.drive.dead_reckoning.pose)
         context.drive.set_motion(self.motion)
         context.drive.update_dead_reckoning()
@@ -5,19 +5,29 @@ from euclid import Vector2
 from imutils.video import VideoStream
 
 from approxeng.holochassis.chassis import Motion
-from approxeng.picamera import find_lines
 from approxeng.viridia import IntervalCheck
-from approxeng.viridia.task import Task
+from approxeng.viridia.capture import FrameCapture, FrameStoreWriter
+from approxeng.viridia.profiling import LatencyHistogram
+from approxeng.viridia.runtime import CoroutineTask, Sleep
+from approxeng.viridia.vision import BandLineFinder, MultiBandLineFinder
 
 
-class LineFollowerTask(Task):
+class LineFollowerTask(CoroutineTask):
     """
     Follow all the lines!
+
+    Frames are read through a :class:`approxeng.viridia.capture.FrameCapture`, so ticks where the camera hasn't
+    produced a new frame since the last one processed are skipped, leaving the previous drive command in effect. The
+    age of each frame when it's used to steer is recorded in frame_ages, and reported when the task shuts down.
+
+    The task is a coroutine, so if it wasn't prewarmed the camera is given time to start by sleeping in the coroutine
+    rather than in init_task, and the task loop carries on ticking in the meantime.
     """
 
     def __init__(self, linear_speed=100, turn_speed=pi / 2, enable_drive=True, threshold=50, scan_region_height=20,
                  scan_region_position=0, scan_region_width_pad=0, min_detection_area=40, invert=True,
-                 blur_kernel_size=9, physical_scan_width=140, physical_scan_distance=70, camera_resolution=128):
+                 blur_kernel_size=9, physical_scan_width=140, physical_scan_distance=70, camera_resolution=128,
+                 stream_factory=None, line_finder=None, lookahead_bands=None, record_frames=None):
         """
         Create a new line follower task
         
@@ -52,9 +62,35 @@ class LineFollowerTask(Task):
         :param camera_resolution:
             The resolution of the square image frame used by the camera, defaults to 128 - we really don't need high
             resolutions for this algorithm
+        :param stream_factory:
+            Optional, a function taking a tuple of (width, height) and returning an un-started video stream. Defaults
+            to None, which creates an imutils VideoStream using the pi camera. Use this to supply a
+            :class:`approxeng.viridia.simulation.SimulatedVideoStream` when running without hardware
+        :param line_finder:
+            Optional, a function taking an image and returning a sorted list of line positions from -1.0 to 1.0.
+            Defaults to None, which creates a :class:`approxeng.viridia.vision.BandLineFinder` from the scan region,
+            threshold, detection area and invert parameters. Pass a :class:`approxeng.viridia.vision.ContourLineFinder`
+            to use the slower blur and contour based finder, which is the only one to use blur_kernel_size
+        :param lookahead_bands:
+            Optional, a list of (scan_region_position, physical_distance, physical_width) tuples. If specified, lines
+            are found in each of these bands with a :class:`approxeng.viridia.vision.MultiBandLineFinder` and the robot
+            steers towards the path fitted through them at the furthest band with a line, rather than towards the line
+            in a single band. The single band parameters scan_region_position, physical_scan_width and
+            physical_scan_distance, and line_finder, are then ignored. The result for the most recent frame, including
+            the estimated curvature, is available as last_lookahead. Defaults to None for a single band
+        :param record_frames:
+            Optional, the path of a frame store file to which every frame captured while the task is running is
+            recorded, see :class:`approxeng.viridia.capture.FrameStoreWriter`. Recordings can be played back by
+            supplying a stream_factory creating a :class:`approxeng.viridia.capture.FrameStoreStream`. Defaults to None
         """
         super(LineFollowerTask, self).__init__(task_name='Line follower')
         self.stream = None
+        self.cold_start = False
+        self.last_sequence = -1
+        self.frames_processed = 0
+        self.frames_skipped = 0
+        self.frames_missed = 0
+        self.frame_ages = LatencyHistogram()
         self.last_line_to_the_right = True
         self.display_interval = IntervalCheck(interval=0.1)
         self.linear_speed = linear_speed
@@ -70,25 +106,73 @@ class LineFollowerTask(Task):
         self.physical_scan_width = physical_scan_width
         self.physical_scan_distance = physical_scan_distance
         self.camera_resolution = camera_resolution
+        self.stream_factory = stream_factory
+        self.record_frames = record_frames
+        if self.stream_factory is None:
+            self.stream_factory = lambda resolution: VideoStream(usePiCamera=True, resolution=resolution)
+        self.line_finder = line_finder
+        if self.line_finder is None:
+            self.line_finder = BandLineFinder(threshold=threshold, scan_region_height=scan_region_height,
+                                              scan_region_position=scan_region_position,
+                                              scan_region_width_pad=scan_region_width_pad,
+                                              min_detection_area=min_detection_area, invert=invert)
+        self.lookahead = None
+        self.last_lookahead = None
+        if lookahead_bands is not None:
+            self.lookahead = MultiBandLineFinder(bands=lookahead_bands, threshold=threshold,
+                                                 scan_region_height=scan_region_height,
+                                                 scan_region_width_pad=scan_region_width_pad,
+                                                 min_detection_area=min_detection_area, invert=invert)
 
-    def init_task(self, context):
+    def _start_camera(self, context):
+        resolution = (self.camera_resolution, self.camera_resolution)
+        recorder = None
+        if self.record_frames is not None:
+            recorder = FrameStoreWriter(path=self.record_frames, resolution=resolution)
+        self.stream = FrameCapture(self.stream_factory(resolution), recorder=recorder, clock=context.clock).start()
+
+    def _warm_up(self, context):
+        # Pause for a couple of seconds to let the camera gather its thoughts
+        for i in range(0, 4):
+            # We really need to make sure the drive is enabled!
+            if self.enable_drive:
+                context.drive.enable_drive()
+            yield Sleep(0.5)
+
+    def prewarm(self, context):
+        """
+        Create the video stream, which should activate the camera, and then pause for a couple of seconds to let it
+        gather its thoughts. Called in the background by the menu while this task is highlighted, so it's fine to
+        block here.
+        """
+        self._start_camera(context)
+        for wait in self._warm_up(context):
+            sleep(wait.seconds)
 
+    def release(self, context):
         """
-        Create the video stream, which should activate the camera, and then pause for a couple of seconds
-        to let it gather its thoughts.
+        Stop the camera and drive started by prewarm
         """
+        if self.enable_drive:
+            context.drive.disable_drive()
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream = None
+
+    def init_task(self, context):
+        super(LineFollowerTask, self).init_task(context)
         # Set up lighting
         context.feather.set_lighting_mode(2)
         context.feather.set_direction(-2.0)
         context.feather.set_ring_hue(0)
-        # Create stream and pause
-        self.stream = VideoStream(usePiCamera=True, resolution=(self.camera_resolution, self.camera_resolution)).start()
-        for i in range(0, 4):
-            # We really need to make sure the drive is enabled!
-            if self.enable_drive:
-                context.drive.enable_drive()
-            sleep(0.5)
-        context.feather.set_ring_hue(200)
+        # If we weren't prewarmed, start the camera now and warm it up in run, without holding up the task loop
+        self.cold_start = self.stream is None
+        if self.cold_start:
+            self._start_camera(context)
+        elif self.enable_drive:
+            # Already warm, but the drive may have been disabled since
+            context.drive.enable_drive()
+        self.last_sequence = -1
         # The camera is on the back of the robot, so set the front to be at PI radians
         context.drive.front = pi
         # Disable any motion limit we may have in action, it'll just confuse things
@@ -98,13 +182,28 @@ class LineFollowerTask(Task):
         # Determine whether, if we lose the line, we should rotate clockwise (True) or counter-clockwise (False)
         self.last_line_to_the_right = True
 
-    def poll_task(self, context, tick):
-        frame = self.stream.read()
-        lines = find_lines(image=frame, threshold=self.threshold, scan_region_height=self.scan_region_height,
-                           scan_region_position=self.scan_region_position,
-                           scan_region_width_pad=self.scan_region_width_pad, min_detection_area=self.min_detection_area,
-                           invert=self.invert, blur_kernel_size=self.blur_kernel_size)
-        if self.enable_drive:
+    def run(self, context, ticks):
+        if self.cold_start:
+            for wait in self._warm_up(context):
+                yield wait
+        context.feather.set_ring_hue(200)
+        while True:
+            context = yield ticks.next_tick()
+            self._follow_line(context)
+
+    def _follow_line(self, context):
+        frame = self.stream.latest()
+        if frame is None or frame.sequence == self.last_sequence:
+            # No new frame since the last tick, nothing to do until there is
+            self.frames_skipped += 1
+            return
+        if self.last_sequence >= 0:
+            self.frames_missed += frame.sequence - self.last_sequence - 1
+        self.last_sequence = frame.sequence
+        self.frames_processed += 1
+        self.frame_ages.add(frame.age(context.clock.time()))
+        if self.lookahead is None:
+            lines = self.line_finder(frame.image)
             if len(lines) > 0:
                 """
                 Found at least one line, pick the left-most. Lines are detected about 15cm from the centre of the robot, 
@@ -113,6 +212,20 @@ class LineFollowerTask(Task):
                 """
                 target_x = lines[0] * self.physical_scan_width / 2
                 target_y = self.physical_scan_distance
+        else:
+            self.last_lookahead = self.lookahead(frame.image)
+            lines = []
+            for band_lines in self.last_lookahead.positions:
+                if len(band_lines) > 0:
+                    lines = band_lines
+                    break
+            if self.last_lookahead.found:
+                # Aim for where the fitted track crosses the furthest band with a line in it, so we start turning into
+                # a bend before the nearest band reaches it
+                target_y = self.last_lookahead.furthest_distance
+                target_x = self.last_lookahead.x_at(target_y)
+        if self.enable_drive:
+            if len(lines) > 0:
                 context.drive.drive_at(x=target_x, y=target_y, speed=self.linear_speed, turn_speed=self.turn_speed)
                 self.last_line_to_the_right = target_x >= 0
             else:
@@ -121,16 +234,19 @@ class LineFollowerTask(Task):
                     context.drive.set_motion(Motion(translation=Vector2(0, 0), rotation=self.turn_speed))
                 else:
                     context.drive.set_motion(Motion(translation=Vector2(0, 0), rotation=-self.turn_speed))
-        if self.display_interval.should_run():
+        if self.display_interval.should_run(context.timestamp):
             if len(lines) > 0:
                 context.feather.set_direction(lines[0])
             else:
                 context.feather.set_direction(-2)
 
     def shutdown(self, context):
+        super(LineFollowerTask, self).shutdown(context)
         context.display.show('Disposing of streams')
         context.drive.disable_drive()
         context.drive.front = 0
         if self.stream is not None:
             self.stream.stop()
             self.stream = None
+        context.display.log('frames', 'Frames processed={}, skipped ticks={}, missed={}, age={}', self.frames_processed,
+                            self.frames_skipped, self.frames_missed, self.frame_ages.summary())
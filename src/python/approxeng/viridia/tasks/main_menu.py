@@ -1,17 +1,33 @@
-from time import sleep
-
-from approxeng.viridia.task import ClearStateTask, Task
+from approxeng.viridia.task import ClearStateTask, Task, TaskPrewarmer, LazyTask
 
 
 class MenuTask(Task):
     """
-    Top level menu class
+    Top level menu class. The highlighted task is prewarmed in the background by a
+    :class:`approxeng.viridia.task.TaskPrewarmer`, so tasks with slow starts, such as the line follower, are ready to
+    go by the time cross is pressed. Tasks can be given as :class:`approxeng.viridia.task.LazyTask`, in which case their
+    modules are only imported when they're prewarmed or started.
     """
 
-    def __init__(self, tasks):
-        super(MenuTask, self).__init__(task_name='Menu')
+    def __init__(self, tasks, prewarm=True, settle_time=0.5, idle_timeout=30.0):
+        """
+        Create a new menu
+
+        :param tasks:
+            List of :class:`approxeng.viridia.task.Task` to choose between
+        :param prewarm:
+            True to prewarm the highlighted task, defaults to True
+        :param settle_time:
+            Time in seconds a task must be highlighted before it's prewarmed, defaults to 0.5
+        :param idle_timeout:
+            Time in seconds after which a prewarmed task is released if the highlight hasn't moved, defaults to 30
+        """
+        super(MenuTask, self).__init__(task_name='Menu', tick_rate=10)
         self.tasks = tasks
         self.selected_task_index = 0
+        self.prewarmer = None
+        if prewarm:
+            self.prewarmer = TaskPrewarmer(settle_time=settle_time, idle_timeout=idle_timeout)
 
     def init_task(self, context):
         context.feather.set_lighting_mode(0)
@@ -29,7 +45,21 @@ class MenuTask(Task):
         elif context.pressed('dright'):
             self._increment_index(1)
         elif context.pressed('cross'):
-            return ClearStateTask(following_task=self.tasks[self.selected_task_index])
+            task = self.tasks[self.selected_task_index]
+            handover = None
+            if self.prewarmer is not None:
+                # Doesn't wait for the prewarm to finish, the task manager does that before the task's init
+                handover = self.prewarmer.claim(task)
+            if isinstance(task, LazyTask):
+                task = task.load()
+            task.prewarm_handover = handover
+            return ClearStateTask(following_task=task)
+        if self.prewarmer is not None:
+            self.prewarmer.select(self.tasks[self.selected_task_index], context)
         context.display.show('Task {} of {}'.format(self.selected_task_index + 1, len(self.tasks)),
                              self.tasks[self.selected_task_index].task_name)
-        sleep(0.1)
+
+    def shutdown(self, context):
+        if self.prewarmer is not None:
+            # Anything still warm wasn't claimed by the task being started
+            self.prewarmer.reset(context)
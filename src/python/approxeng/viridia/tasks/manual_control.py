@@ -4,7 +4,7 @@ from euclid import Vector2
 
 from approxeng.holochassis.chassis import rotate_vector, Motion, DeadReckoning
 from approxeng.holochassis.dynamics import RateLimit, MotionLimit
-from approxeng.viridia import IntervalCheck
+from approxeng.viridia import IntervalCheck, LRUCache
 from approxeng.viridia.task import Task
 
 
@@ -16,7 +16,20 @@ class ManualMotionTask(Task):
     ACCEL_TIME = 1.0
     'Time to reach full speed from a standing start'
 
-    def __init__(self):
+    def __init__(self, wheel_speed_cache_size=None, axis_quantum=0.01, angle_quantum=0.01):
+        """
+        Create a new manual motion task
+
+        :param wheel_speed_cache_size:
+            Optional, the number of entries in an :class:`approxeng.viridia.LRUCache` of wheel speeds, keyed on the
+            quantised stick positions, translation angle and limit mode. When the sticks are held still, or return to a
+            recent position, the cached speeds are sent without any kinematics being computed. The cache is bypassed
+            while the motion limit is enabled. Defaults to None, for no cache
+        :param axis_quantum:
+            When caching, stick values are rounded to a multiple of this, defaults to 0.01
+        :param angle_quantum:
+            When caching, the translation angle is rounded to a multiple of this many radians, defaults to 0.01
+        """
         super(ManualMotionTask, self).__init__(task_name='Manual motion')
         self.front = 0.0
         self.max_trn = 0
@@ -30,6 +43,13 @@ class ManualMotionTask(Task):
         ':type : approxeng.holochassis.dynamics.MotionLimit'
         self.limit_mode = 0
         self.absolute_motion = False
+        self.translation_angle = None
+        self.translation_rotation = None
+        self.wheel_speed_cache = None
+        if wheel_speed_cache_size is not None:
+            self.wheel_speed_cache = LRUCache(max_size=wheel_speed_cache_size)
+        self.axis_quantum = axis_quantum
+        self.angle_quantum = angle_quantum
 
     def init_task(self, context):
         # Maximum translation speed in mm/s
@@ -37,12 +57,17 @@ class ManualMotionTask(Task):
         # Maximum rotation speed in radians/2
         self.max_rot = context.chassis.get_max_rotation_speed()
         self._set_relative_motion(context)
-        self.dead_reckoning = DeadReckoning(chassis=context.chassis, counts_per_revolution=1.0, max_count_value=0)
+        if context.odometry is not None:
+            from approxeng.viridia.dead_reckoning import BatchDeadReckoning
+            self.dead_reckoning = BatchDeadReckoning(chassis=context.chassis, sampler=context.odometry)
+        else:
+            self.dead_reckoning = DeadReckoning(chassis=context.chassis, counts_per_revolution=1.0, max_count_value=0)
         self.motion_limit = MotionLimit(
             linear_acceleration_limit=context.chassis.get_max_translation_speed() / ManualMotionTask.ACCEL_TIME,
             angular_acceleration_limit=context.chassis.get_max_rotation_speed() / ManualMotionTask.ACCEL_TIME)
         self.rate_limit = RateLimit(limit_function=RateLimit.fixed_rate_limit_function(1 / ManualMotionTask.ACCEL_TIME))
         self.limit_mode = 0
+        self.translation_angle = None
         context.display.show(
             'Maximum linear speed = {}, rotational = {}'.format(context.chassis.get_max_translation_speed(),
                                                                 context.chassis.get_max_rotation_speed()), 'foo')
@@ -98,48 +123,87 @@ class ManualMotionTask(Task):
         if context.pressed('dup'):
             context.feather.kick()
 
-        # Check to see whether the minimum interval between dead reckoning updates has passed
-        if self.pose_update_interval.should_run():
+        # If the wheel angles are being sampled in the background integrate every sample since the last tick in one go,
+        # otherwise check to see whether the minimum interval between dead reckoning updates has passed and read from
+        # the motors
+        if context.odometry is not None:
+            self.dead_reckoning.update_from_sampler(context.odometry)
+        elif self.pose_update_interval.should_run(context.timestamp):
             self.dead_reckoning.update_from_revolutions(context.motors.read_angles())
 
-        # Get a vector from the left hand analogue stick and scale it up to our
-        # maximum translation speed, this will mean we go as fast directly forward
-        # as possible when the stick is pushed fully forwards
-
-        translate = Vector2(
-            context.joystick.get_axis_value('lx'),
-            context.joystick.get_axis_value('ly')) * self.max_trn
-        ':type : euclid.Vector2'
-
-        # If we're in absolute mode, rotate the translation vector appropriately
+        # If we're in absolute mode, the translation vector is rotated by our bearing as well as by the front angle
         if self.absolute_motion:
-            translate = rotate_vector(translate,
-                                      self.front - self.dead_reckoning.pose.orientation)
+            angle = self.front - self.dead_reckoning.pose.orientation
         else:
-            translate = rotate_vector(translate, self.front)
+            angle = self.front
+
+        if self.pose_display_interval.should_run(context.timestamp):
+            context.feather.set_direction(angle)
+            context.display.log('pose', '{}', self.dead_reckoning.pose)
+
+        lx = context.joystick.get_axis_value('lx')
+        ly = context.joystick.get_axis_value('ly')
+        rx = context.joystick.get_axis_value('rx')
+
+        # If the wheel speed cache is enabled, look up the quantised inputs and send the cached speeds if we've seen
+        # them recently. On a miss, compute from the quantised values so that a cached result is exactly what would
+        # have been computed. The motion limit is stateful so its output can't be cached.
+        key = None
+        if self.wheel_speed_cache is not None and self.limit_mode != 1:
+            key = (int(round(lx / self.axis_quantum)), int(round(ly / self.axis_quantum)),
+                   int(round(rx / self.axis_quantum)), int(round(angle / self.angle_quantum)), self.limit_mode)
+            speeds = self.wheel_speed_cache.get(key)
+            if speeds is not None:
+                context.drive.apply_wheel_speeds(speeds)
+                return
+            lx = key[0] * self.axis_quantum
+            ly = key[1] * self.axis_quantum
+            rx = key[2] * self.axis_quantum
+            angle = key[3] * self.angle_quantum
+
+        # Get a vector from the left hand analogue stick and scale it up to our
+        # maximum translation speed, this will mean we go as fast directly forward
+        # as possible when the stick is pushed fully forwards. We work with the x and y
+        # components directly rather than creating a Vector2 every tick.
+        x = lx * self.max_trn
+        y = ly * self.max_trn
 
-        if self.pose_display_interval.should_run():
-            if self.absolute_motion:
-                context.feather.set_direction(self.front - self.dead_reckoning.pose.orientation)
-            else:
-                context.feather.set_direction(self.front)
+        self._set_translation_angle(angle)
+        (xx, xy), (yx, yy) = self.translation_rotation
+        translate_x = x * xx + y * yx
+        translate_y = x * xy + y * yy
 
         # Get the rotation in radians per second from the right hand stick's X axis,
         # scaling it to our maximum rotational speed. When standing still this means
         # that full right on the right hand stick corresponds to maximum speed
         # clockwise rotation.
-        rotate = context.joystick.get_axis_value('rx') * self.max_rot
-
-        # Given the translation vector and rotation, use the chassis object to calculate
-        # the speeds required in revolutions per second for each wheel. We'll scale these by the
-        # wheel maximum speeds to get a range of -1.0 to 1.0
-        # This is a :class:`approxeng.holochassis.chassis.WheelSpeeds` containing the speeds and any
-        # scaling applied to bring the requested velocity within the range the chassis can
-        # actually perform.
-        motion = Motion(translation=translate, rotation=rotate)
+        rotate = rx * self.max_rot
+
+        # Given the translation and rotation, use the drive to calculate the speeds required for
+        # each wheel and send them over the I2C bus to the motors. Any scaling needed to bring the
+        # requested velocity within the range the chassis can actually perform is applied in the
+        # same way as HoloChassis.get_wheel_speeds. The motion limit is stateful and works on
+        # Motion objects, so only build one when it's in use.
         if self.limit_mode == 1:
-            motion = self.motion_limit.limit_and_return(motion)
-        speeds = [speed * -60 for speed in context.chassis.get_wheel_speeds(motion=motion).speeds]
-        print self.dead_reckoning.pose
-        # Send desired motor speed values over the I2C bus to the motors
-        context.motors.set_speeds(speeds)
+            motion = self.motion_limit.limit_and_return(
+                Motion(translation=Vector2(translate_x, translate_y), rotation=rotate))
+            context.drive.set_wheel_speeds_from_motion(motion)
+        else:
+            context.drive.set_wheel_speeds(translate_x, translate_y, rotate)
+        if key is not None:
+            self.wheel_speed_cache.put(key, tuple(context.drive.wheel_speeds))
+
+    def shutdown(self, context):
+        if self.wheel_speed_cache is not None:
+            context.display.log('wheel_speed_cache', str(self.wheel_speed_cache))
+
+    def _set_translation_angle(self, angle):
+        """
+        Rotating the translation vector is a linear operation, so rather than calling rotate_vector every tick we
+        rotate the two unit vectors whenever the angle changes and combine the results with the stick values.
+        """
+        if angle != self.translation_angle:
+            self.translation_angle = angle
+            x_axis = rotate_vector(Vector2(1, 0), angle)
+            y_axis = rotate_vector(Vector2(0, 1), angle)
+            self.translation_rotation = ((x_axis.x, x_axis.y), (y_axis.x, y_axis.y))
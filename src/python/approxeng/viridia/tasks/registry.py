@@ -0,0 +1,33 @@
+"""
+The tasks shown in Viridia's top level menu. Each is registered by module and class name, and wrapped in a
+:class:`approxeng.viridia.task.LazyTask`, so importing this module doesn't import any of the tasks or their
+dependencies.
+"""
+
+from approxeng.viridia.task import LazyTask
+
+BUILT_IN_TASKS = [('Manual motion', 'approxeng.viridia.tasks.manual_control', 'ManualMotionTask',
+                   'Drive with the left stick, turn with the right'),
+                  ('Linear calibration', 'approxeng.viridia.tasks.calibration', 'LinearCalibrationTask',
+                   'Drive in a straight line to calibrate wheel sizes'),
+                  ('Angular calibration', 'approxeng.viridia.tasks.calibration', 'AngularCalibrationTask',
+                   'Spin on the spot to calibrate the chassis dimensions'),
+                  ('Line follower', 'approxeng.viridia.tasks.camera', 'LineFollowerTask',
+                   'Follow a line using the camera')]
+'List of (task_name, module, class_name, description) for each of the built-in tasks, in menu order'
+
+
+def built_in_tasks(options=None):
+    """
+    Create lazy tasks for each of the built-in tasks
+
+    :param options:
+        Optional, a dict of task class name to a dict of keyword arguments for that task's constructor. Defaults to
+        None to use the defaults for every task
+    :return:
+        A list of :class:`approxeng.viridia.task.LazyTask`, in menu order
+    """
+    options = options if options is not None else {}
+    return [LazyTask(module=module, class_name=class_name, task_name=task_name, description=description,
+                     **options.get(class_name, {}))
+            for task_name, module, class_name, description in BUILT_IN_TASKS]
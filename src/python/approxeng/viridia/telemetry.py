@@ -0,0 +1,601 @@
+"""
+Binary telemetry recording, streaming, and offline replay. The task manager can be given a
+:class:`approxeng.viridia.telemetry.TelemetryRecorder` which appends a fixed size record for every tick to a
+preallocated, memory mapped, log file. Logs are read back with :class:`approxeng.viridia.telemetry.TelemetryLog`, and
+:class:`approxeng.viridia.telemetry.TelemetryReplay` feeds a log back through a task using stand-in motors and joystick,
+so runs recorded on the robot can be reproduced, checked, and timed on a development machine. For live monitoring the
+task manager can also be given a :class:`approxeng.viridia.telemetry.TelemetryPublisher`, which streams records over a
+local socket to be read with :class:`approxeng.viridia.telemetry.TelemetrySubscriber`.
+"""
+
+import mmap
+import os
+import socket
+import struct
+from collections import namedtuple
+from math import hypot, pi
+from threading import Thread
+from time import time, sleep
+
+from approxeng.viridia.odometry import OdometrySampler
+from approxeng.viridia.simulation import ScriptedButtonPresses, SimulatedFeather, SimulatedGPIO, SimulatedI2C, \
+    NullDisplay
+
+AXES = ('lx', 'ly', 'rx', 'ry')
+'Joystick axes recorded in each tick, in record order'
+
+BUTTONS = ('circle', 'cross', 'square', 'triangle', 'home', 'select', 'start', 'l1', 'l2', 'r1', 'r2', 'ls', 'rs',
+           'dup', 'ddown', 'dleft', 'dright')
+'Buttons recorded in each tick, the bit for each button in the record is 1 << its index in this tuple'
+
+MAGIC = b'VTLM'
+VERSION = 1
+HEADER = struct.Struct('<4sHHIIQ')
+'Magic, version, wheel count, record size, capacity in records, and the number of records written'
+COUNT_OFFSET = 16
+'Offset of the record count within the header, updated after each record is written'
+
+TelemetryRecord = namedtuple('TelemetryRecord',
+                             ['timestamp', 'tick', 'task', 'axes', 'buttons', 'wheel_speeds', 'angles', 'pose'])
+"""
+A single tick read from a log. timestamp is the time the tick started, tick the number of ticks the task had completed,
+task the task class name, axes a tuple of axis values in the order of AXES, buttons a frozenset of names of buttons
+pressed, wheel_speeds a tuple of commanded wheel speeds in RPM, angles a tuple of the most recent wheel angles in
+revolutions, and pose a tuple of x, y and orientation from dead reckoning.
+"""
+
+
+def _record_struct(wheels):
+    return struct.Struct('<dI16sI' + 'f' * len(AXES) + 'f' * wheels + 'd' * wheels + 'ddd')
+
+
+def _measured_angles(context):
+    # Most recent wheel angles, from the odometry sampler if there is one, or None if none have been read
+    if context.odometry is not None:
+        sample = context.odometry.latest()
+        if sample is not None:
+            return sample[2]
+        return None
+    return context.motors.last_angles
+
+
+def _pose(task, context):
+    # Use the task's own dead reckoning if it has one, as ManualMotionTask does, otherwise the drive's
+    dead_reckoning = getattr(task, 'dead_reckoning', None)
+    if dead_reckoning is None:
+        dead_reckoning = context.drive.dead_reckoning
+    return dead_reckoning.pose
+
+
+class TelemetryRecorder:
+    """
+    Appends a fixed size, struct packed, record for every tick to a log file. The file is created at full size when the
+    recorder is created and memory mapped, so recording a tick is a single pack into the mapped memory with no system
+    calls. The kernel writes the pages back to the file in the background. Once the log is full further ticks are
+    counted in dropped but not recorded.
+    """
+
+    def __init__(self, path, capacity=180000, wheels=3):
+        """
+        Create a new log file, replacing any existing file at the path
+
+        :param path:
+            Path of the log file
+        :param capacity:
+            Maximum number of records, defaults to 180000, an hour at 50 ticks per second
+        :param wheels:
+            Number of wheels, defaults to 3
+        """
+        self.path = path
+        self.capacity = capacity
+        self.wheels = wheels
+        self.record_struct = _record_struct(wheels)
+        self.count = 0
+        self.dropped = 0
+        size = HEADER.size + capacity * self.record_struct.size
+        self.file = open(path, 'w+b')
+        self.file.truncate(size)
+        self.map = mmap.mmap(self.file.fileno(), size)
+        HEADER.pack_into(self.map, 0, MAGIC, VERSION, wheels, self.record_struct.size, capacity, 0)
+        self.zero_angles = (0.0,) * wheels
+
+    def record(self, timestamp, tick, task, context):
+        """
+        Record a tick, called by the task manager once the active task has been polled
+
+        :param timestamp:
+            Time the tick started
+        :param tick:
+            The tick count passed to the task
+        :param task:
+            The active task. If this has a dead_reckoning attribute, as :class:`ManualMotionTask` does, the pose from
+            that is recorded, otherwise the pose from the drive's dead reckoning is used
+        :param context:
+            The :class:`approxeng.viridia.task.TaskContext` for the tick
+        """
+        if self.count >= self.capacity:
+            self.dropped += 1
+            return
+        joystick = context.joystick
+        buttons_pressed = context.buttons_pressed
+        buttons = 0
+        for index, sname in enumerate(BUTTONS):
+            if buttons_pressed.was_pressed(sname):
+                buttons |= 1 << index
+        angles = _measured_angles(context)
+        if angles is None:
+            angles = self.zero_angles
+        pose = _pose(task, context)
+        self.record_struct.pack_into(self.map, HEADER.size + self.count * self.record_struct.size,
+                                     timestamp, tick, task.__class__.__name__[:16].encode('ascii'), buttons,
+                                     *([joystick.get_axis_value(sname) for sname in AXES] +
+                                       list(context.drive.wheel_speeds) + list(angles) +
+                                       [pose.position.x, pose.position.y, pose.orientation]))
+        self.count += 1
+        struct.pack_into('<Q', self.map, COUNT_OFFSET, self.count)
+
+    def close(self):
+        """
+        Flush the log to disk and close it
+        """
+        if self.map is not None:
+            self.map.flush()
+            self.map.close()
+            self.file.close()
+            self.map = None
+
+
+PUBLISHED_VERSION = 1
+PUBLISHED_HEADER = struct.Struct('<BB')
+'Version and wheel count, at the start of every published record'
+
+PublishedRecord = namedtuple('PublishedRecord',
+                             ['timestamp', 'tick', 'period', 'poll_time', 'task', 'wheel_speeds', 'angles', 'pose'])
+"""
+A single tick received from a :class:`approxeng.viridia.telemetry.TelemetryPublisher`. timestamp is the time the tick
+started, tick the number of ticks the task had completed, period the time in seconds since the previous tick started,
+poll_time the time in seconds from the start of the tick to the end of the task's poll, task the task's name,
+wheel_speeds a tuple of commanded wheel speeds in RPM, angles a tuple of the most recent wheel angles in revolutions,
+and pose a tuple of x, y and orientation.
+"""
+
+
+def _published_struct(wheels):
+    return struct.Struct('<BBdIff24s' + 'f' * wheels + 'd' * wheels + 'fff')
+
+
+class TelemetryPublisher:
+    """
+    Streams the state of the robot to local listeners, such as a dashboard, as one datagram per tick over UDP on
+    localhost or a unix domain datagram socket. Each datagram is a single struct packed record, which can be decoded
+    with :func:`approxeng.viridia.telemetry.decode_published`.
+
+    The task manager calls record on the task loop's thread, which copies the values for the tick into a preallocated
+    ring buffer and returns. Packing and sending happen on a background thread, so a slow or absent listener never
+    holds up the task loop. The ring has a single producer and a single consumer, each of which only ever moves its own
+    index, so needs no lock. If the sender falls behind and the ring fills, new ticks are counted in dropped.
+    """
+
+    def __init__(self, address, rate=20, capacity=64, wheels=3):
+        """
+        Create a new publisher, call start() to start sending
+
+        :param address:
+            Either a (host, port) tuple to send UDP datagrams, normally with host '127.0.0.1', or a string path of a
+            unix domain datagram socket
+        :param rate:
+            Maximum number of records published per second, ticks arriving faster than this are skipped. Defaults to 20
+        :param capacity:
+            Number of records the ring buffer holds, defaults to 64
+        :param wheels:
+            Number of wheels, defaults to 3
+        """
+        self.address = address
+        self.interval = 1.0 / rate
+        self.capacity = capacity
+        self.wheels = wheels
+        self.record_struct = _published_struct(wheels)
+        self.slots = [None] * capacity
+        self.head = 0
+        'Number of records written, only changed by the producer'
+        self.tail = 0
+        'Number of records sent, only changed by the consumer'
+        self.last_published = None
+        self.last_timestamp = None
+        self.zero_angles = (0.0,) * wheels
+        self.dropped = 0
+        self.sent = 0
+        self.errors = 0
+        self.socket = None
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        """
+        Open the socket and start the sender thread
+
+        :return:
+            This publisher, for chaining
+        """
+        if self.thread is None:
+            family = socket.AF_UNIX if isinstance(self.address, str) else socket.AF_INET
+            self.socket = socket.socket(family, socket.SOCK_DGRAM)
+            self.socket.setblocking(False)
+            self.running = True
+            self.thread = Thread(target=self._send_loop, name='telemetry-publisher')
+            self.thread.daemon = True
+            self.thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stop the sender thread and close the socket, any unsent records are discarded
+        """
+        if self.thread is not None:
+            self.running = False
+            self.thread.join()
+            self.thread = None
+            self.socket.close()
+            self.socket = None
+
+    def record(self, timestamp, tick, task, context):
+        """
+        Publish a tick, called by the task manager once the active task has been polled. Ticks arriving sooner than the
+        publishing interval after the last published tick are skipped.
+
+        :param timestamp:
+            Time the tick started
+        :param tick:
+            The tick count passed to the task
+        :param task:
+            The active task, if this has a dead_reckoning attribute the pose from that is published, otherwise the pose
+            from the drive's dead reckoning is used
+        :param context:
+            The :class:`approxeng.viridia.task.TaskContext` for the tick
+        """
+        period = 0.0 if self.last_timestamp is None else timestamp - self.last_timestamp
+        self.last_timestamp = timestamp
+        if self.last_published is not None and timestamp - self.last_published < self.interval:
+            return
+        if self.head - self.tail >= self.capacity:
+            self.dropped += 1
+            return
+        self.last_published = timestamp
+        angles = _measured_angles(context)
+        if angles is None:
+            angles = self.zero_angles
+        pose = _pose(task, context)
+        poll_time = context.clock.time() - timestamp
+        self.slots[self.head % self.capacity] = (timestamp, tick, period, poll_time, task.task_name,
+                                                 tuple(context.drive.wheel_speeds), tuple(angles),
+                                                 pose.position.x, pose.position.y, pose.orientation)
+        # Publish the slot only once it's been filled
+        self.head += 1
+
+    def _send_loop(self):
+        while self.running:
+            while self.tail < self.head:
+                index = self.tail % self.capacity
+                timestamp, tick, period, poll_time, task_name, speeds, angles, x, y, orientation = self.slots[index]
+                self.slots[index] = None
+                self.tail += 1
+                data = self.record_struct.pack(*((PUBLISHED_VERSION, self.wheels, timestamp, tick, period, poll_time,
+                                                  task_name[:24].encode('utf-8')) + speeds + angles +
+                                                 (x, y, orientation)))
+                try:
+                    self.socket.sendto(data, self.address)
+                    self.sent += 1
+                except socket.error:
+                    # Nobody listening, or the listener isn't keeping up
+                    self.errors += 1
+            sleep(self.interval / 2)
+
+    def __str__(self):
+        return 'TelemetryPublisher[ address={}, sent={}, dropped={}, errors={} ]'.format(self.address, self.sent,
+                                                                                        self.dropped, self.errors)
+
+
+def decode_published(data):
+    """
+    Decode a datagram sent by a :class:`approxeng.viridia.telemetry.TelemetryPublisher`
+
+    :param data:
+        The datagram
+    :return:
+        A :class:`approxeng.viridia.telemetry.PublishedRecord`
+    :raises ValueError:
+        If the datagram isn't a published record of a supported version
+    """
+    if len(data) < PUBLISHED_HEADER.size:
+        raise ValueError('Datagram too short for a published record')
+    version, wheels = PUBLISHED_HEADER.unpack_from(data, 0)
+    record_struct = _published_struct(wheels)
+    if version != PUBLISHED_VERSION or len(data) != record_struct.size:
+        raise ValueError('Datagram is not a version {} published record'.format(PUBLISHED_VERSION))
+    values = record_struct.unpack(data)
+    return PublishedRecord(timestamp=values[2], tick=values[3], period=values[4], poll_time=values[5],
+                           task=values[6].rstrip(b'\0').decode('utf-8'),
+                           wheel_speeds=values[7:7 + wheels], angles=values[7 + wheels:7 + wheels * 2],
+                           pose=values[7 + wheels * 2:])
+
+
+class TelemetrySubscriber:
+    """
+    Receives records from a :class:`approxeng.viridia.telemetry.TelemetryPublisher`, for use by a dashboard or other
+    local monitoring tool. Iterate over the subscriber to receive records as they arrive.
+    """
+
+    def __init__(self, address, timeout=None):
+        """
+        Bind to the address the publisher sends to
+
+        :param address:
+            Either a (host, port) tuple or a string path of a unix domain socket, as passed to the publisher. Any
+            existing file at a unix socket path is replaced
+        :param timeout:
+            Maximum time in seconds to wait for each record, defaults to None to wait indefinitely
+        """
+        family = socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+        if family == socket.AF_UNIX and os.path.exists(address):
+            os.remove(address)
+        self.socket = socket.socket(family, socket.SOCK_DGRAM)
+        self.socket.bind(address)
+        self.socket.settimeout(timeout)
+
+    def receive(self):
+        """
+        Wait for the next record
+
+        :return:
+            A :class:`approxeng.viridia.telemetry.PublishedRecord`, or None if the timeout expired first
+        """
+        try:
+            return decode_published(self.socket.recv(4096))
+        except socket.timeout:
+            return None
+
+    def __iter__(self):
+        while True:
+            record = self.receive()
+            if record is not None:
+                yield record
+
+    def close(self):
+        self.socket.close()
+
+
+class TelemetryLog:
+    """
+    Read access to a log written by :class:`approxeng.viridia.telemetry.TelemetryRecorder`. Logs can be read while
+    they're still being written, len() and iteration cover the records written when they're called.
+    """
+
+    def __init__(self, path):
+        """
+        Open a log
+
+        :param path:
+            Path of the log file
+        :raises ValueError:
+            If the file isn't a telemetry log of a supported version
+        """
+        self.path = path
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), os.path.getsize(path), access=mmap.ACCESS_READ)
+        magic, version, self.wheels, record_size, self.capacity, _ = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('{} is not a version {} telemetry log'.format(path, VERSION))
+        self.record_struct = _record_struct(self.wheels)
+        if record_size != self.record_struct.size:
+            raise ValueError('{} has records of {} bytes, expected {}'.format(path, record_size,
+                                                                            self.record_struct.size))
+
+    def __len__(self):
+        return struct.unpack_from('<Q', self.map, COUNT_OFFSET)[0]
+
+    def __getitem__(self, index):
+        count = len(self)
+        if index < 0:
+            index += count
+        if not 0 <= index < count:
+            raise IndexError('Record {} out of range, log has {} records'.format(index, count))
+        values = self.record_struct.unpack_from(self.map, HEADER.size + index * self.record_struct.size)
+        axes_end = 4 + len(AXES)
+        speeds_end = axes_end + self.wheels
+        angles_end = speeds_end + self.wheels
+        return TelemetryRecord(timestamp=values[0], tick=values[1],
+                               task=values[2].rstrip(b'\0').decode('ascii'),
+                               axes=values[4:axes_end],
+                               buttons=frozenset(sname for index, sname in enumerate(BUTTONS)
+                                                 if values[3] & (1 << index)),
+                               wheel_speeds=values[axes_end:speeds_end],
+                               angles=values[speeds_end:angles_end],
+                               pose=values[angles_end:angles_end + 3])
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+
+class ReplayJoystick:
+    """
+    Stands in for the joystick, presenting the axes and buttons of the current record
+    """
+
+    def __init__(self):
+        self.buttons = self
+        self.axes = dict((sname, 0.0) for sname in AXES)
+        self.pressed = ScriptedButtonPresses(frozenset())
+
+    def set_record(self, record):
+        for sname, value in zip(AXES, record.axes):
+            self.axes[sname] = value
+        self.pressed = ScriptedButtonPresses(record.buttons)
+
+    def get_axis_value(self, sname):
+        return self.axes.get(sname, 0.0)
+
+    def get_and_clear_button_press_history(self):
+        return self.pressed
+
+
+class ReplayMotors:
+    """
+    Stands in for :class:`approxeng.viridia.motors.Motors`, returning the wheel angles of the current record and
+    keeping the most recent commanded speeds
+    """
+
+    def __init__(self, motor_count=3):
+        self.motor_count = motor_count
+        self.speeds = [0.0] * motor_count
+        self.last_angles = None
+        self.enabled = False
+
+    def set_record(self, record):
+        self.last_angles = list(record.angles)
+
+    def set_speeds(self, speeds):
+        self.speeds[:] = speeds
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def read_angles(self):
+        return self.last_angles
+
+
+class TelemetryReplay:
+    """
+    Feeds a recorded log back through a task, such as :class:`ManualMotionTask` or one of the calibration tasks. Each
+    record's joystick state and wheel angles are presented to the task through stand-in joystick and motors, and an
+    odometry sampler, the task is polled, and the wheel speeds it commands are compared with those recorded. Lighting
+    commands go to a :class:`approxeng.viridia.simulation.SimulatedFeather` through an asynchronous feather, as on the
+    robot, so the delays the feather needs between writes don't count towards the task's poll time.
+
+    Tasks which use the time directly, such as the calibration tasks, only reproduce their recorded behaviour when
+    replayed in real time.
+
+    Call close when finished with the replay, to stop the feather's sender thread.
+    """
+
+    def __init__(self, log, chassis, use_odometry=True):
+        """
+        :param log:
+            A :class:`approxeng.viridia.telemetry.TelemetryLog`
+        :param chassis:
+            The chassis the log was recorded with
+        :param use_odometry:
+            If True the recorded angles are presented through an odometry sampler, as in the service script,
+            otherwise tasks read them from the stand-in motors. Defaults to True
+        """
+        from approxeng.viridia.feather import Feather
+        from approxeng.viridia.task import TaskManager
+        self.log = log
+        self.joystick = ReplayJoystick()
+        self.motors = ReplayMotors(motor_count=log.wheels)
+        # An odometry sampler which is never started, recorded angles are added to it as each record is replayed
+        self.odometry = OdometrySampler(motors=self.motors) if use_odometry else None
+        i2c = SimulatedI2C()
+        self.feather = SimulatedFeather(clock=time)
+        i2c.add_device(0x31, self.feather)
+        gpio = SimulatedGPIO()
+        gpio.connect(27, self.feather.set_led_disable)
+        self.task_manager = TaskManager(chassis=chassis, joystick=self.joystick, i2c=i2c, motors=self.motors,
+                                        feather=Feather(i2c=i2c, gpio=gpio, asynchronous=True), display=NullDisplay(),
+                                        odometry=self.odometry)
+
+    def close(self):
+        """
+        Send any lighting commands still pending and stop the feather's sender thread. The log isn't closed.
+        """
+        self.task_manager.feather.stop()
+
+    def run(self, task, task_name=None, start=0, end=None, realtime=False, speed_tolerance=0.5):
+        """
+        Replay the log through a task
+
+        :param task:
+            The task to run, it is initialised before the first record is replayed
+        :param task_name:
+            If specified, only records made while a task with this class name was active are replayed. Defaults to
+            None to replay every record in the range
+        :param start:
+            Index of the first record to replay, defaults to 0
+        :param end:
+            Index after the last record to replay, defaults to None for the end of the log
+        :param realtime:
+            If True, sleep between records to reproduce the recorded timing. Defaults to False to run as fast as
+            possible
+        :param speed_tolerance:
+            Commanded wheel speeds which differ from those recorded by more than this, in RPM, are counted as
+            mismatches. Defaults to 0.5
+        :return:
+            A dict containing 'ticks', the number of records replayed, 'seconds_per_tick', the mean time taken to
+            poll the task, 'max_speed_error', the largest difference in RPM between recorded and replayed wheel
+            speeds, 'mismatches', the number of ticks where that difference exceeded the tolerance, 'pose', the pose
+            from the task's dead reckoning after the last record replayed, 'recorded_pose', the pose recorded in that
+            record, and 'position_error' and 'orientation_error', the distance in mm and the angle in radians between
+            the two. Poses are tuples of x, y and orientation, and are None if no records were replayed
+        """
+        if end is None:
+            end = len(self.log)
+        task_manager = self.task_manager
+        drive = task_manager.drive
+        task.init_task(context=task_manager._build_context())
+        ticks = 0
+        poll_time = 0.0
+        max_error = 0.0
+        mismatches = 0
+        pose = None
+        recorded_pose = None
+        first_timestamp = None
+        replay_start = time()
+        for index in range(start, end):
+            record = self.log[index]
+            if task_name is not None and record.task != task_name:
+                continue
+            if realtime:
+                if first_timestamp is None:
+                    first_timestamp = record.timestamp
+                delay = (record.timestamp - first_timestamp) - (time() - replay_start)
+                if delay > 0:
+                    sleep(delay)
+            self.joystick.set_record(record)
+            self.motors.set_record(record)
+            if self.odometry is not None:
+                self.odometry.add_sample(timestamp=record.timestamp, angles=record.angles)
+            context = task_manager._build_context()
+            poll_start = time()
+            task.poll_task(context=context, tick=ticks)
+            poll_time += time() - poll_start
+            error = max(abs(a - b) for a, b in zip(drive.wheel_speeds, record.wheel_speeds))
+            max_error = max(max_error, error)
+            if error > speed_tolerance:
+                mismatches += 1
+            replayed = _pose(task, context)
+            pose = (replayed.position.x, replayed.position.y, replayed.orientation)
+            recorded_pose = record.pose
+            ticks += 1
+        task.shutdown(context=task_manager._build_context())
+        task_manager.feather.flush()
+        position_error = None
+        orientation_error = None
+        if pose is not None:
+            position_error = hypot(pose[0] - recorded_pose[0], pose[1] - recorded_pose[1])
+            # Smallest angle between the two orientations, either way round
+            orientation_error = abs((pose[2] - recorded_pose[2] + pi) % (2 * pi) - pi)
+        return {'ticks': ticks,
+                'seconds_per_tick': poll_time / ticks if ticks > 0 else None,
+                'max_speed_error': max_error,
+                'mismatches': mismatches,
+                'pose': pose,
+                'recorded_pose': recorded_pose,
+                'position_error': position_error,
+                'orientation_error': orientation_error}
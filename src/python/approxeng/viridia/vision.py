@@ -0,0 +1,386 @@
+import numpy as np
+
+GREY_WEIGHTS = np.array([0.114, 0.587, 0.299], dtype=np.float32)
+'Weights of the blue, green and red channels when converting to greyscale, as used by OpenCV for BGR images'
+
+
+def _find_runs(counts, min_detection_area):
+    """
+    Find runs of non-zero values in a one dimensional array of dark pixel counts
+
+    :param counts:
+        Numpy array of counts
+    :param min_detection_area:
+        Runs whose counts sum to less than this are ignored
+    :return:
+        A tuple of two numpy arrays, the index at which each run starts and the centroid of each run
+    """
+    occupied = np.concatenate(([False], counts > 0, [False]))
+    edges = np.flatnonzero(occupied[1:] != occupied[:-1])
+    if len(edges) == 0:
+        return edges, np.zeros(0)
+    # Each run of occupied columns starts a reduceat segment, the gap following a run adds nothing to its sums
+    starts = edges[0::2]
+    areas = np.add.reduceat(counts, starts)
+    moments = np.add.reduceat(counts * np.arange(len(counts)), starts)
+    keep = areas >= min_detection_area
+    return starts[keep], moments[keep].astype(np.float64) / areas[keep]
+
+
+class BandLineFinder:
+    """
+    Finds dark lines crossing a horizontal band of the image. Only the band is ever converted or thresholded, the rest
+    of the frame is never touched, so the cost depends on the width and height of the band rather than the size of the
+    whole frame.
+
+    Rather than blurring the band and finding contours, each pixel darker than the threshold is counted, the counts are
+    summed down each column, and each run of adjacent columns containing dark pixels is treated as a line. This
+    assumes lines cross the band roughly vertically, which holds for a band a few tens of pixels high. The area of a
+    line is the number of dark pixels in its run of columns, and its position is the x centroid of those pixels.
+
+    Results are in the same form as approxeng.picamera.find_lines, so the two can be swapped: a sorted list of x
+    positions, from -1.0 at the left of the band to 1.0 at the right, or the other way round if inverted.
+    """
+
+    def __init__(self, threshold=50, scan_region_height=20, scan_region_position=0, scan_region_width_pad=0,
+                 min_detection_area=40, invert=False):
+        """
+        Create a new line finder
+
+        :param threshold:
+            Pixels with a grey level at or below this value, from 0 to 255, are considered to be part of a line.
+            Defaults to 50
+        :param scan_region_height:
+            The height in pixels of the band, defaults to 20
+        :param scan_region_position:
+            The position of the band relative to the entire frame. 0 is at the top, 1.0 is as far towards the bottom
+            as it will go. Defaults to 0
+        :param scan_region_width_pad:
+            The number of pixels to discard at either edge of the band, defaults to 0
+        :param min_detection_area:
+            The minimum number of dark pixels in a line, anything smaller is ignored. Defaults to 40
+        :param invert:
+            Set to True to have -1.0 at the right hand edge of the band rather than the left, defaults to False
+        """
+        self.threshold = threshold
+        self.scan_region_height = scan_region_height
+        self.scan_region_position = scan_region_position
+        self.scan_region_width_pad = scan_region_width_pad
+        self.min_detection_area = min_detection_area
+        self.invert = invert
+
+    def band(self, image):
+        """
+        Crop the scan band from an image, without copying it
+
+        :param image:
+            Image as a numpy array, either greyscale with shape (height, width) or BGR with shape (height, width, 3)
+        :return:
+            A view of the band
+        """
+        height, width = image.shape[0], image.shape[1]
+        band_height = min(self.scan_region_height, height)
+        top = int((height - band_height) * self.scan_region_position)
+        return image[top:top + band_height, self.scan_region_width_pad:width - self.scan_region_width_pad]
+
+    def column_counts(self, image):
+        """
+        Count the dark pixels in each column of the scan band
+
+        :param image:
+            Image as a numpy array, either greyscale or BGR
+        :return:
+            A one dimensional numpy array of dark pixel counts, one per column of the band
+        """
+        band = self.band(image)
+        if band.ndim == 3:
+            band = np.dot(band, GREY_WEIGHTS)
+        return (band <= self.threshold).sum(axis=0)
+
+    def find_lines(self, image):
+        """
+        Find lines crossing the scan band
+
+        :param image:
+            Image as a numpy array, either greyscale or BGR
+        :return:
+            A sorted list of line positions, from -1.0 to 1.0
+        """
+        counts = self.column_counts(image)
+        width = len(counts)
+        if width == 0:
+            return []
+        starts, centroids = _find_runs(counts, self.min_detection_area)
+        positions = (centroids + 0.5) * 2.0 / width - 1.0
+        if self.invert:
+            positions = -positions
+        return sorted(positions.tolist())
+
+    def __call__(self, image):
+        return self.find_lines(image)
+
+    @staticmethod
+    def found(lines):
+        """
+        Check whether a result from find_lines includes a line. Every finder has this method, so results can be checked
+        without knowing which finder produced them
+
+        :param lines:
+            The result of find_lines
+        :return:
+            True if at least one line was found
+        """
+        return len(lines) > 0
+
+
+class LookaheadResult(object):
+    """
+    Lines found by a :class:`approxeng.viridia.vision.MultiBandLineFinder`, along with the path traced through them
+
+    :ivar positions:
+        List, one entry per band in order of increasing distance, of sorted lists of line positions from -1.0 to 1.0
+    :ivar distances:
+        List of the physical distance of each band from the robot's centre, in mm
+    :ivar track:
+        List, one entry per band, of the x coordinate in mm of the line followed through that band, or None if no line
+        was found in the band
+    :ivar coefficients:
+        Polynomial coefficients, highest power first, of the track's x coordinate as a function of distance, or None if
+        no lines were found at all
+    :ivar curvature:
+        Curvature of the track at the nearest band containing a line, in 1/mm. Positive when the track bends towards
+        positive x. Zero if fewer than three bands contain a line
+    """
+
+    __slots__ = ['positions', 'distances', 'track', 'coefficients', 'curvature']
+
+    def __init__(self, positions, distances, track, coefficients, curvature):
+        self.positions = positions
+        self.distances = distances
+        self.track = track
+        self.coefficients = coefficients
+        self.curvature = curvature
+
+    @property
+    def found(self):
+        """
+        True if a line was found in any band
+        """
+        return self.coefficients is not None
+
+    def x_at(self, distance):
+        """
+        Estimate the x coordinate of the track at a given distance
+
+        :param distance:
+            Distance from the robot's centre, in mm
+        :return:
+            The x coordinate in mm, or None if no lines were found
+        """
+        if self.coefficients is None:
+            return None
+        return float(np.polyval(self.coefficients, distance))
+
+    @property
+    def furthest_distance(self):
+        """
+        The distance of the furthest band in which a line was found, or None if no lines were found
+        """
+        for distance, x in zip(reversed(self.distances), reversed(self.track)):
+            if x is not None:
+                return distance
+        return None
+
+
+class MultiBandLineFinder:
+    """
+    Finds lines in several horizontal bands at once, each corresponding to a different distance ahead of the robot, and
+    fits a path through them so that steering can anticipate bends rather than reacting once the robot is already on
+    them.
+
+    The rows of every band are gathered from the frame in a single indexing operation, then converted to grey,
+    thresholded and summed down each column together. The column counts for all the bands are laid end to end with a
+    blank column between each, so a single pass of the run finding used by
+    :class:`approxeng.viridia.vision.BandLineFinder` finds the lines in every band. The cost of each frame therefore
+    grows with the total number of rows scanned, without any per-band overhead beyond a little bookkeeping.
+
+    The followed line is picked in the nearest band as the left-most line, as with the single band line follower, and
+    in each further band as the line closest to the one picked in the band before. A polynomial of x against distance,
+    up to quadratic, is then fitted through the picked lines.
+    """
+
+    def __init__(self, bands, threshold=50, scan_region_height=20, scan_region_width_pad=0, min_detection_area=40,
+                 invert=False):
+        """
+        Create a new multi-band line finder
+
+        :param bands:
+            List of (scan_region_position, physical_distance, physical_width) tuples, one per band. The position is
+            relative to the frame as for :class:`approxeng.viridia.vision.BandLineFinder`, physical_distance is the
+            distance in mm of the band from the robot's centre, and physical_width the width in mm of floor covered by
+            the band. Bands are sorted by distance.
+        :param threshold:
+            Pixels with a grey level at or below this value are considered to be part of a line. Defaults to 50
+        :param scan_region_height:
+            The height in pixels of each band, defaults to 20
+        :param scan_region_width_pad:
+            The number of pixels to discard at either edge of each band, defaults to 0
+        :param min_detection_area:
+            The minimum number of dark pixels in a line, anything smaller is ignored. Defaults to 40
+        :param invert:
+            Set to True to have -1.0 at the right hand edge of the band rather than the left, defaults to False
+        """
+        self.bands = sorted(bands, key=lambda band: band[1])
+        self.distances = [float(band[1]) for band in self.bands]
+        self.half_widths = [band[2] / 2.0 for band in self.bands]
+        self.threshold = threshold
+        self.scan_region_height = scan_region_height
+        self.scan_region_width_pad = scan_region_width_pad
+        self.min_detection_area = min_detection_area
+        self.invert = invert
+        self._rows = None
+        self._rows_height = None
+
+    def _band_rows(self, height):
+        if self._rows_height != height:
+            band_height = min(self.scan_region_height, height)
+            self._rows = np.concatenate(
+                [np.arange(band_height) + int((height - band_height) * band[0]) for band in self.bands])
+            self._rows_height = height
+        return self._rows
+
+    def column_counts(self, image):
+        """
+        Count the dark pixels in each column of each band
+
+        :param image:
+            Image as a numpy array, either greyscale or BGR
+        :return:
+            A two dimensional numpy array of dark pixel counts, with one row per band in order of increasing distance
+        """
+        width = image.shape[1]
+        rows = image[self._band_rows(image.shape[0]), self.scan_region_width_pad:width - self.scan_region_width_pad]
+        if rows.ndim == 3:
+            rows = np.dot(rows, GREY_WEIGHTS)
+        dark = rows <= self.threshold
+        return dark.reshape(len(self.bands), -1, dark.shape[1]).sum(axis=1)
+
+    def find_band_lines(self, image):
+        """
+        Find lines in each band
+
+        :param image:
+            Image as a numpy array, either greyscale or BGR
+        :return:
+            A list, one entry per band in order of increasing distance, of sorted lists of line positions from -1.0 to
+            1.0
+        """
+        counts = self.column_counts(image)
+        band_count, width = counts.shape
+        if width == 0:
+            return [[] for _ in self.bands]
+        stride = width + 1
+        # Blank column between bands, so runs can't carry over from the end of one band to the start of the next
+        padded = np.zeros((band_count, stride), dtype=counts.dtype)
+        padded[:, :width] = counts
+        starts, centroids = _find_runs(padded.ravel(), self.min_detection_area)
+        band_indices = starts // stride
+        positions = (centroids - band_indices * stride + 0.5) * 2.0 / width - 1.0
+        if self.invert:
+            positions = -positions
+        return [sorted(positions[band_indices == band].tolist()) for band in range(band_count)]
+
+    def find_lines(self, image):
+        """
+        Find lines in each band and fit a path through them
+
+        :param image:
+            Image as a numpy array, either greyscale or BGR
+        :return:
+            A :class:`approxeng.viridia.vision.LookaheadResult`
+        """
+        positions = self.find_band_lines(image)
+        track = []
+        previous = None
+        for band_positions, half_width in zip(positions, self.half_widths):
+            if len(band_positions) == 0:
+                track.append(None)
+                continue
+            xs = [position * half_width for position in band_positions]
+            if previous is None:
+                previous = xs[0]
+            else:
+                previous = min(xs, key=lambda x: abs(x - previous))
+            track.append(previous)
+        distances = [d for d, x in zip(self.distances, track) if x is not None]
+        xs = [x for x in track if x is not None]
+        coefficients = None
+        curvature = 0.0
+        if len(xs) == 1:
+            coefficients = np.array([xs[0]])
+        elif len(xs) > 1:
+            coefficients = np.polyfit(distances, xs, min(2, len(xs) - 1))
+            if len(coefficients) == 3:
+                slope = 2 * coefficients[0] * distances[0] + coefficients[1]
+                curvature = float(2 * coefficients[0] / (1 + slope * slope) ** 1.5)
+        return LookaheadResult(positions=positions, distances=self.distances, track=track,
+                               coefficients=coefficients, curvature=curvature)
+
+    def __call__(self, image):
+        return self.find_lines(image)
+
+    @staticmethod
+    def found(lines):
+        """
+        Check whether a result from find_lines includes a line in any band. Every finder has this method, so results
+        can be checked without knowing which finder produced them
+
+        :param lines:
+            The :class:`approxeng.viridia.vision.LookaheadResult` from find_lines
+        :return:
+            True if at least one line was found in any band
+        """
+        return lines.found
+
+
+class ContourLineFinder:
+    """
+    Finds lines using approxeng.picamera.find_lines, which blurs and thresholds the frame then uses OpenCV's contour
+    detection. Slower than :class:`approxeng.viridia.vision.BandLineFinder`, but copes better with lines crossing the
+    band at a steep angle.
+    """
+
+    def __init__(self, threshold=50, scan_region_height=20, scan_region_position=0, scan_region_width_pad=0,
+                 min_detection_area=40, invert=False, blur_kernel_size=9):
+        from approxeng.picamera import find_lines
+        self._find_lines = find_lines
+        self.threshold = threshold
+        self.scan_region_height = scan_region_height
+        self.scan_region_position = scan_region_position
+        self.scan_region_width_pad = scan_region_width_pad
+        self.min_detection_area = min_detection_area
+        self.invert = invert
+        self.blur_kernel_size = blur_kernel_size
+
+    def find_lines(self, image):
+        return self._find_lines(image=image, threshold=self.threshold, scan_region_height=self.scan_region_height,
+                                scan_region_position=self.scan_region_position,
+                                scan_region_width_pad=self.scan_region_width_pad,
+                                min_detection_area=self.min_detection_area, invert=self.invert,
+                                blur_kernel_size=self.blur_kernel_size)
+
+    def __call__(self, image):
+        return self.find_lines(image)
+
+    @staticmethod
+    def found(lines):
+        """
+        Check whether a result from find_lines includes a line. Every finder has this method, so results can be checked
+        without knowing which finder produced them
+
+        :param lines:
+            The result of find_lines
+        :return:
+            True if at least one line was found
+        """
+        return len(lines) > 0
@@ -0,0 +1,237 @@
+from collections import namedtuple, deque
+from threading import Thread
+from time import sleep
+
+from approxeng.viridia.clock import SYSTEM_CLOCK
+
+Overrun = namedtuple('Overrun', ['start', 'task', 'phase', 'duration'])
+"""
+A tick which overran its deadline. start is the time the tick started, task the active task's class name, phase the
+phase of the tick which was running when the deadline passed, or 'tick' if it was between phases, and duration the
+total time the tick took, or None if it hasn't finished yet.
+"""
+
+
+class TickWatchdog:
+    """
+    Enforces a deadline on every tick of the task loop. If a tick is still running when its deadline passes, for
+    example because a task's poll is blocked on the camera or a hung I2C transaction, the motors are disabled from the
+    watchdog's own thread, so the robot stops rather than carrying on at its last setpoint. The motors stay disabled
+    until a task enables them again, typically by being started from the menu. Every overrun is recorded along with the
+    task and the phase of the tick which was running.
+
+    Given the raw I2C interface, the watchdog disables the motors through it rather than through the bus scheduler and
+    shadow registers used by the task loop, as the tick being stopped may be holding the bus, and the shadow registers
+    aren't safe to write from another thread. Given the bus scheduler as well, it first waits briefly for any
+    transaction in progress and holds the bus while it writes, so the two never overlap on the I2CHelper. If the
+    transaction is still running after bus_timeout it's taken to be hung, and the motors are disabled anyway.
+
+    Deadlines are timed on a monotonic clock, so the system time being stepped, for example when the Pi, which has no
+    real time clock, first gets the time over NTP, can neither trip the watchdog nor stop it tripping.
+
+    The watchdog sees the start and end of each tick and phase by wrapping the task manager's profiler with a
+    :class:`approxeng.viridia.watchdog.WatchedProfiler`. Arming and disarming the deadline is just a few attribute
+    writes on the task loop's thread, the watchdog thread polls for overruns every resolution seconds.
+
+    Some phases are expected to take longer than a tick, in particular init, as tasks such as the line follower wait
+    for the camera there. These can be given their own deadlines, or None to lift the deadline while they run.
+    """
+
+    def __init__(self, motors, deadline=0.1, phase_deadlines=None, resolution=0.005, history=100, i2c=None, bus=None,
+                 bus_timeout=0.02, clock=None):
+        """
+        Create a new watchdog, call start() to start watching
+
+        :param motors:
+            The :class:`approxeng.viridia.motors.Motors` to disable when a tick overruns
+        :param deadline:
+            Maximum time in seconds from the start of a tick to its end, defaults to 0.1
+        :param phase_deadlines:
+            Optional, a dict of phase name to the maximum time in seconds for that phase, or None for no limit, which
+            replaces the tick deadline while the phase runs. Defaults to None, which lifts the deadline for the 'init'
+            and 'switch' phases
+        :param resolution:
+            Time in seconds between checks, and so the longest a tick can run past its deadline before the motors are
+            disabled, defaults to 0.005
+        :param history:
+            Number of most recent overruns retained in overruns, defaults to 100
+        :param i2c:
+            Optional, the raw :class:`approxeng.pi2arduino.I2CHelper` underneath the bus scheduler. If supplied the
+            motors are disabled by writing to it directly, with :meth:`approxeng.viridia.motors.Motors.disable_direct`,
+            so a tick stuck on a hung I2C transaction, which holds the bus scheduler, can't stop the watchdog stopping
+            the motors. Defaults to None to disable the motors through their own interface
+        :param bus:
+            Optional, the :class:`approxeng.viridia.bus.BusScheduler` in front of i2c. If supplied, the bus is held
+            while the motors are disabled through i2c. Defaults to None
+        :param bus_timeout:
+            Maximum time in seconds to wait for a transaction in progress on the bus, defaults to 0.02
+        :param clock:
+            Optional, the clock deadlines are timed against, which must be the task manager's clock. Defaults to None
+            for :data:`approxeng.viridia.clock.SYSTEM_CLOCK`. The watchdog always polls in real time
+        """
+        self.motors = motors
+        self.i2c = i2c
+        self.bus = bus
+        self.bus_timeout = bus_timeout
+        self.clock = clock if clock is not None else SYSTEM_CLOCK
+        self.deadline = deadline
+        self.phase_deadlines = phase_deadlines if phase_deadlines is not None else {'init': None, 'switch': None}
+        self.resolution = resolution
+        self.tick_deadline = None
+        self.tick_start = None
+        self.tick_id = 0
+        self.task_name = None
+        self.phase = None
+        self.tripped_tick = None
+        self.overruns = deque(maxlen=history)
+        self.counts = {}
+        self.trips = 0
+        self.running = False
+        self.thread = None
+
+    def wrap(self, profiler):
+        """
+        Place the watchdog in front of a profiler, called by the task manager
+
+        :param profiler:
+            The task manager's profiler
+        :return:
+            A :class:`approxeng.viridia.watchdog.WatchedProfiler`, which the task manager uses in place of the profiler
+        """
+        return WatchedProfiler(watchdog=self, profiler=profiler)
+
+    def start(self):
+        """
+        Start the watchdog thread
+
+        :return:
+            This watchdog, for chaining
+        """
+        if self.thread is None:
+            self.running = True
+            self.thread = Thread(target=self._watch_loop, name='tick-watchdog')
+            self.thread.daemon = True
+            self.thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stop the watchdog thread
+        """
+        if self.thread is not None:
+            self.running = False
+            self.thread.join()
+            self.thread = None
+
+    def _watch_loop(self):
+        while self.running:
+            sleep(self.resolution)
+            tick_id = self.tick_id
+            deadline = self.tick_deadline
+            # Check the tick didn't change while reading the deadline, so an overrun is never blamed on the next tick
+            if deadline is not None and tick_id == self.tick_id and tick_id != self.tripped_tick and \
+                    self.clock.time() > deadline:
+                phase = self.phase if self.phase is not None else 'tick'
+                try:
+                    self._disable_motors()
+                except IOError:
+                    pass
+                self.overruns.append(Overrun(start=self.tick_start, task=self.task_name, phase=phase, duration=None))
+                key = (self.task_name, phase)
+                self.counts[key] = self.counts.get(key, 0) + 1
+                self.trips += 1
+                # Only once the overrun is recorded, so the task loop never fills in the duration of an earlier one
+                self.tripped_tick = tick_id
+
+    def _disable_motors(self):
+        if self.i2c is None:
+            self.motors.disable()
+            return
+        exclusive = self.bus is not None and self.bus.acquire_exclusive(self.bus_timeout)
+        try:
+            self.motors.disable_direct(self.i2c)
+        finally:
+            if exclusive:
+                self.bus.release_exclusive()
+
+    def arm(self, task):
+        """
+        Start the deadline for a new tick
+        """
+        self.task_name = task.__class__.__name__
+        self.phase = None
+        self.tick_id += 1
+        self.tick_start = self.clock.time()
+        self.tick_deadline = self.tick_start + self.deadline
+
+    def enter_phase(self, phase):
+        self.phase = phase
+        if phase in self.phase_deadlines:
+            phase_deadline = self.phase_deadlines[phase]
+            self.tick_deadline = None if phase_deadline is None else self.clock.time() + phase_deadline
+
+    def exit_phase(self):
+        if self.phase in self.phase_deadlines:
+            # Give the rest of the tick a full deadline from the end of the phase
+            self.tick_deadline = self.clock.time() + self.deadline
+        self.phase = None
+
+    def disarm(self):
+        """
+        End the current tick, recording an overrun if its deadline passed
+        """
+        self.tick_deadline = None
+        if self.tripped_tick == self.tick_id:
+            # The overrun for this tick is the most recent one, as the watchdog can't trip again until the next tick
+            self.overruns[-1] = self.overruns[-1]._replace(duration=self.clock.time() - self.tick_start)
+            self.tripped_tick = None
+
+    def statistics(self):
+        """
+        :return:
+            A dict of task class name to a dict of phase name to the number of overruns in that phase
+        """
+        statistics = {}
+        for (task_name, phase), count in self.counts.items():
+            statistics.setdefault(task_name, {})[phase] = count
+        return statistics
+
+    def __str__(self):
+        return 'TickWatchdog[ deadline={}, trips={}, overruns={} ]'.format(self.deadline, self.trips,
+                                                                            self.statistics())
+
+
+class WatchedProfiler:
+    """
+    Stands in for the task manager's profiler, passing each call on to the profiler and to a
+    :class:`approxeng.viridia.watchdog.TickWatchdog`
+    """
+
+    def __init__(self, watchdog, profiler):
+        self.watchdog = watchdog
+        self.profiler = profiler
+
+    def instrument(self, i2c):
+        return self.profiler.instrument(i2c)
+
+    def start_tick(self, task):
+        self.profiler.start_tick(task)
+        self.watchdog.arm(task)
+
+    def start(self, phase):
+        self.profiler.start(phase)
+        self.watchdog.enter_phase(phase)
+
+    def stop(self):
+        self.profiler.stop()
+        self.watchdog.exit_phase()
+
+    def record(self, phase, seconds):
+        self.profiler.record(phase, seconds)
+
+    def add_i2c_time(self, seconds):
+        self.profiler.add_i2c_time(seconds)
+
+    def end_tick(self):
+        self.watchdog.disarm()
+        self.profiler.end_tick()
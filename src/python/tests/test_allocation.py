@@ -0,0 +1,61 @@
+import unittest
+
+from approxeng.viridia.benchmark import SimulatedSystem, measure_allocations
+from approxeng.viridia.clock import VirtualClock
+from approxeng.viridia.simulation import ScriptedJoystick
+from approxeng.viridia.tasks.manual_control import ManualMotionTask
+
+
+class TestAllocationFreePath(unittest.TestCase):
+    """
+    Checks the control path for manual driving re-uses its objects from tick to tick, rather than creating new ones
+    """
+
+    def setUp(self):
+        self.clock = VirtualClock()
+        self.joystick = ScriptedJoystick(script=[(0.0, {'lx': 0.3, 'ly': 0.6, 'rx': -0.2}, None)],
+                                         clock=self.clock.time)
+        self.system = None
+
+    def tearDown(self):
+        if self.system is not None:
+            self.system.close()
+
+    def _system(self, reuse_context):
+        self.system = SimulatedSystem(joystick=self.joystick, reuse_context=reuse_context, odometry=False,
+                                      clock=self.clock)
+        return self.system.task_manager
+
+    def test_reused_context_is_refreshed(self):
+        task_manager = self._system(reuse_context=True)
+        context = task_manager._build_context()
+        self.clock.advance(0.02)
+        refreshed = task_manager._build_context()
+        self.assertIs(refreshed, context)
+        self.assertEqual(refreshed.timestamp, 0.02)
+
+    def test_new_context_without_reuse(self):
+        task_manager = self._system(reuse_context=False)
+        context = task_manager._build_context()
+        self.assertIsNot(task_manager._build_context(), context)
+
+    def test_drive_writes_into_preallocated_speeds(self):
+        drive = self._system(reuse_context=True).drive
+        speeds = drive.wheel_speeds
+        drive.set_wheel_speeds(0, 100, 0)
+        first = list(speeds)
+        drive.set_wheel_speeds(100, 0, 0.5)
+        self.assertIs(drive.wheel_speeds, speeds)
+        self.assertNotEqual(list(speeds), first)
+
+    def test_steady_state_allocations(self):
+        task_manager = self._system(reuse_context=True)
+        result = measure_allocations(task=ManualMotionTask(), task_manager=task_manager, ticks=500, warmup=50)
+        # Other threads and the interpreter can account for the odd object, but nothing should be created every tick
+        self.assertLess(result['gc_objects_per_tick'], 0.5)
+        if 'blocks_per_tick' in result:
+            self.assertLess(result['blocks_per_tick'], 0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+import unittest
+from threading import Thread
+from time import sleep
+
+from approxeng.viridia.bus import BusScheduler, PRIORITY_SETPOINT, PRIORITY_ODOMETRY, PRIORITY_LIGHTING
+from approxeng.viridia.clock import VirtualClock
+
+
+class TimedI2C:
+    """
+    Records the address of every transaction, each of which takes a fixed time on a virtual clock
+    """
+
+    def __init__(self, clock, latency=0.004):
+        self.clock = clock
+        self.latency = latency
+        self.log = []
+
+    def send(self, address, *sequence):
+        self.clock.advance(self.latency)
+        self.log.append(address)
+
+    def read(self, address, format_string):
+        self.clock.advance(self.latency)
+        self.log.append(address)
+        return [0.0]
+
+
+class TestBusScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = VirtualClock()
+        self.i2c = TimedI2C(clock=self.clock)
+        self.bus = BusScheduler(i2c=self.i2c, tick_budget=0.01, clock=self.clock)
+        self.threads = []
+
+    def tearDown(self):
+        for thread in self.threads:
+            thread.join(1.0)
+
+    def _submit(self, address, priority):
+        """
+        Send from another thread, waiting until the transaction is queued or sent
+        """
+        queued = len(self.bus.waiting) + len(self.i2c.log)
+        thread = Thread(target=self.bus.send, args=(address, (0,), priority))
+        thread.daemon = True
+        thread.start()
+        self.threads.append(thread)
+        for _ in range(1000):
+            if len(self.bus.waiting) + len(self.i2c.log) > queued:
+                return
+            sleep(0.001)
+        self.fail('Transaction was never queued')
+
+    def _wait_for_sends(self, count):
+        for _ in range(1000):
+            if len(self.i2c.log) >= count:
+                return
+            sleep(0.001)
+
+    def test_highest_priority_first_then_in_order(self):
+        self.bus.tick_budget = None
+        self.assertTrue(self.bus.acquire_exclusive(timeout=1.0))
+        self._submit(0x31, PRIORITY_LIGHTING)
+        self._submit(0x62, PRIORITY_ODOMETRY)
+        self._submit(0x61, PRIORITY_SETPOINT)
+        self._submit(0x63, PRIORITY_ODOMETRY)
+        self._submit(0x64, PRIORITY_SETPOINT)
+        self.bus.release_exclusive()
+        self._wait_for_sends(5)
+        self.assertEqual(self.i2c.log, [0x61, 0x64, 0x62, 0x63, 0x31])
+
+    def test_budget_defers_lighting_to_next_tick(self):
+        self.bus.start_tick()
+        for address in [0x61, 0x62, 0x63]:
+            self.bus.send(address, (0,), PRIORITY_SETPOINT)
+        self._submit(0x31, PRIORITY_LIGHTING)
+        sleep(0.05)
+        self.assertEqual(self.i2c.log, [0x61, 0x62, 0x63])
+        # Setpoints and odometry are never held back
+        self.bus.send(0x61, (0,), PRIORITY_SETPOINT)
+        self.assertEqual(self.bus.read(0x61, 'f', PRIORITY_ODOMETRY), [0.0])
+        self.bus.start_tick()
+        self._wait_for_sends(6)
+        self.assertEqual(self.i2c.log[-1], 0x31)
+        self.assertEqual(self.bus.statistics()[PRIORITY_LIGHTING]['deferred'], 1)
+
+    def test_over_budget_on_tick_thread(self):
+        self.bus.start_tick()
+        for address in [0x61, 0x62, 0x63]:
+            self.bus.send(address, (0,), PRIORITY_SETPOINT)
+        # The tick thread can't wait for its own next tick, so droppable traffic is dropped and the rest sent anyway
+        self.assertFalse(self.bus.send(0x31, (0,), PRIORITY_LIGHTING, droppable=True))
+        self.assertTrue(self.bus.send(0x31, (1,), PRIORITY_LIGHTING))
+        statistics = self.bus.statistics()[PRIORITY_LIGHTING]
+        self.assertEqual(statistics['dropped'], 1)
+        self.assertEqual(statistics['over_budget'], 1)
+        self.assertEqual(statistics['transactions'], 1)
+        self.assertAlmostEqual(self.bus.statistics()[PRIORITY_SETPOINT]['bus_time'], 0.012)
+
+    def test_client_priorities(self):
+        client = self.bus.client(send_priority=PRIORITY_LIGHTING, droppable=True)
+        self.bus.start_tick()
+        for _ in range(3):
+            client.send(0x31, 0)
+        self.assertEqual(self.i2c.log, [0x31] * 3)
+        self.assertEqual(client.read(0x31, 'f'), None)
+
+    def test_exclusive_times_out_while_busy(self):
+        self.assertTrue(self.bus.acquire_exclusive(timeout=0.1))
+        self.assertFalse(self.bus.acquire_exclusive(timeout=0.01))
+        self.bus.release_exclusive()
+        self.assertTrue(self.bus.acquire_exclusive(timeout=0.01))
+        self.bus.release_exclusive()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import os
+import unittest
+
+from approxeng.viridia import IntervalCheck
+from approxeng.viridia.clock import MonotonicClock, VirtualClock
+
+
+class TestVirtualClock(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = VirtualClock(start=10.0)
+
+    def test_only_moves_when_told(self):
+        self.assertEqual(self.clock.time(), 10.0)
+        self.clock.advance(0.5)
+        self.clock.sleep(0.25)
+        self.clock.sleep(-1.0)
+        self.assertEqual(self.clock.time(), 10.75)
+
+    def test_wait_readable(self):
+        read, write = os.pipe()
+        try:
+            # Nothing to read, so time moves on by the timeout
+            self.assertFalse(self.clock.wait_readable(read, 0.5))
+            self.assertEqual(self.clock.time(), 10.5)
+            os.write(write, b'x')
+            self.assertTrue(self.clock.wait_readable(read, 0.5))
+            self.assertEqual(self.clock.time(), 10.5)
+            self.assertTrue(self.clock.wait_readable(read, None))
+        finally:
+            os.close(read)
+            os.close(write)
+
+
+class TestMonotonicClock(unittest.TestCase):
+
+    def test_never_goes_backwards(self):
+        clock = MonotonicClock()
+        readings = [clock.time() for _ in range(1000)]
+        self.assertEqual(readings, sorted(readings))
+
+    def test_sleep(self):
+        clock = MonotonicClock()
+        start = clock.time()
+        clock.sleep(0.02)
+        clock.sleep(-1.0)
+        self.assertGreaterEqual(clock.time() - start, 0.02)
+
+    def test_wait_readable(self):
+        clock = MonotonicClock()
+        read, write = os.pipe()
+        try:
+            self.assertFalse(clock.wait_readable(read, 0.01))
+            os.write(write, b'x')
+            self.assertTrue(clock.wait_readable(read, None))
+        finally:
+            os.close(read)
+            os.close(write)
+
+
+class TestIntervalCheck(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = VirtualClock()
+        self.interval = IntervalCheck(interval=0.1, clock=self.clock)
+
+    def test_fixed_deadlines(self):
+        interval = IntervalCheck(interval=0.25, clock=self.clock)
+        runs = []
+        # Polled at a period which doesn't divide the interval, the runs stay on the 250ms schedule rather than
+        # drifting later each time, which would give runs on every other tick
+        for tick in range(11):
+            if interval.should_run(tick * 0.1875):
+                runs.append(tick)
+        self.assertEqual(runs, [0, 2, 3, 4, 6, 7, 8, 10])
+
+    def test_missed_deadline_restarts_schedule(self):
+        self.assertTrue(self.interval.should_run(0.0))
+        self.assertTrue(self.interval.should_run(0.35))
+        # Once, rather than once for every interval missed, then one interval on from when it ran
+        self.assertFalse(self.interval.should_run(0.36))
+        self.assertFalse(self.interval.should_run(0.44))
+        self.assertTrue(self.interval.should_run(0.45))
+
+    def test_reads_clock_without_time(self):
+        self.assertTrue(self.interval.should_run())
+        self.clock.advance(0.05)
+        self.assertFalse(self.interval.should_run())
+        self.clock.advance(0.05)
+        self.assertTrue(self.interval.should_run())
+
+    def test_sleep_on_clock(self):
+        self.interval.sleep()
+        self.assertEqual(self.clock.time(), 0.0)
+        self.clock.advance(0.03)
+        self.interval.sleep()
+        self.assertAlmostEqual(self.clock.time(), 0.1)
+        self.interval.sleep()
+        self.assertAlmostEqual(self.clock.time(), 0.2)
+
+    def test_with_measures_from_end_of_block(self):
+        with self.interval:
+            self.clock.advance(0.05)
+        with self.interval:
+            pass
+        self.assertAlmostEqual(self.clock.time(), 0.15)
+
+
+if __name__ == '__main__':
+    unittest.main()
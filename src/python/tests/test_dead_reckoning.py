@@ -0,0 +1,92 @@
+import unittest
+
+from approxeng.holochassis.chassis import DeadReckoning, get_regular_triangular_chassis
+
+from approxeng.viridia.clock import VirtualClock
+from approxeng.viridia.dead_reckoning import BatchDeadReckoning
+from approxeng.viridia.drive import ViridiaDrive
+from approxeng.viridia.motors import Motors
+from approxeng.viridia.odometry import OdometrySampler
+from approxeng.viridia.simulation import SimulatedRobot
+
+
+class TestBatchDeadReckoning(unittest.TestCase):
+    """
+    Drives the simulated robot through the drive, so the motor angles carry the same sign change as on the robot, and
+    checks the batch integrator against holochassis's own dead reckoning
+    """
+
+    def setUp(self):
+        self.clock = VirtualClock()
+        self.robot = SimulatedRobot(clock=self.clock.time)
+        self.motors = Motors(i2c=self.robot.i2c)
+        self.chassis = get_regular_triangular_chassis(wheel_distance=204, wheel_radius=29.5,
+                                                      max_rotations_per_second=500 / 60.0)
+        self.drive = ViridiaDrive(chassis=self.chassis, motors=self.motors)
+        self.drive.enable_drive()
+
+    def _drive(self, x, y, rotation, seconds=1.0, interval=0.01):
+        batch = BatchDeadReckoning(chassis=self.chassis)
+        reference = DeadReckoning(chassis=self.chassis, counts_per_revolution=1.0, max_count_value=0)
+        angles = self.motors.read_angles()
+        batch.update(timestamps=[self.clock.time()], revolutions=angles)
+        reference.update_from_revolutions(angles)
+        self.drive.set_wheel_speeds(x, y, rotation)
+        for _ in range(int(seconds / interval)):
+            self.clock.advance(interval)
+            angles = self.motors.read_angles()
+            batch.update(timestamps=[self.clock.time()], revolutions=angles)
+            reference.update_from_revolutions(angles)
+        self.drive.set_wheel_speeds(0, 0, 0)
+        return batch.pose, reference.pose
+
+    def _assert_poses_equal(self, pose, expected):
+        self.assertAlmostEqual(pose.position.x, expected.position.x, delta=0.5)
+        self.assertAlmostEqual(pose.position.y, expected.position.y, delta=0.5)
+        self.assertAlmostEqual(pose.orientation, expected.orientation, delta=0.005)
+
+    def test_forward(self):
+        pose, expected = self._drive(x=0, y=100, rotation=0)
+        self.assertGreater(pose.position.y, 80)
+        self._assert_poses_equal(pose, expected)
+
+    def test_rotation(self):
+        pose, expected = self._drive(x=0, y=0, rotation=0.5)
+        self.assertGreater(pose.orientation, 0.4)
+        self._assert_poses_equal(pose, expected)
+
+    def _fill_sampler(self, sampler, seconds, x, y, rotation, interval=0.01):
+        self.drive.set_wheel_speeds(x, y, rotation)
+        for _ in range(int(seconds / interval)):
+            self.clock.advance(interval)
+            sampler.add_sample(timestamp=self.clock.time(), angles=self.motors.read_angles())
+        self.drive.set_wheel_speeds(0, 0, 0)
+
+    def test_starts_from_latest_sample(self):
+        # Movement already held in the sampler's ring buffer when the integrator is created isn't counted
+        sampler = OdometrySampler(motors=self.motors)
+        self._fill_sampler(sampler, seconds=2.0, x=0, y=100, rotation=0.5)
+        batch = BatchDeadReckoning(chassis=self.chassis, sampler=sampler)
+        pose = batch.update_from_sampler(sampler)
+        self.assertAlmostEqual(pose.position.x, 0.0)
+        self.assertAlmostEqual(pose.position.y, 0.0)
+        self.assertAlmostEqual(pose.orientation, 0.0)
+        self._fill_sampler(sampler, seconds=1.0, x=0, y=100, rotation=0)
+        pose = batch.update_from_sampler(sampler)
+        self.assertGreater(pose.position.y, 80)
+        self.assertLess(pose.position.y, 110)
+
+    def test_reset_starts_from_latest_sample(self):
+        sampler = OdometrySampler(motors=self.motors)
+        batch = BatchDeadReckoning(chassis=self.chassis, sampler=sampler)
+        self._fill_sampler(sampler, seconds=1.0, x=0, y=100, rotation=0)
+        # Let the wheels come to a stop before resetting
+        self._fill_sampler(sampler, seconds=1.0, x=0, y=0, rotation=0)
+        batch.reset()
+        self._fill_sampler(sampler, seconds=1.0, x=0, y=0, rotation=0)
+        pose = batch.update_from_sampler(sampler)
+        self.assertAlmostEqual(pose.position.y, 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+import sys
+import unittest
+from StringIO import StringIO
+from threading import Event
+
+from approxeng.viridia.benchmark import NullStream
+from approxeng.viridia.clock import VirtualClock
+from approxeng.viridia.display import AsyncDisplay, OutputSink
+
+
+class BlockingStream:
+    """
+    Holds every write until released, as a pipe to a slow reader would
+    """
+
+    def __init__(self):
+        self.gate = Event()
+        self.blocked = Event()
+        self.lines = []
+
+    def write(self, s):
+        self.blocked.set()
+        self.gate.wait()
+        self.lines.append(s)
+
+    def flush(self):
+        pass
+
+
+class TestOutputSink(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = VirtualClock()
+        self.stream = StringIO()
+        self.sink = OutputSink(stream=self.stream, capacity=4, intervals={'pose': 0.5}, clock=self.clock)
+
+    def tearDown(self):
+        self.sink.stop()
+
+    def test_lines_written_in_order(self):
+        self.sink.start()
+        self.sink.write('display', 'Hello')
+        self.sink.write('frames', 'Frames processed={}, skipped={}', 10, 2)
+        self.assertTrue(self.sink.flush(timeout=1.0))
+        self.assertEqual(self.stream.getvalue(), 'Hello\nFrames processed=10, skipped=2\n')
+
+    def test_rate_limit(self):
+        accepted = []
+        for _ in range(10):
+            accepted.append(self.sink.write('pose', 'x'))
+            self.sink.write('other', 'y')
+            self.clock.advance(0.2)
+        # Accepted at 0, 0.6 and 1.2, other sources aren't limited
+        self.assertEqual(accepted, [True, False, False, True, False, False, True, False, False, True])
+        self.sink.set_interval('other', 1.0)
+        self.assertFalse(self.sink.write('other', 'y'))
+        statistics = self.sink.statistics()
+        self.assertEqual(statistics['pose']['rate_limited'], 6)
+        self.assertEqual(statistics['other']['rate_limited'], 1)
+
+    def test_overflow_drops_oldest(self):
+        for index in range(6):
+            self.sink.write('source{}'.format(index % 2), str(index))
+        self.sink.start()
+        self.assertTrue(self.sink.flush(timeout=1.0))
+        self.assertEqual(self.stream.getvalue(), '2\n3\n4\n5\n')
+        statistics = self.sink.statistics()
+        self.assertEqual(statistics['source0'], {'written': 2, 'rate_limited': 0, 'overflowed': 1})
+        self.assertEqual(statistics['source1'], {'written': 2, 'rate_limited': 0, 'overflowed': 1})
+
+    def test_never_blocks_on_stream(self):
+        stream = BlockingStream()
+        sink = OutputSink(stream=stream, capacity=4).start()
+        try:
+            sink.write('display', 'first')
+            self.assertTrue(stream.blocked.wait(1.0))
+            # The writer is stuck, but writes still return straight away, and the buffer limits what's held
+            for index in range(10):
+                self.assertTrue(sink.write('display', str(index)))
+            self.assertFalse(sink.flush(timeout=0.01))
+            stream.gate.set()
+            self.assertTrue(sink.flush(timeout=1.0))
+            self.assertEqual(stream.lines, ['first\n', '6\n', '7\n', '8\n', '9\n'])
+        finally:
+            stream.gate.set()
+            sink.stop()
+
+    def test_bad_line_does_not_stop_writer(self):
+        stderr = sys.stderr
+        sys.stderr = NullStream()
+        try:
+            self.sink.start()
+            self.sink.write('bad', 'Missing {} {}', 1)
+            self.sink.write('good', 'Fine')
+            self.assertTrue(self.sink.flush(timeout=1.0))
+        finally:
+            sys.stderr = stderr
+        self.assertEqual(self.stream.getvalue(), 'Fine\n')
+
+    def test_stop_writes_queued_lines(self):
+        self.sink.write('display', 'Queued')
+        self.sink.start()
+        self.sink.stop()
+        self.assertIsNone(self.sink.thread)
+        self.assertEqual(self.stream.getvalue(), 'Queued\n')
+
+
+class TestAsyncDisplay(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = VirtualClock()
+        self.stream = StringIO()
+        self.sink = OutputSink(stream=self.stream, default_interval=0.5, intervals={'display': 0.0}, clock=self.clock)
+        self.display = AsyncDisplay(sink=self.sink)
+
+    def tearDown(self):
+        self.sink.stop()
+
+    def test_show_only_writes_changes(self):
+        self.display.show('Manual motion', 'Running')
+        self.display.show('Manual motion', 'Running')
+        self.display.show('Line follower')
+        self.assertTrue(self.sink.flush(timeout=1.0))
+        self.assertEqual(self.stream.getvalue(), 'Manual motion\nRunning\nLine follower\n')
+
+    def test_log_rate_limited_per_source(self):
+        for _ in range(5):
+            self.display.log('pose', 'x={}', 1)
+            self.display.log('cache', 'hits={}', 2)
+            self.clock.advance(0.2)
+        self.assertTrue(self.sink.flush(timeout=1.0))
+        self.assertEqual(self.stream.getvalue().count('x=1\n'), 2)
+        self.assertEqual(self.stream.getvalue().count('hits=2\n'), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import unittest
+from threading import Event
+
+from approxeng.viridia.feather import Feather
+from approxeng.viridia.simulation import SimulatedGPIO
+
+
+class GatedI2C:
+    """
+    Records every send, and can hold the feather's sender on its first send until released, so that commands queue up
+    behind it. Can also be told to fail a number of sends.
+    """
+
+    def __init__(self):
+        self.sent = []
+        self.gate = Event()
+        self.gate.set()
+        self.blocked = Event()
+        self.failures = 0
+
+    def send(self, address, *sequence):
+        if not self.gate.is_set():
+            self.blocked.set()
+            self.gate.wait()
+        if self.failures > 0:
+            self.failures -= 1
+            raise IOError('Simulated bus error')
+        self.sent.append(sequence)
+
+    def read(self, address, format_string):
+        raise IOError('Feather does not respond to reads')
+
+
+class TestFeather(unittest.TestCase):
+
+    def setUp(self):
+        self.i2c = GatedI2C()
+        self.feather = Feather(i2c=self.i2c, gpio=SimulatedGPIO(), asynchronous=True)
+
+    def tearDown(self):
+        self.i2c.gate.set()
+        self.feather.stop()
+
+    def _hold_sender(self):
+        self.i2c.gate.clear()
+        self.feather.set_lighting_mode(0)
+        self.assertTrue(self.i2c.blocked.wait(1.0))
+
+    def test_lighting_coalesced_and_kicks_kept(self):
+        self._hold_sender()
+        for index in range(10):
+            self.feather.set_direction(index * 0.1)
+            self.feather.kick()
+            self.feather.set_ring_hue(index)
+        self.i2c.gate.set()
+        self.assertTrue(self.feather.flush(timeout=1.0))
+        queued = self.i2c.sent[1:]
+        # Only the latest of each lighting command, sent before the kicks
+        self.assertEqual(queued[:2], [(1, 9, 30), (3, 0.9)])
+        self.assertEqual(queued[2:], [(100,)] * 10)
+
+    def test_commands_retried_after_bus_error(self):
+        self._hold_sender()
+        self.feather.kick()
+        self.feather.set_direction(1.0)
+        self.feather.kick()
+        self.i2c.failures = 2
+        self.i2c.gate.set()
+        self.assertTrue(self.feather.flush(timeout=1.0))
+        self.assertEqual(self.i2c.sent.count((100,)), 2)
+        self.assertIn((3, 1.0), self.i2c.sent)
+        self.assertEqual(self.feather.errors, 2)
+
+    def test_stop_sends_pending_then_sends_synchronously(self):
+        self._hold_sender()
+        self.feather.kick()
+        self.i2c.gate.set()
+        self.assertTrue(self.feather.stop(timeout=1.0))
+        self.assertIsNone(self.feather.sender)
+        self.assertEqual(self.i2c.sent[-1], (100,))
+        self.feather.kick()
+        # No sender any more, so the kick has already been sent
+        self.assertEqual(self.i2c.sent.count((100,)), 2)
+
+    def test_synchronous(self):
+        feather = Feather(i2c=self.i2c, gpio=SimulatedGPIO())
+        feather.set_direction(0.5)
+        feather.kick()
+        self.assertEqual(self.i2c.sent, [(3, 0.5), (100,)])
+        self.assertTrue(feather.flush())
+
+
+if __name__ == '__main__':
+    unittest.main()
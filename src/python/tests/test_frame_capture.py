@@ -0,0 +1,135 @@
+import unittest
+
+import numpy as np
+
+from approxeng.viridia.capture import Frame, FrameCapture
+from approxeng.viridia.clock import VirtualClock
+from approxeng.viridia.simulation import SimulatedVideoStream
+from approxeng.viridia.tasks.camera import LineFollowerTask
+
+
+class FakeStream:
+    """
+    Stands in for a started FrameCapture, offering whatever frame it was last given
+    """
+
+    def __init__(self):
+        self.frame = None
+
+    def latest(self):
+        return self.frame
+
+    def stop(self):
+        pass
+
+
+class FakeFeather:
+
+    def __init__(self):
+        self.directions = []
+
+    def set_direction(self, direction):
+        self.directions.append(direction)
+
+
+class FakeContext:
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.timestamp = clock.time()
+        self.feather = FakeFeather()
+
+
+def line_image(column, size=64):
+    image = np.full((size, size, 3), 200, dtype=np.uint8)
+    image[:, column:column + 4] = 20
+    return image
+
+
+class TestFrameCapture(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = VirtualClock()
+
+    def test_frames_numbered_in_order(self):
+        capture = FrameCapture(stream=None, clock=self.clock)
+        seen = []
+        capture.add_listener(seen.append)
+        self.assertIsNone(capture.latest())
+        for index in range(3):
+            capture.add_frame(image=index, timestamp=index * 0.1)
+        self.assertEqual([(frame.sequence, frame.image) for frame in seen], [(0, 0), (1, 1), (2, 2)])
+        self.assertIs(capture.latest(), seen[-1])
+        capture.remove_listener(seen.append)
+        capture.add_frame(image=3, timestamp=0.3)
+        self.assertEqual(len(seen), 3)
+
+    def test_wait_for_frame(self):
+        capture = FrameCapture(stream=None, clock=self.clock)
+        self.assertIsNone(capture.wait_for_frame(-1, timeout=0.01))
+        capture.add_frame(image=0, timestamp=0.0)
+        self.assertEqual(capture.wait_for_frame(-1, timeout=0.01).sequence, 0)
+        # Already seen, so there's nothing newer to return
+        self.assertIsNone(capture.wait_for_frame(0, timeout=0.01))
+
+    def test_repeated_reads_are_not_new_frames(self):
+        stream = SimulatedVideoStream(resolution=(32, 32), clock=self.clock.time, frame_rate=10)
+        capture = FrameCapture(stream=stream, poll_interval=0.001, clock=self.clock).start()
+        try:
+            first = capture.wait_for_frame(-1, timeout=1.0)
+            self.assertEqual(first.sequence, 0)
+            # The stream keeps returning the same image until the camera would have produced another
+            self.assertIsNone(capture.wait_for_frame(0, timeout=0.05))
+            self.clock.advance(0.1)
+            second = capture.wait_for_frame(0, timeout=1.0)
+            self.assertEqual(second.sequence, 1)
+            self.assertEqual(second.timestamp, 0.1)
+            self.assertAlmostEqual(second.age(self.clock.time() + 0.02), 0.02)
+        finally:
+            capture.stop()
+
+
+class TestLineFollowerFrames(unittest.TestCase):
+    """
+    Checks the line follower only processes each frame once, counting the ticks where there's no new frame and the
+    frames it never saw
+    """
+
+    def setUp(self):
+        self.clock = VirtualClock()
+        self.task = LineFollowerTask(enable_drive=False, invert=False, stream_factory=lambda resolution: None)
+        self.task.stream = FakeStream()
+        self.context = FakeContext(clock=self.clock)
+
+    def _tick(self, frame=None):
+        if frame is not None:
+            self.task.stream.frame = frame
+        self.clock.advance(0.02)
+        self.context.timestamp = self.clock.time()
+        self.task._follow_line(self.context)
+
+    def test_no_frame_yet(self):
+        self._tick()
+        self.assertEqual((self.task.frames_processed, self.task.frames_skipped), (0, 1))
+
+    def test_duplicate_frames_skipped(self):
+        self._tick(Frame(sequence=0, timestamp=0.0, image=line_image(8)))
+        self._tick()
+        self._tick()
+        self._tick(Frame(sequence=1, timestamp=0.05, image=line_image(8)))
+        self.assertEqual(self.task.frames_processed, 2)
+        self.assertEqual(self.task.frames_skipped, 2)
+        self.assertEqual(self.task.frames_missed, 0)
+        # Ages are measured against the context's clock when each frame is used
+        self.assertEqual(self.task.frame_ages.count, 2)
+        self.assertEqual(len(self.context.feather.directions), 1)
+        self.assertLess(self.context.feather.directions[0], 0)
+
+    def test_missed_frames_counted(self):
+        self._tick(Frame(sequence=0, timestamp=0.0, image=line_image(8)))
+        self._tick(Frame(sequence=4, timestamp=0.1, image=line_image(8)))
+        self.assertEqual(self.task.frames_missed, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+
+import numpy as np
+from approxeng.holochassis.chassis import Motion, get_regular_triangular_chassis
+from euclid import Vector2
+
+from approxeng.viridia.kinematics import CompiledKinematics
+
+MOTIONS = [(0, 0, 0), (100, 0, 0), (0, -250, 0), (0, 0, 1.5), (120, 80, -0.7), (-300, 200, 2.0), (2000, 0, 0),
+           (0, 0, -20)]
+'A mix of motions, the last two fast enough to need scaling back'
+
+
+class TestCompiledKinematics(unittest.TestCase):
+    """
+    Checks the compiled kinematics against the chassis they were compiled from
+    """
+
+    def setUp(self):
+        self.chassis = get_regular_triangular_chassis(wheel_distance=204, wheel_radius=29.5,
+                                                      max_rotations_per_second=500 / 60.0)
+
+    def _expected(self, x, y, rotation, scale=1.0):
+        wheel_speeds = self.chassis.get_wheel_speeds(motion=Motion(translation=Vector2(x, y), rotation=rotation))
+        return [speed * scale for speed in wheel_speeds.speeds], wheel_speeds.scaling
+
+    def test_matches_chassis(self):
+        kinematics = CompiledKinematics(chassis=self.chassis)
+        speeds = [0.0] * 3
+        for x, y, rotation in MOTIONS:
+            expected, expected_scaling = self._expected(x, y, rotation)
+            scaling = kinematics.wheel_speeds(x, y, rotation, speeds)
+            self.assertAlmostEqual(scaling, expected_scaling)
+            for speed, expected_speed in zip(speeds, expected):
+                self.assertAlmostEqual(speed, expected_speed)
+
+    def test_scaled_for_motors(self):
+        kinematics = CompiledKinematics(chassis=self.chassis, scale=-60)
+        speeds = [0.0] * 3
+        for x, y, rotation in MOTIONS:
+            expected, _ = self._expected(x, y, rotation, scale=-60)
+            kinematics.wheel_speeds(x, y, rotation, speeds)
+            for speed, expected_speed in zip(speeds, expected):
+                self.assertAlmostEqual(speed, expected_speed, places=4)
+            # Saturated wheels run at the motors' 500 RPM
+            self.assertLessEqual(max(abs(speed) for speed in speeds), 500 + 1e-6)
+
+    def test_writes_into_list(self):
+        kinematics = CompiledKinematics(chassis=self.chassis)
+        speeds = [0.0] * 3
+        kinematics.wheel_speeds(100, 0, 0, speeds)
+        self.assertNotEqual(speeds, [0.0] * 3)
+
+    def test_batch_matches_single(self):
+        kinematics = CompiledKinematics(chassis=self.chassis, scale=-60)
+        batch, scaling = kinematics.wheel_speeds_batch(MOTIONS)
+        self.assertEqual(batch.shape, (len(MOTIONS), 3))
+        speeds = [0.0] * 3
+        for index, (x, y, rotation) in enumerate(MOTIONS):
+            self.assertAlmostEqual(scaling[index], kinematics.wheel_speeds(x, y, rotation, speeds))
+            np.testing.assert_allclose(batch[index], speeds, atol=1e-9)
+
+    def test_inverse(self):
+        kinematics = CompiledKinematics(chassis=self.chassis, scale=-1)
+        speeds = [0.0] * 3
+        kinematics.wheel_speeds(120, 80, -0.7, speeds)
+        # The motion recovered from the wheel movements moves the wheels in the same way
+        x, y, rotation = kinematics.inverse().dot(speeds)
+        recovered = [0.0] * 3
+        kinematics.wheel_speeds(x, y, rotation, recovered)
+        np.testing.assert_allclose(recovered, speeds, atol=1e-9)
+
+
+if __name__ == '__main__':
+    unittest.main()
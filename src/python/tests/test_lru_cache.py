@@ -0,0 +1,100 @@
+import unittest
+
+from approxeng.viridia import LRUCache
+from approxeng.viridia.benchmark import SimulatedSystem
+from approxeng.viridia.clock import VirtualClock
+from approxeng.viridia.simulation import ScriptedJoystick
+from approxeng.viridia.tasks.manual_control import ManualMotionTask
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = LRUCache(max_size=3)
+
+    def test_get_and_put(self):
+        self.assertIsNone(self.cache.get('a'))
+        self.cache.put('a', 1)
+        self.assertEqual(self.cache.get('a'), 1)
+        self.cache.put('a', 2)
+        self.assertEqual(self.cache.get('a'), 2)
+        self.assertEqual(self.cache.statistics(),
+                         {'size': 1, 'hits': 2, 'misses': 1, 'evictions': 0, 'hit_rate': 2.0 / 3})
+
+    def test_least_recently_used_evicted(self):
+        for key in 'abc':
+            self.cache.put(key, key)
+        # Using a makes b the least recently used
+        self.cache.get('a')
+        self.cache.put('d', 'd')
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual([self.cache.get(key) for key in 'acd'], ['a', 'c', 'd'])
+        self.assertEqual(self.cache.evictions, 1)
+
+    def test_replacing_does_not_evict(self):
+        for key in 'abc':
+            self.cache.put(key, key)
+        self.cache.put('a', 'A')
+        self.assertEqual(self.cache.evictions, 0)
+        self.assertEqual(len(self.cache.entries), 3)
+
+    def test_clear(self):
+        self.assertIsNone(self.cache.hit_rate)
+        self.cache.put('a', 1)
+        self.cache.get('a')
+        self.cache.clear()
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.hit_rate, 0.5)
+
+
+class TestWheelSpeedCache(unittest.TestCase):
+    """
+    Drives the manual motion task with and without its wheel speed cache, on the simulated robot
+    """
+
+    def setUp(self):
+        self.systems = []
+
+    def tearDown(self):
+        for system in self.systems:
+            system.close()
+
+    def _drive(self, task, script, ticks=20):
+        # Each run on its own clock, so the script lines up with the same ticks every time
+        clock = VirtualClock()
+        joystick = ScriptedJoystick(script=script, clock=clock.time)
+        system = SimulatedSystem(joystick=joystick, odometry=False, clock=clock)
+        self.systems.append(system)
+        task_manager = system.task_manager
+        task.init_task(context=task_manager._build_context())
+        speeds = []
+        for tick in range(ticks):
+            clock.advance(0.02)
+            task.poll_task(context=task_manager._build_context(), tick=tick)
+            speeds.append(tuple(task_manager.drive.wheel_speeds))
+        return speeds
+
+    def test_cached_speeds_match_computed(self):
+        script = [(0.0, {'lx': 0.3, 'ly': 0.6, 'rx': -0.2}, None), (0.1, {'lx': -0.5}, None),
+                  (0.2, {'lx': 0.3}, None)]
+        cached_task = ManualMotionTask(wheel_speed_cache_size=16)
+        cached = self._drive(cached_task, script)
+        uncached = self._drive(ManualMotionTask(), script)
+        self.assertEqual(len(cached), len(uncached))
+        for cached_speeds, uncached_speeds in zip(cached, uncached):
+            for a, b in zip(cached_speeds, uncached_speeds):
+                self.assertAlmostEqual(a, b, places=6)
+        # Three distinct stick positions, one of which comes back
+        self.assertEqual(cached_task.wheel_speed_cache.misses, 2)
+        self.assertEqual(cached_task.wheel_speed_cache.hits, 18)
+
+    def test_bypassed_with_motion_limit(self):
+        task = ManualMotionTask(wheel_speed_cache_size=16)
+        # Pressed after the task is initialised, so the first poll sees it
+        self._drive(task, [(0.0, {'ly': 0.5}, None), (0.01, None, ['cross'])])
+        self.assertEqual(task.limit_mode, 1)
+        self.assertEqual(task.wheel_speed_cache.hits + task.wheel_speed_cache.misses, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import unittest
+
+from approxeng.viridia.clock import VirtualClock
+from approxeng.viridia.odometry import OdometrySampler
+
+
+class FakeMotors:
+    """
+    Stands in for the motors, with wheel angles which increase on every read
+    """
+
+    motor_count = 3
+
+    def __init__(self):
+        self.reads = 0
+
+    def read_angles(self):
+        self.reads += 1
+        return [self.reads, self.reads * 10.0, self.reads * 100.0]
+
+
+class TestOdometrySampler(unittest.TestCase):
+
+    def setUp(self):
+        self.sampler = OdometrySampler(motors=FakeMotors(), capacity=8)
+
+    def _add(self, first, last):
+        for sequence in range(first, last):
+            self.sampler.add_sample(timestamp=sequence * 0.01, angles=[sequence, sequence * 10.0, sequence * 100.0])
+
+    def test_empty(self):
+        self.assertEqual(self.sampler.latest(), None)
+        self.assertEqual(self.sampler.samples_since(-1), [])
+        sequence, timestamps, angles = self.sampler.block_since(-1)
+        self.assertEqual((sequence, len(timestamps), len(angles)), (-1, 0, 0))
+
+    def test_latest(self):
+        self._add(0, 3)
+        self.assertEqual(self.sampler.latest(), (2, 0.02, [2.0, 20.0, 200.0]))
+
+    def test_samples_since(self):
+        self._add(0, 5)
+        self.assertEqual([sample[0] for sample in self.sampler.samples_since(2)], [3, 4])
+        self.assertEqual(self.sampler.samples_since(4), [])
+
+    def test_wraparound_keeps_newest(self):
+        self._add(0, 13)
+        samples = self.sampler.samples_since(-1)
+        # Only the last capacity samples are still held, however far back the caller asks from
+        self.assertEqual([sample[0] for sample in samples], range(5, 13))
+        self.assertEqual(samples[-1], (12, 0.12, [12.0, 120.0, 1200.0]))
+        self.assertEqual([sample[0] for sample in self.sampler.samples_since(3)], range(5, 13))
+
+    def test_block_across_wrap(self):
+        self._add(0, 13)
+        # Samples 9 to 12 are held in ring slots 1 to 4, 5 to 8 in slots 5 to 7 and 0
+        sequence, timestamps, angles = self.sampler.block_since(6)
+        self.assertEqual(sequence, 12)
+        self.assertEqual(list(timestamps), [s * 0.01 for s in range(7, 13)])
+        self.assertEqual(list(angles), [value for s in range(7, 13) for value in (s, s * 10.0, s * 100.0)])
+
+    def test_block_matches_samples(self):
+        for count in range(1, 20):
+            sampler = OdometrySampler(motors=FakeMotors(), capacity=8)
+            self.sampler = sampler
+            self._add(0, count)
+            for since in range(-1, count):
+                samples = sampler.samples_since(since)
+                sequence, timestamps, angles = sampler.block_since(since)
+                self.assertEqual(list(timestamps), [sample[1] for sample in samples])
+                self.assertEqual(list(angles), [value for sample in samples for value in sample[2]])
+                self.assertEqual(sequence, samples[-1][0] if samples else since)
+
+    def test_sample_loop_on_clock(self):
+        clock = VirtualClock()
+        motors = FakeMotors()
+        sampler = OdometrySampler(motors=motors, rate=100, capacity=8, clock=clock)
+        sampler.running = True
+
+        def stop_after_five(seconds):
+            clock.advance(seconds)
+            if motors.reads >= 5:
+                sampler.running = False
+
+        clock.sleep = stop_after_five
+        sampler._sample_loop()
+        timestamps = [sample[1] for sample in sampler.samples_since(-1)]
+        self.assertEqual(len(timestamps), 5)
+        for previous, timestamp in zip(timestamps, timestamps[1:]):
+            self.assertAlmostEqual(timestamp - previous, 0.01)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+import sys
+import unittest
+from threading import Event
+from time import sleep
+
+from approxeng.viridia.benchmark import NullStream
+from approxeng.viridia.task import Task, TaskPrewarmer
+
+
+class FakeContext:
+
+    def __init__(self, timestamp):
+        self.timestamp = timestamp
+
+
+class WarmingTask(Task):
+    """
+    Records its prewarms and releases in a shared log. Prewarm can be held until a gate is opened.
+    """
+
+    def __init__(self, name, log):
+        Task.__init__(self, task_name=name)
+        self.log = log
+        self.gate = Event()
+        self.gate.set()
+        self.fail = False
+
+    def init_task(self, context):
+        pass
+
+    def poll_task(self, context, tick):
+        pass
+
+    def prewarm(self, context):
+        self.gate.wait()
+        if self.fail:
+            raise RuntimeError('Camera not found')
+        self.log.append(('prewarm', self.task_name, context.timestamp))
+
+    def release(self, context):
+        self.log.append(('release', self.task_name, context.timestamp))
+
+
+class TestTaskPrewarmer(unittest.TestCase):
+
+    def setUp(self):
+        self.log = []
+        self.prewarmer = TaskPrewarmer(settle_time=0.5, idle_timeout=30.0)
+        self.a = WarmingTask('a', self.log)
+        self.b = WarmingTask('b', self.log)
+
+    def _select(self, task, timestamp):
+        self.prewarmer.select(task, FakeContext(timestamp))
+
+    def _wait_idle(self):
+        for _ in range(1000):
+            with self.prewarmer.condition:
+                if not self.prewarmer.actions and not self.prewarmer.busy:
+                    return
+            sleep(0.001)
+        self.fail('Prewarmer never finished')
+
+    def test_prewarmed_once_settled(self):
+        for timestamp in [0.0, 0.2, 0.4]:
+            self._select(self.a, timestamp)
+        self._wait_idle()
+        self.assertEqual(self.log, [])
+        for timestamp in [0.5, 0.6, 1.0]:
+            self._select(self.a, timestamp)
+        self._wait_idle()
+        self.assertEqual(self.log, [('prewarm', 'a', 0.5)])
+        self.assertIs(self.prewarmer.warm_task, self.a)
+
+    def test_changing_selection_releases(self):
+        self._select(self.a, 0.0)
+        self._select(self.a, 0.5)
+        self._select(self.b, 0.6)
+        self._select(self.b, 1.1)
+        self._wait_idle()
+        self.assertEqual(self.log, [('prewarm', 'a', 0.5), ('release', 'a', 0.6), ('prewarm', 'b', 1.1)])
+        self.assertEqual((self.prewarmer.prewarms, self.prewarmer.releases), (2, 1))
+
+    def test_idle_timeout_releases(self):
+        self._select(self.a, 0.0)
+        self._select(self.a, 0.5)
+        self._select(self.a, 30.0)
+        self._select(self.a, 60.0)
+        self._wait_idle()
+        # Not prewarmed again until it's selected afresh
+        self.assertEqual(self.log, [('prewarm', 'a', 0.5), ('release', 'a', 30.0)])
+        self._select(self.b, 61.0)
+        self._select(self.a, 62.0)
+        self._select(self.a, 62.5)
+        self._wait_idle()
+        self.assertEqual(self.log[-1], ('prewarm', 'a', 62.5))
+
+    def test_claim_waits_for_prewarm(self):
+        self.a.gate.clear()
+        self._select(self.a, 0.0)
+        self._select(self.a, 0.5)
+        handover = self.prewarmer.claim(self.a)
+        # Claiming doesn't wait, the handover is set once the prewarm is done
+        self.assertFalse(handover.is_set())
+        self.a.gate.set()
+        self.assertTrue(handover.wait(1.0))
+        self.assertEqual(self.log, [('prewarm', 'a', 0.5)])
+        # The task now owns its resources, so leaving the menu doesn't release them
+        self.prewarmer.reset(FakeContext(1.0))
+        self._wait_idle()
+        self.assertEqual(self.log, [('prewarm', 'a', 0.5)])
+
+    def test_claim_with_nothing_pending(self):
+        self.assertTrue(self.prewarmer.claim(self.a).is_set())
+
+    def test_claim_other_task_leaves_warm(self):
+        self._select(self.a, 0.0)
+        self._select(self.a, 0.5)
+        self.assertTrue(self.prewarmer.claim(self.b).wait(1.0))
+        self.assertIs(self.prewarmer.warm_task, self.a)
+        self.prewarmer.reset(FakeContext(1.0))
+        self._wait_idle()
+        self.assertEqual(self.log[-1], ('release', 'a', 1.0))
+
+    def test_failed_prewarm_keeps_worker(self):
+        self.a.fail = True
+        # The worker prints the failure's traceback
+        stderr = sys.stderr
+        sys.stderr = NullStream()
+        try:
+            self._select(self.a, 0.0)
+            self._select(self.a, 0.5)
+            self._select(self.b, 0.6)
+            self._select(self.b, 1.1)
+            self._wait_idle()
+        finally:
+            sys.stderr = stderr
+        self.assertEqual(self.log, [('release', 'a', 0.6), ('prewarm', 'b', 1.1)])
+
+
+if __name__ == '__main__':
+    unittest.main()
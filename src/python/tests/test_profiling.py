@@ -0,0 +1,122 @@
+import unittest
+from StringIO import StringIO
+
+from approxeng.viridia.clock import VirtualClock
+from approxeng.viridia.profiling import LatencyHistogram, TickProfiler
+
+
+class MenuTask:
+    pass
+
+
+class DriveTask:
+    pass
+
+
+class SlowI2C:
+    """
+    I2C helper which takes a fixed time, on a virtual clock, for every transaction
+    """
+
+    def __init__(self, clock, latency):
+        self.clock = clock
+        self.latency = latency
+
+    def send(self, address, *sequence):
+        self.clock.advance(self.latency)
+
+    def read(self, address, format_string):
+        self.clock.advance(self.latency)
+        return [0]
+
+
+class TestLatencyHistogram(unittest.TestCase):
+
+    def test_empty(self):
+        histogram = LatencyHistogram(window=10)
+        self.assertEqual(histogram.percentile(50), None)
+        self.assertEqual(histogram.summary(), {'count': 0, 'p50': None, 'p99': None, 'max': None})
+
+    def test_percentiles(self):
+        histogram = LatencyHistogram(window=100)
+        for value in range(100):
+            histogram.add(value / 1000.0)
+        summary = histogram.summary()
+        self.assertEqual(summary['count'], 100)
+        self.assertAlmostEqual(summary['p50'], 0.05)
+        self.assertAlmostEqual(summary['p99'], 0.099)
+        self.assertAlmostEqual(summary['max'], 0.099)
+        self.assertAlmostEqual(histogram.percentile(10), 0.01)
+
+    def test_only_window_retained(self):
+        histogram = LatencyHistogram(window=10)
+        for value in range(100):
+            histogram.add(float(value))
+        summary = histogram.summary()
+        self.assertEqual(summary['count'], 100)
+        self.assertEqual(histogram.percentile(0), 90.0)
+        self.assertEqual(summary['max'], 99.0)
+
+
+class TestTickProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = VirtualClock()
+        self.profiler = TickProfiler(window=100, clock=self.clock)
+
+    def _tick(self, task, poll_time, i2c=None):
+        self.profiler.start_tick(task)
+        self.profiler.start('context')
+        self.clock.advance(0.001)
+        self.profiler.stop()
+        self.profiler.start('poll')
+        if i2c is not None:
+            i2c.send(0x61, 0, 1.0)
+        self.clock.advance(poll_time)
+        self.profiler.stop()
+        self.profiler.end_tick()
+
+    def test_phases_per_task_class(self):
+        for _ in range(10):
+            self._tick(MenuTask(), poll_time=0.002)
+            self._tick(DriveTask(), poll_time=0.005)
+        summary = self.profiler.summary()
+        self.assertEqual(set(summary), {'MenuTask', 'DriveTask'})
+        self.assertEqual(summary['MenuTask']['poll']['count'], 10)
+        self.assertAlmostEqual(summary['MenuTask']['poll']['max'], 0.002)
+        self.assertAlmostEqual(summary['DriveTask']['poll']['max'], 0.005)
+        self.assertAlmostEqual(summary['DriveTask']['context']['max'], 0.001)
+        self.assertAlmostEqual(summary['DriveTask']['tick']['max'], 0.006)
+        # Phases which weren't timed are left out
+        self.assertNotIn('init', summary['MenuTask'])
+
+    def test_instrumented_i2c_time(self):
+        i2c = self.profiler.instrument(SlowI2C(clock=self.clock, latency=0.0005))
+        self._tick(DriveTask(), poll_time=0.002, i2c=i2c)
+        summary = self.profiler.summary()['DriveTask']
+        self.assertAlmostEqual(summary['i2c']['max'], 0.0005)
+        # I2C time is part of the phase it happened in
+        self.assertAlmostEqual(summary['poll']['max'], 0.0025)
+        # and doesn't carry over into the next tick
+        self._tick(DriveTask(), poll_time=0.002)
+        self.assertAlmostEqual(self.profiler.histograms['DriveTask']['i2c'].percentile(0), 0.0)
+
+    def test_record_external_phase(self):
+        self.profiler.start_tick(DriveTask())
+        self.profiler.record('buttons', 0.0002)
+        self.profiler.end_tick()
+        self.assertAlmostEqual(self.profiler.summary()['DriveTask']['buttons']['max'], 0.0002)
+
+    def test_dump(self):
+        self._tick(DriveTask(), poll_time=0.005)
+        stream = StringIO()
+        self.profiler.dump(stream)
+        lines = stream.getvalue().splitlines()
+        self.assertTrue(lines[0].startswith('task'))
+        poll = [line for line in lines if line.startswith('DriveTask') and ' poll ' in line]
+        self.assertEqual(len(poll), 1)
+        self.assertIn('5.000', poll[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import unittest
+
+from approxeng.viridia.clock import VirtualClock
+from approxeng.viridia.motors import Motors
+from approxeng.viridia.registers import ShadowRegisters
+
+
+class RecordingI2C:
+    """
+    Records every send, and can be told to fail the next one
+    """
+
+    def __init__(self):
+        self.sent = []
+        self.fail = False
+
+    def send(self, address, *sequence):
+        if self.fail:
+            self.fail = False
+            raise IOError('Simulated bus error')
+        self.sent.append((address, sequence))
+
+    def read(self, address, format_string):
+        return [0.0]
+
+
+class TestShadowRegisters(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = VirtualClock()
+        self.registers = ShadowRegisters(keepalive=1.0, clock=self.clock)
+
+    def test_unchanged_write_skipped(self):
+        self.assertTrue(self.registers.should_write(0x61, 'enable', (1,)))
+        self.assertFalse(self.registers.should_write(0x61, 'enable', (1,)))
+        self.assertTrue(self.registers.should_write(0x61, 'enable', (2,)))
+        # Registers are per device
+        self.assertTrue(self.registers.should_write(0x62, 'enable', (2,)))
+        self.assertEqual(self.registers.statistics(),
+                         {0x61: {'writes': 2, 'saved': 1}, 0x62: {'writes': 1, 'saved': 0}})
+
+    def test_tolerance(self):
+        self.assertTrue(self.registers.should_write(0x61, 'speed', (0, 10.0), tolerance=0.1))
+        self.assertFalse(self.registers.should_write(0x61, 'speed', (0, 10.05), tolerance=0.1))
+        # Compared against the value last sent, not the last requested, so small changes can't creep
+        self.assertFalse(self.registers.should_write(0x61, 'speed', (0, 9.95), tolerance=0.1))
+        self.assertTrue(self.registers.should_write(0x61, 'speed', (0, 10.2), tolerance=0.1))
+
+    def test_keepalive(self):
+        self.assertTrue(self.registers.should_write(0x61, 'enable', (1,)))
+        self.clock.advance(0.9)
+        self.assertFalse(self.registers.should_write(0x61, 'enable', (1,)))
+        self.clock.advance(0.2)
+        self.assertTrue(self.registers.should_write(0x61, 'enable', (1,)))
+
+    def test_invalidate(self):
+        for address in [0x61, 0x62]:
+            for register in ['enable', 'speed']:
+                self.registers.should_write(address, register, (1,))
+        self.registers.invalidate(0x61, 'enable')
+        self.assertTrue(self.registers.should_write(0x61, 'enable', (1,)))
+        self.assertFalse(self.registers.should_write(0x61, 'speed', (1,)))
+        self.registers.invalidate(0x62)
+        self.assertTrue(self.registers.should_write(0x62, 'enable', (1,)))
+        self.assertTrue(self.registers.should_write(0x62, 'speed', (1,)))
+        self.registers.invalidate()
+        self.assertTrue(self.registers.should_write(0x61, 'speed', (1,)))
+        # Nothing to forget is fine
+        self.registers.invalidate(0x63, 'enable')
+
+    def test_motors_skip_unchanged_speeds(self):
+        i2c = RecordingI2C()
+        motors = Motors(i2c=i2c, registers=self.registers, speed_tolerance=0.1)
+        motors.set_speeds([10.0, 20.0, 30.0])
+        motors.set_speeds([10.05, 20.0, 31.0])
+        self.assertEqual(i2c.sent, [(0x61, (0, 10.0)), (0x62, (0, 20.0)), (0x63, (0, 30.0)), (0x63, (0, 31.0))])
+
+    def test_failed_write_sent_again(self):
+        i2c = RecordingI2C()
+        motors = Motors(i2c=i2c, registers=self.registers)
+        i2c.fail = True
+        self.assertRaises(IOError, motors.enable_motor, 0)
+        motors.enable_motor(0)
+        self.assertEqual(i2c.sent, [(0x61, (1,))])
+
+    def test_direct_disable_invalidates_enable(self):
+        i2c = RecordingI2C()
+        motors = Motors(i2c=i2c, registers=self.registers)
+        motors.enable()
+        raw = RecordingI2C()
+        motors.disable_direct(raw)
+        self.assertEqual(raw.sent, [(0x61, (2,)), (0x62, (2,)), (0x63, (2,))])
+        # The shadow copy still said enabled, so without invalidation this would have been skipped
+        motors.enable()
+        self.assertEqual(len(i2c.sent), 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,226 @@
+import unittest
+from threading import Timer
+
+from approxeng.viridia.benchmark import SimulatedSystem
+from approxeng.viridia.clock import VirtualClock
+from approxeng.viridia.runtime import Call, Cancelled, CoroutineTask, Future, PolledCoroutine, Runtime, Sleep, \
+    TickSource, periodic
+from approxeng.viridia.simulation import ScriptedJoystick
+from approxeng.viridia.task import Task
+
+
+class FakeContext:
+
+    def __init__(self, timestamp):
+        self.timestamp = timestamp
+
+
+class TestRuntime(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = VirtualClock()
+        self.runtime = Runtime(workers=0, clock=self.clock)
+        self.log = []
+
+    def tearDown(self):
+        self.runtime.shutdown()
+
+    def _sleeper(self, name, interval, count):
+        for _ in range(count):
+            yield Sleep(interval)
+            self.log.append((name, self.clock.time()))
+
+    def test_sleeps_interleave_on_virtual_clock(self):
+        self.runtime.spawn(self._sleeper('a', 0.3, 2))
+        self.runtime.spawn(self._sleeper('b', 0.25, 3))
+        self.runtime.run()
+        self.assertEqual([name for name, _ in self.log], ['b', 'a', 'b', 'a', 'b'])
+        for (_, when), expected in zip(self.log, [0.25, 0.3, 0.5, 0.6, 0.75]):
+            self.assertAlmostEqual(when, expected)
+
+    def test_wait_for_coroutine_and_call(self):
+        def child():
+            yield Sleep(1.0)
+            self.log.append('child')
+
+        def parent():
+            yield self.runtime.spawn(child())
+            value = yield Call(lambda a, b: a + b, 2, b=3)
+            self.log.append(value)
+            try:
+                yield Call(int, 'not a number')
+            except ValueError:
+                self.log.append('raised')
+
+        self.assertIsNone(self.runtime.run(until=self.runtime.spawn(parent())))
+        self.assertEqual(self.log, ['child', 5, 'raised'])
+
+    def test_bad_yield_raised_into_coroutine(self):
+        def coroutine():
+            try:
+                yield 'something'
+            except TypeError:
+                self.log.append('raised')
+
+        self.runtime.run(until=self.runtime.spawn(coroutine()))
+        self.assertEqual(self.log, ['raised'])
+
+    def test_errors_end_coroutine(self):
+        def failing():
+            yield None
+            raise KeyError('oops')
+
+        coroutine = self.runtime.spawn(failing(), name='failing')
+        self.assertRaises(KeyError, self.runtime.run, coroutine)
+        self.assertEqual(self.runtime.errors[0][0], 'failing')
+        self.assertEqual(self.runtime.coroutines, [])
+
+    def test_cancel_runs_finally(self):
+        def waiting():
+            try:
+                yield Sleep(10.0)
+            finally:
+                self.log.append('finally')
+
+        coroutine = self.runtime.spawn(waiting())
+        self.runtime._run_ready()
+        coroutine.cancel()
+        self.assertEqual(self.log, ['finally'])
+        self.assertRaises(Cancelled, coroutine.future.result)
+
+    def test_future_from_another_thread(self):
+        runtime = Runtime(workers=1)
+        future = Future()
+
+        def waiting():
+            value = yield future
+            self.log.append(value)
+
+        Timer(0.05, future.set_result, ['done']).start()
+        try:
+            runtime.run(until=runtime.spawn(waiting()))
+        finally:
+            runtime.shutdown()
+        self.assertEqual(self.log, ['done'])
+
+    def test_call_on_worker(self):
+        runtime = Runtime(workers=1)
+
+        def calling():
+            value = yield Call(lambda: 'from worker')
+            self.log.append(value)
+
+        try:
+            runtime.run(until=runtime.spawn(calling()))
+        finally:
+            runtime.shutdown()
+        self.assertEqual(self.log, ['from worker'])
+
+    def test_stepped(self):
+        def stepped():
+            while True:
+                self.log.append(self.clock.time())
+                yield None
+
+        coroutine = self.runtime.spawn(stepped(), stepped=True)
+        self.runtime._run_ready()
+        # Held by the loop until stepped
+        self.assertEqual(self.log, [])
+        self.runtime.step(coroutine)
+        self.clock.advance(1.0)
+        self.runtime.step(coroutine)
+        self.assertEqual(self.log, [0.0, 1.0])
+
+    def test_periodic(self):
+        calls = []
+        self.runtime.spawn(periodic(lambda: calls.append(self.clock.time()), interval=0.1, clock=self.clock))
+
+        def stop_after(seconds):
+            yield Sleep(seconds)
+            self.runtime.stop()
+
+        self.runtime.spawn(stop_after(0.45))
+        self.runtime.run()
+        self.assertEqual(len(calls), 5)
+        for index, when in enumerate(calls):
+            self.assertAlmostEqual(when, index * 0.1)
+
+
+class TestPolledCoroutine(unittest.TestCase):
+
+    def test_sleeps_against_context_timestamps(self):
+        log = []
+        ticks = TickSource()
+
+        def coroutine():
+            log.append('start')
+            yield Sleep(0.05)
+            log.append((yield Call(lambda: 'called')))
+            context = yield ticks.next_tick()
+            log.append(context.timestamp)
+
+        polled = PolledCoroutine(generator=coroutine(), ticks=ticks)
+        self.assertFalse(polled.poll(FakeContext(0.0)))
+        self.assertFalse(polled.poll(FakeContext(0.02)))
+        self.assertFalse(polled.poll(FakeContext(0.04)))
+        self.assertEqual(log, ['start'])
+        self.assertFalse(polled.poll(FakeContext(0.06)))
+        self.assertEqual(log, ['start', 'called'])
+        self.assertTrue(polled.poll(FakeContext(0.08)))
+        self.assertEqual(log, ['start', 'called', 0.08])
+
+
+class CountingTask(CoroutineTask):
+    """
+    Sleeps, then records the timestamps of a few ticks before switching to the next task
+    """
+
+    def __init__(self, next_task):
+        super(CountingTask, self).__init__(task_name='Counting')
+        self.following_task = next_task
+        self.timestamps = []
+
+    def run(self, context, ticks):
+        yield Sleep(0.1)
+        for _ in range(3):
+            context = yield ticks.next_tick()
+            self.timestamps.append(context.timestamp)
+        self.next_task = self.following_task
+
+
+class StopTask(Task):
+
+    def __init__(self, task_manager):
+        Task.__init__(self, task_name='Stop')
+        self.task_manager = task_manager
+
+    def init_task(self, context):
+        pass
+
+    def poll_task(self, context, tick):
+        self.task_manager.stop()
+
+
+class TestRuntimeTaskManager(unittest.TestCase):
+
+    def test_coroutine_task_on_virtual_clock(self):
+        clock = VirtualClock()
+        system = SimulatedSystem(joystick=ScriptedJoystick(clock=clock.time), tick_rate=50, clock=clock,
+                                 runtime=Runtime(workers=0, clock=clock))
+        try:
+            task_manager = system.task_manager
+            task = CountingTask(next_task=StopTask(task_manager))
+            task_manager.run(initial_task=task)
+        finally:
+            system.close()
+        # Initialised on the first tick, at time zero, the sleep ends on the tick at 0.1, then it waits for the next
+        self.assertEqual(len(task.timestamps), 3)
+        self.assertAlmostEqual(task.timestamps[0], 0.12)
+        for previous, timestamp in zip(task.timestamps, task.timestamps[1:]):
+            self.assertAlmostEqual(timestamp - previous, 0.02)
+        # The odometry service ran alongside the task loop
+        self.assertGreater(len(system.odometry.samples_since(-1)), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from approxeng.viridia.benchmark import SimulatedSystem
+from approxeng.viridia.clock import VirtualClock
+from approxeng.viridia.simulation import ScriptedButtonPresses, ScriptedJoystick
+from approxeng.viridia.tasks.manual_control import ManualMotionTask
+from approxeng.viridia.telemetry import TelemetryLog, TelemetryRecorder, TelemetryReplay
+
+
+class FakePosition:
+
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+
+class FakePose:
+
+    def __init__(self, x, y, orientation):
+        self.position = FakePosition(x, y)
+        self.orientation = orientation
+
+
+class FakeObject:
+    """
+    Holds whatever attributes it's created with, used for the parts of the context the recorder reads
+    """
+
+    def __init__(self, **attributes):
+        self.__dict__.update(attributes)
+
+
+class RecordedTask:
+    pass
+
+
+def fake_context(axes, buttons, wheel_speeds, angles, pose):
+    return FakeObject(joystick=FakeObject(get_axis_value=lambda sname: axes.get(sname, 0.0)),
+                      buttons_pressed=ScriptedButtonPresses(frozenset(buttons)),
+                      odometry=None,
+                      motors=FakeObject(last_angles=angles),
+                      drive=FakeObject(wheel_speeds=wheel_speeds, dead_reckoning=FakeObject(pose=FakePose(*pose))))
+
+
+class TestTelemetryLog(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'telemetry.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        recorder = TelemetryRecorder(path=self.path, capacity=10)
+        recorder.record(timestamp=12.5, tick=3, task=RecordedTask(),
+                        context=fake_context(axes={'lx': 0.5, 'ry': -0.25}, buttons=['cross', 'r2'],
+                                             wheel_speeds=[10.0, -20.5, 30.25], angles=[1.125, 2.0, -3.5],
+                                             pose=(100.0, -50.0, 1.5)))
+        # No angles read yet, recorded as zeros
+        recorder.record(timestamp=12.52, tick=4, task=RecordedTask(),
+                        context=fake_context(axes={}, buttons=[], wheel_speeds=[0.0, 0.0, 0.0], angles=None,
+                                             pose=(0.0, 0.0, 0.0)))
+        log = TelemetryLog(self.path)
+        try:
+            # Readable while still being written
+            self.assertEqual(len(log), 2)
+            record = log[0]
+            self.assertEqual((record.timestamp, record.tick, record.task), (12.5, 3, 'RecordedTask'))
+            self.assertEqual(record.axes, (0.5, 0.0, 0.0, -0.25))
+            self.assertEqual(record.buttons, frozenset(['cross', 'r2']))
+            self.assertEqual(record.wheel_speeds, (10.0, -20.5, 30.25))
+            self.assertEqual(record.angles, (1.125, 2.0, -3.5))
+            self.assertEqual(record.pose, (100.0, -50.0, 1.5))
+            self.assertEqual(log[-1].angles, (0.0, 0.0, 0.0))
+            self.assertEqual([record.tick for record in log], [3, 4])
+            self.assertRaises(IndexError, log.__getitem__, 2)
+        finally:
+            log.close()
+            recorder.close()
+
+    def test_full_log_drops_records(self):
+        recorder = TelemetryRecorder(path=self.path, capacity=2)
+        for tick in range(5):
+            recorder.record(timestamp=tick * 0.02, tick=tick, task=RecordedTask(),
+                            context=fake_context(axes={}, buttons=[], wheel_speeds=[0.0, 0.0, 0.0],
+                                                 angles=[0.0, 0.0, 0.0], pose=(0.0, 0.0, 0.0)))
+        recorder.close()
+        self.assertEqual(recorder.dropped, 3)
+        log = TelemetryLog(self.path)
+        try:
+            self.assertEqual([record.tick for record in log], [0, 1])
+        finally:
+            log.close()
+
+    def test_not_a_log(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'\0' * 64)
+        self.assertRaises(ValueError, TelemetryLog, self.path)
+
+
+class TestTelemetryReplay(unittest.TestCase):
+    """
+    Records manual driving on the simulated robot, then replays the log through a new task, which should command the
+    same wheel speeds and end up in the same place
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'telemetry.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _record(self, ticks):
+        clock = VirtualClock()
+        joystick = ScriptedJoystick(script=[(0.0, {'ly': 0.5}, None), (0.5, {'lx': 0.3, 'rx': -0.4}, None),
+                                            (1.0, {'ly': 0.0}, ['cross'])], clock=clock.time)
+        system = SimulatedSystem(joystick=joystick, odometry=False, clock=clock)
+        recorder = TelemetryRecorder(path=self.path, capacity=ticks)
+        try:
+            task_manager = system.task_manager
+            task_manager.recorder = recorder
+            task_manager._start(ManualMotionTask())
+            for _ in range(ticks):
+                task_manager._run_tick()
+                clock.advance(0.02)
+        finally:
+            recorder.close()
+            system.close()
+        return task_manager.chassis
+
+    def test_replay_matches_recording(self):
+        chassis = self._record(ticks=75)
+        log = TelemetryLog(self.path)
+        replay = TelemetryReplay(log=log, chassis=chassis, use_odometry=False)
+        try:
+            # The first tick initialises the task, so isn't recorded
+            self.assertEqual(len(log), 74)
+            result = replay.run(task=ManualMotionTask(), task_name='ManualMotionTask')
+        finally:
+            replay.close()
+            log.close()
+        self.assertEqual(result['ticks'], 74)
+        self.assertEqual(result['mismatches'], 0)
+        self.assertLess(result['max_speed_error'], 0.01)
+        self.assertLess(result['position_error'], 0.1)
+        self.assertLess(result['orientation_error'], 0.001)
+
+    def test_nothing_replayed(self):
+        chassis = self._record(ticks=5)
+        log = TelemetryLog(self.path)
+        replay = TelemetryReplay(log=log, chassis=chassis)
+        try:
+            result = replay.run(task=ManualMotionTask(), task_name='SomeOtherTask')
+        finally:
+            replay.close()
+            log.close()
+        self.assertEqual(result['ticks'], 0)
+        self.assertIsNone(result['pose'])
+        self.assertIsNone(result['position_error'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import os
+import shutil
+import tempfile
+import unittest
+from time import sleep
+
+from approxeng.viridia.clock import VirtualClock
+from approxeng.viridia.telemetry import TelemetryPublisher, TelemetrySubscriber, decode_published
+
+
+class FakePosition:
+
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+
+class FakePose:
+
+    def __init__(self, x, y, orientation):
+        self.position = FakePosition(x, y)
+        self.orientation = orientation
+
+
+class FakeObject:
+    """
+    Holds whatever attributes it's created with, used for the parts of the context the publisher reads
+    """
+
+    def __init__(self, **attributes):
+        self.__dict__.update(attributes)
+
+
+class PublishedTask:
+    task_name = 'Manual motion'
+
+
+class TestTelemetryStream(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'telemetry.sock')
+        self.clock = VirtualClock()
+        self.context = FakeObject(clock=self.clock, odometry=None, motors=FakeObject(last_angles=[1.5, 2.5, -0.5]),
+                                  drive=FakeObject(wheel_speeds=[10.0, -20.0, 30.0],
+                                                   dead_reckoning=FakeObject(pose=FakePose(100.0, -50.0, 0.5))))
+        self.publisher = None
+        self.subscriber = None
+
+    def tearDown(self):
+        if self.publisher is not None:
+            self.publisher.stop()
+        if self.subscriber is not None:
+            self.subscriber.close()
+        shutil.rmtree(self.directory)
+
+    def _record(self, tick, poll_time=0.0):
+        timestamp = self.clock.time()
+        self.clock.advance(poll_time)
+        self.publisher.record(timestamp=timestamp, tick=tick, task=PublishedTask(), context=self.context)
+
+    def test_published_to_subscriber(self):
+        self.subscriber = TelemetrySubscriber(address=self.path, timeout=1.0)
+        self.publisher = TelemetryPublisher(address=self.path, rate=20).start()
+        self.clock.advance(10.0)
+        self._record(tick=7, poll_time=0.25)
+        record = self.subscriber.receive()
+        self.assertEqual((record.timestamp, record.tick, record.period, record.poll_time, record.task),
+                         (10.0, 7, 0.0, 0.25, 'Manual motion'))
+        self.assertEqual(record.wheel_speeds, (10.0, -20.0, 30.0))
+        self.assertEqual(record.angles, (1.5, 2.5, -0.5))
+        self.assertEqual(record.pose, (100.0, -50.0, 0.5))
+
+    def test_udp(self):
+        self.subscriber = TelemetrySubscriber(address=('127.0.0.1', 0), timeout=1.0)
+        address = self.subscriber.socket.getsockname()
+        self.publisher = TelemetryPublisher(address=address).start()
+        self._record(tick=1)
+        self.assertEqual(self.subscriber.receive().tick, 1)
+
+    def test_rate_limited(self):
+        self.publisher = TelemetryPublisher(address=self.path, rate=20)
+        for tick in range(10):
+            self._record(tick=tick)
+            self.clock.advance(0.02)
+        # Published at 0, 0.06, 0.12 and 0.18
+        self.assertEqual([self.publisher.slots[index][1] for index in range(self.publisher.head)], [0, 3, 6, 9])
+        # Periods are between ticks, whether or not they were published
+        self.assertAlmostEqual(self.publisher.slots[1][2], 0.02)
+
+    def test_full_ring_drops(self):
+        self.publisher = TelemetryPublisher(address=self.path, rate=1000, capacity=4)
+        for tick in range(6):
+            self._record(tick=tick)
+            self.clock.advance(0.01)
+        self.assertEqual(self.publisher.head, 4)
+        self.assertEqual(self.publisher.dropped, 2)
+
+    def test_no_listener(self):
+        self.publisher = TelemetryPublisher(address=self.path, rate=100).start()
+        self._record(tick=0)
+        for _ in range(100):
+            if self.publisher.errors > 0:
+                break
+            sleep(0.01)
+        self.assertEqual((self.publisher.sent, self.publisher.errors), (0, 1))
+
+    def test_decode_rejects_other_data(self):
+        self.assertRaises(ValueError, decode_published, b'\x01')
+        # Too short for three wheels, then the right length but an unknown version
+        self.assertRaises(ValueError, decode_published, b'\x01\x03' + b'\0' * 10)
+        self.assertRaises(ValueError, decode_published, b'\x09\x03' + b'\0' * 92)
+
+    def test_subscriber_timeout(self):
+        self.subscriber = TelemetrySubscriber(address=self.path, timeout=0.01)
+        self.assertIsNone(self.subscriber.receive())
+
+
+if __name__ == '__main__':
+    unittest.main()
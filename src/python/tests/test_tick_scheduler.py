@@ -0,0 +1,76 @@
+import unittest
+
+from approxeng.viridia.clock import VirtualClock
+from approxeng.viridia.task import TickScheduler
+
+
+class TestTickScheduler(unittest.TestCase):
+    """
+    Runs the scheduler on a virtual clock, with each tick's work modelled by advancing the clock
+    """
+
+    def setUp(self):
+        self.clock = VirtualClock()
+        self.scheduler = TickScheduler(rate=50, clock=self.clock)
+        self.scheduler.start_tick()
+
+    def _tick(self, work):
+        self.clock.advance(work)
+        self.scheduler.wait()
+        return self.clock.time()
+
+    def test_fixed_rate_without_drift(self):
+        starts = [self._tick(work=0.003) for _ in range(100)]
+        for previous, start in zip(starts, starts[1:]):
+            self.assertAlmostEqual(start - previous, 0.02, places=9)
+        self.assertEqual(self.scheduler.ticks, 100)
+        self.assertEqual(self.scheduler.missed_deadlines, 0)
+        self.assertEqual(self.scheduler.overruns, 0)
+
+    def test_overrun_re_anchors_without_catching_up(self):
+        self._tick(work=0.003)
+        late = self._tick(work=0.05)
+        self.assertEqual(self.scheduler.missed_deadlines, 1)
+        self.assertEqual(self.scheduler.overruns, 1)
+        # The next tick gets a full period from the late one, rather than starting straight away to catch up
+        self.assertAlmostEqual(self._tick(work=0.003) - late, 0.02, places=9)
+        self.assertEqual(self.scheduler.missed_deadlines, 1)
+
+    def test_late_wake_is_missed_deadline_not_overrun(self):
+        self._tick(work=0.003)
+        self.clock.advance(0.003)
+        delay = self.scheduler.end_tick()
+        # Oversleep past the deadline of the next tick, which then does very little work
+        self.clock.advance(delay + 0.03)
+        self.scheduler.start_tick()
+        self._tick(work=0.001)
+        self.assertEqual(self.scheduler.missed_deadlines, 1)
+        self.assertEqual(self.scheduler.overruns, 0)
+
+    def test_no_rate_never_waits(self):
+        self.scheduler.set_rate(None)
+        self.assertEqual(self.scheduler.rate, None)
+        for _ in range(10):
+            self.clock.advance(0.001)
+            self.assertEqual(self.scheduler.end_tick(), 0.0)
+            self.scheduler.start_tick()
+        self.assertEqual(self.scheduler.missed_deadlines, 0)
+
+    def test_rate_change_is_not_missed_deadline(self):
+        self._tick(work=0.003)
+        self._tick(work=0.003)
+        self.scheduler.set_rate(10)
+        self.assertAlmostEqual(self.scheduler.rate, 10)
+        first = self._tick(work=0.003)
+        self.assertAlmostEqual(self._tick(work=0.003) - first, 0.1, places=9)
+        self.assertEqual(self.scheduler.missed_deadlines, 0)
+
+    def test_same_rate_keeps_schedule(self):
+        self._tick(work=0.003)
+        start = self._tick(work=0.003)
+        self.scheduler.set_rate(50)
+        self.assertAlmostEqual(self._tick(work=0.003) - start, 0.02, places=9)
+
+
+if __name__ == '__main__':
+    unittest.main()
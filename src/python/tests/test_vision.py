@@ -0,0 +1,153 @@
+import unittest
+
+import numpy as np
+
+from approxeng.viridia.vision import BandLineFinder, MultiBandLineFinder
+
+
+def blank(height=64, width=64):
+    return np.full((height, width), 200, dtype=np.uint8)
+
+
+class TestBandLineFinder(unittest.TestCase):
+
+    def setUp(self):
+        self.finder = BandLineFinder(scan_region_height=20, min_detection_area=10)
+
+    def test_no_lines(self):
+        self.assertEqual(self.finder(blank()), [])
+        self.assertFalse(BandLineFinder.found([]))
+
+    def test_line_positions(self):
+        image = blank()
+        # Centred on column 31.5, the middle of the image, and on column 3.5, near the left
+        image[:, 28:36] = 20
+        image[:, 2:6] = 20
+        lines = self.finder(image)
+        self.assertEqual(len(lines), 2)
+        self.assertAlmostEqual(lines[0], 4.0 * 2 / 64 - 1)
+        self.assertAlmostEqual(lines[1], 0.0)
+        self.assertTrue(BandLineFinder.found(lines))
+
+    def test_line_at_edge(self):
+        image = blank()
+        image[:, 60:] = 20
+        self.assertAlmostEqual(self.finder(image)[0], 62.0 * 2 / 64 - 1)
+
+    def test_invert(self):
+        image = blank()
+        image[:, 2:6] = 20
+        finder = BandLineFinder(scan_region_height=20, min_detection_area=10, invert=True)
+        self.assertAlmostEqual(finder(image)[0], -self.finder(image)[0])
+
+    def test_only_band_scanned(self):
+        image = blank()
+        image[30:, 10:20] = 20
+        self.assertEqual(self.finder(image), [])
+        bottom = BandLineFinder(scan_region_height=20, scan_region_position=1.0, min_detection_area=10)
+        self.assertEqual(len(bottom(image)), 1)
+
+    def test_small_features_ignored(self):
+        image = blank()
+        image[0:2, 10:12] = 20
+        image[:, 40:44] = 20
+        self.assertEqual(len(self.finder(image)), 1)
+
+    def test_width_pad(self):
+        image = blank()
+        image[:, 2:6] = 20
+        image[:, 28:36] = 20
+        finder = BandLineFinder(scan_region_height=20, scan_region_width_pad=8, min_detection_area=10)
+        # The line at the left is cut off, and positions are relative to the 48 pixels remaining
+        lines = finder(image)
+        self.assertEqual(len(lines), 1)
+        self.assertAlmostEqual(lines[0], 24.0 * 2 / 48 - 1)
+
+    def test_colour_matches_grey(self):
+        image = blank()
+        image[:, 20:26] = 20
+        colour = np.repeat(image[:, :, np.newaxis], 3, axis=2)
+        self.assertEqual(self.finder(colour), self.finder(image))
+
+
+class TestMultiBandLineFinder(unittest.TestCase):
+
+    def setUp(self):
+        # Given furthest first, to check the bands are sorted into order of increasing distance
+        self.bands = [(0.0, 300, 200), (0.5, 200, 160), (1.0, 100, 140)]
+        self.finder = MultiBandLineFinder(bands=self.bands, scan_region_height=10, min_detection_area=10)
+
+    @staticmethod
+    def _draw(image, position, columns):
+        top = int((image.shape[0] - 10) * position)
+        image[top:top + 10, columns[0]:columns[1]] = 20
+
+    def test_bands_match_single_band_finder(self):
+        image = blank()
+        self._draw(image, 1.0, (30, 34))
+        self._draw(image, 0.5, (34, 38))
+        self._draw(image, 0.5, (4, 8))
+        self._draw(image, 0.0, (50, 60))
+        expected = [BandLineFinder(scan_region_height=10, scan_region_position=position, min_detection_area=10)(image)
+                    for position, _, _ in sorted(self.bands, key=lambda band: band[1])]
+        self.assertEqual(self.finder.find_band_lines(image), expected)
+
+    def test_runs_do_not_join_across_bands(self):
+        image = blank()
+        # Each only half the detection area, so they'd be found as a line if the end of the nearest band, at the
+        # bottom of the image, ran into the start of the next band
+        image[54:59, 63] = 20
+        image[27:32, 0] = 20
+        self.assertEqual(self.finder.find_band_lines(image), [[], [], []])
+
+    def test_no_lines(self):
+        result = self.finder(blank())
+        self.assertFalse(result.found)
+        self.assertFalse(MultiBandLineFinder.found(result))
+        self.assertEqual(result.track, [None, None, None])
+        self.assertIsNone(result.x_at(100))
+        self.assertIsNone(result.furthest_distance)
+        self.assertEqual(result.curvature, 0.0)
+
+    def test_single_band(self):
+        image = blank()
+        self._draw(image, 1.0, (30, 34))
+        result = self.finder(image)
+        self.assertTrue(MultiBandLineFinder.found(result))
+        self.assertEqual(result.furthest_distance, 100)
+        self.assertAlmostEqual(result.x_at(300), 0.0)
+        self.assertEqual(result.curvature, 0.0)
+
+    def test_track_through_bends(self):
+        image = blank()
+        self._draw(image, 1.0, (30, 34))
+        self._draw(image, 1.0, (50, 54))
+        self._draw(image, 0.5, (34, 38))
+        self._draw(image, 0.0, (4, 8))
+        self._draw(image, 0.0, (42, 46))
+        result = self.finder(image)
+        # Left-most line in the nearest band, then whichever line is closest to the one before
+        self.assertEqual([len(positions) for positions in result.positions], [2, 1, 2])
+        self.assertAlmostEqual(result.track[0], 0.0)
+        self.assertAlmostEqual(result.track[1], 10.0)
+        self.assertAlmostEqual(result.track[2], result.positions[2][1] * 100)
+        self.assertEqual(result.furthest_distance, 300)
+        for distance, x in zip(result.distances, result.track):
+            self.assertAlmostEqual(result.x_at(distance), x)
+        # Bending further towards positive x with distance
+        self.assertGreater(result.curvature, 0)
+
+    def test_gap_in_track(self):
+        image = blank()
+        self._draw(image, 1.0, (30, 34))
+        self._draw(image, 0.0, (42, 46))
+        result = self.finder(image)
+        self.assertIsNone(result.track[1])
+        self.assertEqual(result.furthest_distance, 300)
+        # Only two points, so a straight line with no curvature
+        self.assertEqual(len(result.coefficients), 2)
+        self.assertEqual(result.curvature, 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
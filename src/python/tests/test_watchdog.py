@@ -0,0 +1,178 @@
+import unittest
+from time import sleep
+
+from approxeng.viridia.benchmark import SimulatedSystem
+from approxeng.viridia.clock import VirtualClock
+from approxeng.viridia.runtime import Runtime
+from approxeng.viridia.simulation import ScriptedJoystick
+from approxeng.viridia.task import Task
+from approxeng.viridia.watchdog import TickWatchdog
+
+
+class FakeMotors:
+
+    def __init__(self):
+        self.disabled = 0
+        self.disabled_direct = []
+
+    def disable(self):
+        self.disabled += 1
+
+    def disable_direct(self, i2c):
+        self.disabled_direct.append(i2c)
+
+
+class FakeBus:
+
+    def __init__(self, available):
+        self.available = available
+        self.held = False
+
+    def acquire_exclusive(self, timeout):
+        self.held = self.available
+        return self.available
+
+    def release_exclusive(self):
+        self.held = False
+
+
+class WatchedTask:
+    pass
+
+
+def wait_for(condition, timeout=1.0):
+    for _ in range(int(timeout / 0.001)):
+        if condition():
+            return True
+        sleep(0.001)
+    return False
+
+
+class TestTickWatchdog(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = VirtualClock()
+        self.motors = FakeMotors()
+        self.watchdog = None
+
+    def tearDown(self):
+        if self.watchdog is not None:
+            self.watchdog.stop()
+
+    def _watchdog(self, **kwargs):
+        self.watchdog = TickWatchdog(motors=self.motors, deadline=0.1, resolution=0.001, clock=self.clock,
+                                     **kwargs).start()
+        return self.watchdog
+
+    def test_tick_within_deadline(self):
+        watchdog = self._watchdog()
+        for _ in range(3):
+            watchdog.arm(WatchedTask())
+            self.clock.advance(0.09)
+            sleep(0.005)
+            watchdog.disarm()
+        self.assertEqual(watchdog.trips, 0)
+        self.assertEqual(self.motors.disabled, 0)
+
+    def test_overrun_disables_motors(self):
+        watchdog = self._watchdog()
+        watchdog.arm(WatchedTask())
+        watchdog.enter_phase('poll')
+        self.clock.advance(0.15)
+        self.assertTrue(wait_for(lambda: watchdog.trips > 0))
+        self.assertEqual(self.motors.disabled, 1)
+        self.assertEqual(list(watchdog.overruns), [(0.0, 'WatchedTask', 'poll', None)])
+        # Only once per tick, however long it runs on
+        self.clock.advance(0.5)
+        sleep(0.01)
+        watchdog.exit_phase()
+        watchdog.disarm()
+        self.assertEqual(watchdog.trips, 1)
+        self.assertAlmostEqual(watchdog.overruns[0].duration, 0.65)
+        self.assertEqual(watchdog.statistics(), {'WatchedTask': {'poll': 1}})
+
+    def test_init_has_no_deadline(self):
+        watchdog = self._watchdog()
+        watchdog.arm(WatchedTask())
+        watchdog.enter_phase('init')
+        self.clock.advance(5.0)
+        sleep(0.01)
+        # The rest of the tick gets a full deadline from the end of the phase
+        watchdog.exit_phase()
+        self.clock.advance(0.05)
+        sleep(0.01)
+        self.assertEqual(watchdog.trips, 0)
+        self.clock.advance(0.1)
+        self.assertTrue(wait_for(lambda: watchdog.trips > 0))
+        self.assertEqual(watchdog.overruns[0].phase, 'tick')
+
+    def test_phase_deadline(self):
+        watchdog = self._watchdog(phase_deadlines={'poll': 0.5})
+        watchdog.arm(WatchedTask())
+        watchdog.enter_phase('poll')
+        self.clock.advance(0.3)
+        sleep(0.01)
+        self.assertEqual(watchdog.trips, 0)
+        self.clock.advance(0.3)
+        self.assertTrue(wait_for(lambda: watchdog.trips > 0))
+
+    def test_disabled_directly_holding_bus(self):
+        bus = FakeBus(available=True)
+        watchdog = self._watchdog(i2c='raw', bus=bus)
+        watchdog.arm(WatchedTask())
+        self.clock.advance(0.2)
+        self.assertTrue(wait_for(lambda: watchdog.trips > 0))
+        self.assertEqual(self.motors.disabled_direct, ['raw'])
+        self.assertEqual(self.motors.disabled, 0)
+        self.assertFalse(bus.held)
+
+    def test_disabled_when_bus_hung(self):
+        watchdog = self._watchdog(i2c='raw', bus=FakeBus(available=False))
+        watchdog.arm(WatchedTask())
+        self.clock.advance(0.2)
+        self.assertTrue(wait_for(lambda: watchdog.trips > 0))
+        self.assertEqual(self.motors.disabled_direct, ['raw'])
+
+
+class StallingTask(Task):
+    """
+    Drives the motors, then on one tick stalls until the watchdog trips
+    """
+
+    def __init__(self, system, stall_tick=5):
+        Task.__init__(self, task_name='Stalling')
+        self.system = system
+        self.stall_tick = stall_tick
+
+    def init_task(self, context):
+        context.motors.enable()
+
+    def poll_task(self, context, tick):
+        if tick == self.stall_tick:
+            context.clock.advance(0.3)
+            wait_for(lambda: self.system.watchdog.trips > 0)
+            self.system.task_manager.stop()
+
+
+class TestWatchdogInTaskLoop(unittest.TestCase):
+
+    def test_stalled_poll_stops_robot(self):
+        clock = VirtualClock()
+        system = SimulatedSystem(joystick=ScriptedJoystick(clock=clock.time), tick_rate=50, clock=clock,
+                                 runtime=Runtime(workers=0, clock=clock))
+        try:
+            system.task_manager.run(initial_task=StallingTask(system))
+            self.assertEqual(system.watchdog.trips, 1)
+            overrun = system.watchdog.overruns[0]
+            self.assertEqual((overrun.task, overrun.phase), ('StallingTask', 'poll'))
+            self.assertAlmostEqual(overrun.duration, 0.3)
+            self.assertFalse(any(motor.enabled for motor in system.robot.motors))
+            # The shadow registers were invalidated, so enabling again reaches the motors
+            system.motors.enable()
+            self.assertTrue(all(motor.enabled for motor in system.robot.motors))
+        finally:
+            system.close()
+
+
+if __name__ == '__main__':
+    unittest.main()